@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+"""
+BlurryFrame
+
+Takes one APS frame out of aedat['data']['frame'] as a float image scaled
+to [0, 1], as mat2gray does in main_video2.m.
+"""
+
+import numpy as np
+
+def BlurryFrame(frame, frameIndex):
+    """
+    The frame is cut down to its xLength x yLength (frames smaller than the
+    largest are padded in the samples array); colour channels, if any, are
+    averaged.
+    """
+
+    samples = frame['samples'][frameIndex]
+    if 'yLength' in frame and 'xLength' in frame:
+        samples = samples[0 : int(frame['yLength'][frameIndex]),
+                          0 : int(frame['xLength'][frameIndex])]
+    blurry = samples.astype(np.float64)
+    if blurry.ndim == 3:
+        blurry = blurry.mean(axis=2)
+    blurry -= blurry.min()
+    if blurry.max() > 0:
+        blurry /= blurry.max()
+    return blurry
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+"""
+DoubleIntegral
+
+The EDI model: a blurry frame B is the mean of the latent frames over its
+exposure, and L(t) = L(f) * exp(c * E(t)), so
+    L(f) = B / mean_t(exp(c * E(t)))
+and the video is L(f) * exp(c * E(t)) at each sample time.
+"""
+
+import numpy as np
+
+def DoubleIntegral(blurry, eventIntegral, delta):
+    """
+    Parameters
+    ----------
+    blurry :
+        the blurry frame, as a float image (e.g. from BlurryFrame).
+    eventIntegral :
+        E at each sample time, from EventIntegral.
+    delta :
+        the contrast threshold c.
+
+    Returns
+    -------
+    :
+        (latentFrame, video): the sharp frame at the reference time, and
+        the (numSamples, height, width) latent frames at the sample times.
+    """
+
+    video = np.multiply(eventIntegral, float(delta), dtype=np.float64)
+    np.exp(video, out=video)
+    latentFrame = blurry / video.mean(axis=0)
+    video *= latentFrame
+    return latentFrame, video
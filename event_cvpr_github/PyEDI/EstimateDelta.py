@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+"""
+EstimateDelta
+
+Chooses the contrast threshold c for a blurry frame, as estdelta does: the
+c whose latent frame has the least TVNorm energy.
+
+The latent frame for c is the blurry frame over the mean over samples of
+exp(c * E), and at most pixels E only takes a few integer values; so, for
+those pixels, the event integral is first reduced to a histogram of the
+samples at which E is each value m + r, m being the least E at the pixel.
+The means for any number of candidate c values are then exp(c * m) times
+the histogram times a table of exp(c * r) - one matrix product, rather than
+an exp over the whole integral for each c. The histogram has as many
+columns as the widest pixel needs, so pixels whose E spans more than half
+as many values as there are samples (e.g. hot pixels) are left out of it,
+and their means are taken directly, as are those of all the pixels when
+none are narrow enough. The candidates lie on a fixed grid of numPoints
+steps over deltaRange, whose exp tables are kept (expTableCache), so frames
+searched over the same grid share them.
+
+The search evaluates numCandidates points spread over the grid at once,
+then numCandidates points around the best of them, and so on down to the
+grid step - the resolution of the Fibonacci search of estdelta, which is
+still available (search='fibonacci'), but which evaluates one c at a time,
+directly on the event integral.
+EstimateDeltas searches several frames at once, on several processes.
+"""
+
+import multiprocessing
+import numpy as np
+from PyEDI.FiboSearch import FiboSearch
+from PyEDI.TVNorm import TVNorm
+
+# The number of c values evaluated at each step of the search
+defaultNumCandidates = 16
+# Latent frames are made for as many candidates at once as fit in this many
+# pixels (or, for pixels whose means are taken directly, samples)
+energyBlockSize = 2 ** 22
+# exp(c * n) tables, by the c values they are for; the cache is emptied when
+# it holds this many
+maxExpTableCacheSize = 32
+expTableCache = {}
+
+def EventIntegralHistogram(eventIntegral, maxCounts=None):
+    """
+    Reduces the event integral to a dict of:
+        numSamples - the number of samples of E
+        histogram - a (numHistogramPixels, R) int32 array, whose element
+            [k, r] is the number of samples at which E is
+            minCounts[k] + r at pixel histogramPixels[k]
+        histogramPixels, minCounts - the (flat) pixels in the histogram,
+            those at which E takes no more than maxCounts values (by
+            default, half the number of samples), and the least E at each
+        directPixels, directIntegral - the other pixels, and the
+            (numSamples, numDirectPixels) E at them
+    """
+
+    numSamples = eventIntegral.shape[0]
+    if maxCounts is None:
+        maxCounts = max(numSamples // 2, 1)
+    eventIntegral = eventIntegral.reshape(numSamples, -1)
+    minCounts = eventIntegral.min(axis=0).astype(np.intp)
+    numCounts = eventIntegral.max(axis=0).astype(np.intp) - minCounts + 1
+    inHistogram = numCounts <= maxCounts
+    histogramPixels = np.flatnonzero(inHistogram)
+    directPixels = np.flatnonzero(~inHistogram)
+
+    numColumns = int(numCounts[histogramPixels].max()) if len(histogramPixels) > 0 else 1
+    bins = eventIntegral[:, histogramPixels].astype(np.intp)
+    bins -= minCounts[histogramPixels]
+    bins += np.arange(len(histogramPixels)) * numColumns
+    histogram = np.bincount(bins.ravel(), minlength=len(histogramPixels) * numColumns)
+    return {'numSamples': numSamples,
+            'histogram': histogram.reshape(len(histogramPixels), numColumns).astype(np.int32),
+            'histogramPixels': histogramPixels,
+            'minCounts': minCounts[histogramPixels],
+            'directPixels': directPixels,
+            'directIntegral': eventIntegral[:, directPixels]}
+
+def ExpTable(deltas, minCount, maxCount):
+    """
+    Returns the table of exp(c * n), for n from minCount to maxCount (rows)
+    and c in deltas (columns). Tables are cached by deltas, and grown to
+    cover the counts asked for.
+    """
+
+    deltas = np.asarray(deltas, np.float64)
+    key = deltas.tostring()
+    tableMinCount = minCount
+    tableMaxCount = maxCount
+    if key in expTableCache:
+        cachedMinCount, table = expTableCache[key]
+        cachedMaxCount = cachedMinCount + len(table) - 1
+        if cachedMinCount <= minCount and maxCount <= cachedMaxCount:
+            return table[minCount - cachedMinCount : maxCount - cachedMinCount + 1]
+        tableMinCount = min(minCount, cachedMinCount)
+        tableMaxCount = max(maxCount, cachedMaxCount)
+    elif len(expTableCache) >= maxExpTableCacheSize:
+        expTableCache.clear()
+    table = np.exp(np.outer(np.arange(tableMinCount, tableMaxCount + 1), deltas))
+    expTableCache[key] = (tableMinCount, table)
+    return table[minCount - tableMinCount : maxCount - tableMinCount + 1]
+
+def LatentFrameEnergy(blurry, eventIntegral, delta, edgeMap=None, tvWeight=0.2):
+    """
+    The TVNorm energy of the latent frame for one c, straight from the event
+    integral.
+    """
+
+    denominator = np.multiply(eventIntegral, float(delta), dtype=np.float64)
+    np.exp(denominator, out=denominator)
+    return TVNorm(blurry / denominator.mean(axis=0), edgeMap, tvWeight)
+
+def LatentFrameEnergies(blurry, histogram, grid, points, edgeMap=None, tvWeight=0.2):
+    """
+    Returns the TVNorm energy of the latent frame for each c in
+    grid[points], given the histogram of the event integral (from
+    EventIntegralHistogram).
+    """
+
+    height, width = blurry.shape
+    numSamples = histogram['numSamples']
+    histogramPixels = histogram['histogramPixels']
+    directPixels = histogram['directPixels']
+    counts = histogram['histogram'].astype(np.float64)
+    minCounts = histogram['minCounts']
+    numCandidates = len(points)
+    candidatesPerBlock = max(energyBlockSize // max(blurry.size, numSamples * len(directPixels)), 1)
+    if len(histogramPixels) > 0:
+        countTable = ExpTable(grid, 0, counts.shape[1] - 1)
+        offsetTable = ExpTable(grid, int(minCounts.min()), int(minCounts.max()))
+        offsetRows = minCounts - int(minCounts.min())
+    energies = np.empty(numCandidates)
+    for blockStart in range(0, numCandidates, candidatesPerBlock):
+        blockPoints = points[blockStart : blockStart + candidatesPerBlock]
+        # (H * W, C) means over samples of exp(c * E)
+        denominators = np.empty((blurry.size, len(blockPoints)))
+        if len(histogramPixels) > 0:
+            histogramDenominators = np.dot(counts, countTable[:, blockPoints])
+            histogramDenominators *= offsetTable[:, blockPoints][offsetRows]
+            denominators[histogramPixels] = histogramDenominators
+            del histogramDenominators
+        if len(directPixels) > 0:
+            directDenominators = np.multiply.outer(histogram['directIntegral'], grid[blockPoints])
+            np.exp(directDenominators, out=directDenominators)
+            denominators[directPixels] = directDenominators.sum(axis=0)
+            del directDenominators
+        denominators /= numSamples
+        latentFrames = np.divide(blurry.reshape(-1, 1), denominators, out=denominators)
+        latentFrames = np.ascontiguousarray(latentFrames.T).reshape(-1, height, width)
+        energies[blockStart : blockStart + len(blockPoints)] = TVNorm(latentFrames, edgeMap, tvWeight)
+    return energies
+
+def SearchDelta(blurry, histogram, edgeMap=None, deltaRange=(0.05, 1.0),
+                numPoints=100, tvWeight=0.2, numCandidates=defaultNumCandidates):
+    """
+    The batch search of EstimateDelta, given the histogram of the event
+    integral.
+    """
+
+    grid = np.linspace(deltaRange[0], deltaRange[1], numPoints + 1)
+    # Energies by grid point, so that none is evaluated twice
+    energies = {}
+    start = 0
+    end = numPoints
+    step = max(int(np.ceil(numPoints / float(max(numCandidates - 1, 1)))), 1)
+    while True:
+        points = [point for point in range(start, end + 1, step) + [end]
+                  if point not in energies]
+        points = sorted(set(points))
+        if len(points) > 0:
+            pointEnergies = LatentFrameEnergies(blurry, histogram, grid, points,
+                                                edgeMap, tvWeight)
+            energies.update(zip(points, pointEnergies))
+        best = min(range(start, end + 1, step) + [end], key=lambda point: energies[point])
+        if step == 1:
+            return grid[best]
+        start = max(best - step, 0)
+        end = min(best + step, numPoints)
+        step = max(min(int(np.ceil((end - start) / float(max(numCandidates - 1, 1)))),
+                       step // 2), 1)
+
+def EstimateDelta(blurry, eventIntegral, edgeMap=None, deltaRange=(0.05, 1.0),
+                  numPoints=100, tvWeight=0.2, numCandidates=defaultNumCandidates,
+                  search='batch'):
+    """
+    Parameters
+    ----------
+    blurry :
+        the blurry frame, as a float image (e.g. from BlurryFrame).
+    eventIntegral :
+        E at each sample time, from EventIntegral.
+    edgeMap :
+        e.g. the number of events at each pixel around the reference time.
+    deltaRange :
+        the range of c searched.
+    numPoints :
+        the resolution of the search, as a number of steps over the range.
+    numCandidates :
+        the number of c values evaluated at once.
+    search :
+        'batch', or 'fibonacci' for the search of estdelta.
+
+    Returns
+    -------
+    :
+        the estimated c.
+    """
+
+    if search == 'fibonacci':
+        return FiboSearch(lambda delta: LatentFrameEnergy(blurry, eventIntegral, delta,
+                                                          edgeMap, tvWeight),
+                          deltaRange[0], deltaRange[1], numPoints)
+    if search != 'batch':
+        raise Exception('search should be \'batch\' or \'fibonacci\', not %s' % search)
+    return SearchDelta(blurry, EventIntegralHistogram(eventIntegral), edgeMap,
+                       deltaRange, numPoints, tvWeight, numCandidates)
+
+def EstimateDeltaTask(task):
+    blurry, eventIntegral, edgeMap, searchParams = task
+    return EstimateDelta(blurry, eventIntegral, edgeMap, **searchParams)
+
+def EstimateDeltas(blurryFrames, eventIntegrals, edgeMaps=None, workers=1,
+                   **searchParams):
+    """
+    Estimates c for each of a sequence of blurry frames, given their event
+    integrals (and edge maps, if any); the other parameters are those of
+    EstimateDelta. If workers > 1, the frames are shared among that many
+    processes.
+    Returns an array of the c for each frame.
+    """
+
+    if edgeMaps is None:
+        edgeMaps = [None] * len(blurryFrames)
+    tasks = [(blurry, eventIntegral, edgeMap, searchParams)
+             for blurry, eventIntegral, edgeMap in zip(blurryFrames, eventIntegrals, edgeMaps)]
+    if workers <= 1 or len(tasks) <= 1:
+        return np.array([EstimateDeltaTask(task) for task in tasks])
+    pool = multiprocessing.Pool(min(workers, len(tasks)))
+    try:
+        deltas = pool.map(EstimateDeltaTask, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    return np.array(deltas)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Event2Video
+
+Deblurs one APS frame with the events around it, and brings it alive as a
+video of vLength frames, as event2video_final (and estdelta,
+warpingBlur2If and fromIf2Ivideo) do for main_video2.m:
+
+    from PyAedatTools.ImportAedat import ImportAedat
+    from PyEDI.BlurryFrame import BlurryFrame
+    from PyEDI.EventWindow import EventWindow
+    from PyEDI.Event2Video import Event2Video
+
+    aedat = ImportAedat({'importParams': {'filePath': 'rotatevideonew2_6.aedat'}})
+    frameIndex = 45
+    blurry = BlurryFrame(aedat['data']['frame'], frameIndex)
+    eventStart, eventEnd = EventWindow(aedat['data']['frame'], frameIndex)
+    latentFrame, video, delta = Event2Video(blurry, aedat['data']['polarity'],
+                                            eventStart, eventEnd, 100)
+
+The event integral is sampled at the vLength frame times, and is built
+once; estimating c and reconstructing the frames then only go over the
+integral, not the events.
+One c is estimated per blurry frame.
+"""
+
+from PyAedatTools.AccumulateEvents import AccumulateEvents
+from PyEDI.EventIntegral import EventIntegral
+from PyEDI.EstimateDelta import EstimateDelta
+from PyEDI.DoubleIntegral import DoubleIntegral
+
+def Event2Video(blurry, polarity, eventStart, eventEnd, vLength, delta=None,
+                referenceTime=None, deltaRange=(0.05, 1.0), tvWeight=0.2):
+    """
+    Parameters
+    ----------
+    blurry :
+        the blurry frame, as a float image (e.g. from BlurryFrame).
+    polarity :
+        the polarity events, with the layout of aedat['data']['polarity'],
+        in time order; only those in [eventStart, eventEnd) are used.
+    eventStart, eventEnd :
+        the event window (us), e.g. from EventWindow.
+    vLength :
+        the number of frames in the video.
+    delta :
+        the contrast threshold c; estimated if not given.
+    referenceTime :
+        the time (us) of the latent frame; by default, the middle of the
+        window.
+
+    Returns
+    -------
+    :
+        (latentFrame, video, delta): the sharp frame at the reference time,
+        the (vLength, height, width) video, and c.
+    """
+
+    height, width = blurry.shape
+    if referenceTime is None:
+        referenceTime = (eventStart + eventEnd) / 2.0
+    eventIntegral = EventIntegral(polarity, eventStart, eventEnd, vLength,
+                                  height, width, referenceTime)
+    if delta is None:
+        # The edges at the reference time are where there are events in the
+        # frame intervals either side of it
+        frameInterval = (eventEnd - eventStart) / float(vLength)
+        edgeMap = AccumulateEvents(polarity, referenceTime - frameInterval,
+                                   referenceTime + frameInterval, height=height,
+                                   width=width, signed=False)[0]
+        delta = EstimateDelta(blurry, eventIntegral, edgeMap, deltaRange,
+                              tvWeight=tvWeight)
+    latentFrame, video = DoubleIntegral(blurry, eventIntegral, delta)
+    return latentFrame, video, delta
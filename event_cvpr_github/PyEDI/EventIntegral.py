@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+EventIntegral
+
+The event integral E(t) of EDI (the event-based double integral): for each
+pixel, the number of on events minus the number of off events between the
+reference time f and t, so that the latent image at t is 
+L(t) = L(f) * exp(c * E(t)), for a contrast threshold c.
+
+E is sampled at numSamples times spread evenly over the event window
+(the middle of each of numSamples equal sub-intervals). The events of each
+sub-interval are counted in one pass (AccumulateEvents) and summed
+cumulatively, so the whole integral costs O(events + pixels x samples),
+rather than an integration from f for every sample.
+"""
+
+import numpy as np
+from PyAedatTools.AccumulateEvents import AccumulateEvents
+
+def SampleTimes(eventStart, eventEnd, numSamples):
+    """
+    The times (us) at which E is sampled.
+    """
+
+    return eventStart + (np.arange(numSamples) + 0.5) * (eventEnd - eventStart) / numSamples
+
+def EventIntegral(polarity, eventStart, eventEnd, numSamples, height, width,
+                  referenceTime=None):
+    """
+    Parameters
+    ----------
+    polarity :
+        the polarity events, with the layout of aedat['data']['polarity'],
+        in time order.
+    eventStart, eventEnd :
+        the event window (us), e.g. from EventWindow.
+    numSamples :
+        the number of times at which to sample E.
+    height, width :
+        the size of the frame; events beyond it are dropped.
+    referenceTime :
+        the time f (us) of the latent frame; by default, the middle of the
+        window.
+
+    Returns
+    -------
+    :
+        (numSamples, height, width) int32 array of E at SampleTimes.
+    """
+
+    if referenceTime is None:
+        referenceTime = (eventStart + eventEnd) / 2.0
+    sampleTimes = SampleTimes(eventStart, eventEnd, numSamples)
+    # E at each sample time counts from the start of the window, to begin
+    # with: count the events up to each sample time, then add them up
+    windowStarts = np.concatenate([[eventStart], sampleTimes[0 : -1]])
+    eventIntegral = AccumulateEvents(polarity, windowStarts, sampleTimes,
+                                     height=height, width=width)
+    np.cumsum(eventIntegral, axis=0, out=eventIntegral)
+    referenceIntegral = AccumulateEvents(polarity, eventStart, referenceTime,
+                                         height=height, width=width)[0]
+    eventIntegral -= referenceIntegral
+    return eventIntegral
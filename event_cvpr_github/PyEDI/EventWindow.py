@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""
+EventWindow
+
+The window of events used to deblur a frame, as chosen in main_video2.m:
+the frame's exposure, widened on each side by half the gap to the
+neighbouring frame, and moved by timeShift (the delay between the APS
+and DVS timestamps; -0.02 or -0.04 s for the recordings in the paper).
+"""
+
+def EventWindow(frame, frameIndex, timeShift=-0.04):
+    """
+    Parameters
+    ----------
+    frame :
+        the frames, with the layout of aedat['data']['frame'] (with
+        timeStampStart and timeStampEnd, or timeStampExposureStart and
+        timeStampExposureEnd if the frame timestamps weren't simplified).
+    frameIndex :
+        0-based index of the frame to deblur.
+    timeShift :
+        shift of the window, in seconds.
+
+    Returns
+    -------
+    :
+        (eventStart, eventEnd) in us.
+    """
+
+    # The exposure timestamps, if the frame timestamps weren't simplified
+    if 'timeStampStart' in frame:
+        timeStampStart = frame['timeStampStart'].astype(float)
+    else:
+        timeStampStart = frame['timeStampExposureStart'].astype(float)
+    if 'timeStampEnd' in frame:
+        timeStampEnd = frame['timeStampEnd'].astype(float)
+    else:
+        timeStampEnd = frame['timeStampExposureEnd'].astype(float)
+    numFrames = len(timeStampStart)
+    if frameIndex + 1 < numFrames:
+        timeForward = timeStampStart[frameIndex + 1] - timeStampEnd[frameIndex]
+    else:
+        timeForward = 0
+    if frameIndex > 0:
+        timeBack = timeStampStart[frameIndex] - timeStampEnd[frameIndex - 1]
+    else:
+        timeBack = 0
+    eventStart = timeStampStart[frameIndex] + timeShift * 1e6 - timeBack / 2
+    eventEnd = timeStampEnd[frameIndex] + timeShift * 1e6 + timeForward / 2
+    return eventStart, eventEnd
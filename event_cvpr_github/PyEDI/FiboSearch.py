@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+FiboSearch
+
+Fibonacci search for the minimum of a unimodal function of one variable,
+as in fibosearch.m.
+"""
+
+def FiboSearch(function, a, b, numPoints):
+    """
+    Searches [a, b] for the minimum of function, to a resolution of
+    (b - a) / numPoints.
+    """
+
+    # Find the number of iterations required
+    fibo = [1, 1, 2]
+    fiboIndex = 2
+    while fibo[fiboIndex] < numPoints:
+        fibo.append(fibo[-1] + fibo[-2])
+        fiboIndex = fiboIndex + 1
+
+    ratio = float(fibo[fiboIndex - 2]) / fibo[fiboIndex]
+    x1 = a + ratio * (b - a)
+    x2 = b - ratio * (b - a)
+    fx1 = function(x1)
+    fx2 = function(x2)
+    for k in range(1, fiboIndex):
+        ratio = float(fibo[fiboIndex - k - 1]) / fibo[fiboIndex - k + 1]
+        if fx1 < fx2:
+            b = x2
+            x2, fx2 = x1, fx1
+            x1 = a + ratio * (b - a)
+            fx1 = function(x1)
+        else:
+            a = x1
+            x1, fx1 = x2, fx2
+            x2 = b - ratio * (b - a)
+            fx2 = function(x2)
+    if fx1 < fx2:
+        return x1
+    return x2
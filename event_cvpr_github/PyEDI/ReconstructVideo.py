@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+"""
+ReconstructVideo
+
+Runs Event2Video over many frames of a recording, as main_video2.m does
+for startframe:endframe, on several worker processes:
+
+    from PyAedatTools.ImportAedat import ImportAedat
+    from PyEDI.ReconstructVideo import ReconstructVideo
+
+    aedat = ImportAedat({'importParams': {'filePath': 'rotatevideonew2_6.aedat'}})
+    deltas = ReconstructVideo(aedat, 'rotatevideonew2_6.npy', range(44, 50),
+                              vLength=100, workers=4)
+
+Each frame only needs the events in its own window, so the windows of all
+the frames are found up front (EventWindow, then one np.searchsorted over
+the polarity timestamps), and the polarity columns spanning them are copied
+once into shared memory, which the workers read without copying. Each task
+is then just a frame and the range of events it needs.
+
+The videos are written, in frame order, into a (numFrames, vLength, height,
+width) float32 .npy file, which is memory-mapped, so the whole result is
+never held in memory; at most maxPendingFrames frames are being worked on
+or waiting to be written at once.
+
+The recording can also be read from an event store (see
+PyAedatTools.EventStore), in which case only the frames to deblur (and
+their neighbours, whose timestamps bound the windows) and the polarity
+events spanning the windows are loaded:
+
+    deltas = ReconstructVideo({'importParams': {'filePath': 'rotatevideonew2_6.events'}},
+                              'rotatevideonew2_6.npy', range(44, 50))
+"""
+
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from PyAedatTools.EventStore import ImportEventStore
+from PyAedatTools.EventStore import EventStoreNumEvents
+from PyEDI.BlurryFrame import BlurryFrame
+from PyEDI.EventWindow import EventWindow
+from PyEDI.Event2Video import Event2Video
+
+polarityColumnFormat = (('timeStamp', ctypes.c_uint64, 'uint64'),
+                        ('x', ctypes.c_uint16, 'uint16'),
+                        ('y', ctypes.c_uint16, 'uint16'),
+                        ('polarity', ctypes.c_uint8, 'bool'))
+
+# Set in each worker by InitialiseWorker
+workerState = {}
+
+def SharedColumnArray(rawColumn, dtype):
+    return np.frombuffer(rawColumn, 'uint8' if dtype == 'bool' else dtype).view(dtype)
+
+def InitialiseWorker(rawColumns):
+    workerState['polarity'] = {}
+    for name, cType, dtype in polarityColumnFormat:
+        workerState['polarity'][name] = SharedColumnArray(rawColumns[name], dtype)
+
+def FrameShape(frame, frameIndex):
+    """
+    The (height, width) of a frame, as BlurryFrame gives it, without
+    converting its samples.
+    """
+
+    if 'yLength' in frame and 'xLength' in frame:
+        return int(frame['yLength'][frameIndex]), int(frame['xLength'][frameIndex])
+    return tuple(int(length) for length in np.shape(frame['samples'][frameIndex])[0 : 2])
+
+def ReconstructFrame(task):
+    """
+    Runs Event2Video on one frame, given the range of its events in the
+    shared polarity columns. Returns (position, video, delta), where position
+    is the place of the frame in the output.
+    """
+
+    position, blurry, eventStart, eventEnd, firstEvent, lastEvent, videoParams = task
+    polarity = {}
+    for name in workerState['polarity']:
+        polarity[name] = workerState['polarity'][name][firstEvent : lastEvent]
+    latentFrame, video, delta = Event2Video(blurry, polarity, eventStart, eventEnd,
+                                            **videoParams)
+    return position, video.astype(np.float32), delta
+
+def ReconstructVideo(aedat, outputPath, frameIndices=None, vLength=100,
+                     timeShift=-0.04, delta=None, workers=1, maxPendingFrames=None,
+                     **videoParams):
+    """
+    Parameters
+    ----------
+    aedat :
+        the output of ImportAedat, holding frames and polarity events (in
+        time order); or, to read from an event store, a dict with just
+        'importParams', as for ImportEventStore.
+    outputPath :
+        the .npy file into which the videos are written.
+    frameIndices :
+        0-based indices of the frames to deblur; by default, all of them.
+    vLength :
+        the number of frames in the video of each frame.
+    timeShift :
+        shift of the event windows, in seconds (see EventWindow).
+    delta :
+        the contrast threshold c; estimated for each frame if not given.
+    workers :
+        the number of worker processes; with 1, the frames are done in this
+        process.
+    maxPendingFrames :
+        the most frames which are submitted but not yet written; by default,
+        twice the number of workers.
+    Other parameters (referenceTime excepted) are passed on to Event2Video.
+
+    Returns
+    -------
+    :
+        the c used for each frame.
+    """
+
+    fromEventStore = 'data' not in aedat
+    if fromEventStore:
+        numStoreFrames = EventStoreNumEvents(aedat['importParams']['filePath']).get('frame', 0)
+        if frameIndices is None:
+            frameIndices = range(numStoreFrames)
+        frameIndices = list(frameIndices)
+        for frameIndex in frameIndices:
+            if not 0 <= frameIndex < numStoreFrames:
+                raise Exception('The store holds %d frames, so frame %d can\'t be deblurred'
+                                % (numStoreFrames, frameIndex))
+        # The window of a frame is bounded by the timestamps of the frames
+        # either side of it, so those are read too. Frame indices are
+        # counted over the whole store, so no time window is applied.
+        storeFrameIndices = sorted(set(neighbour for frameIndex in frameIndices
+                                       for neighbour in (frameIndex - 1, frameIndex, frameIndex + 1)
+                                       if 0 <= neighbour < numStoreFrames))
+        frameParams = dict(aedat['importParams'], dataTypes=['frame'],
+                           frameIndices=storeFrameIndices)
+        for key in ('startTime', 'endTime'):
+            frameParams.pop(key, None)
+        frame = ImportEventStore({'importParams': frameParams})['data'].get('frame')
+        # Where each frame to deblur is among those read; a frame's
+        # neighbours in the store are its neighbours there too
+        framePositions = list(np.searchsorted(storeFrameIndices, frameIndices))
+    else:
+        frame = aedat['data']['frame']
+        polarity = aedat['data']['polarity']
+        if frameIndices is None:
+            frameIndices = range(len(frame['samples']))
+        framePositions = list(frameIndices)
+    numFrames = len(framePositions)
+    if maxPendingFrames is None:
+        maxPendingFrames = 2 * workers
+    videoParams['vLength'] = vLength
+    videoParams['delta'] = delta
+
+    # The videos all go into one array, so the frames must all be of one size
+    frameShapes = sorted(set(FrameShape(frame, framePosition) for framePosition in framePositions))
+    if len(frameShapes) > 1:
+        raise Exception('The frames to deblur are of %d different sizes (%s); '
+                        'ReconstructVideo needs frames of one size'
+                        % (len(frameShapes), ', '.join('%dx%d' % (width, height)
+                                                        for height, width in frameShapes)))
+    height, width = frameShapes[0] if numFrames > 0 else (0, 0)
+
+    # The windows of all the frames, and the events in each
+    windows = np.array([EventWindow(frame, framePosition, timeShift)
+                        for framePosition in framePositions]).reshape(-1, 2)
+    if fromEventStore:
+        polarity = dict((name, np.zeros(0, dtype)) for name, cType, dtype in polarityColumnFormat)
+        if numFrames > 0:
+            # Just the events spanning the windows (a us wider, against
+            # rounding)
+            polarityParams = dict(aedat['importParams'], dataTypes=['polarity'],
+                                  startTime=(windows[:, 0].min() - 1) / 1e6,
+                                  endTime=(windows[:, 1].max() + 1) / 1e6)
+            polarity = ImportEventStore({'importParams': polarityParams})['data'].get(
+                'polarity', polarity)
+    firstEvents = np.searchsorted(polarity['timeStamp'], windows[:, 0], 'left')
+    lastEvents = np.searchsorted(polarity['timeStamp'], windows[:, 1], 'right')
+
+    video = np.lib.format.open_memmap(outputPath, 'w+', np.float32,
+                                      (numFrames, vLength, height, width))
+    deltas = np.zeros(numFrames)
+    if numFrames == 0:
+        return deltas
+
+    # Only the events spanning the windows are shared
+    spanStart = int(firstEvents.min())
+    spanEnd = int(max(lastEvents.max(), spanStart))
+    tasks = (
+        (position, BlurryFrame(frame, framePositions[position]), windows[position, 0],
+         windows[position, 1], firstEvents[position] - spanStart,
+         lastEvents[position] - spanStart, videoParams)
+        for position in range(numFrames))
+
+    def WriteFrame(result):
+        position, frameVideo, frameDelta = result
+        video[position] = frameVideo
+        deltas[position] = frameDelta
+
+    if workers <= 1:
+        workerState['polarity'] = dict((name, polarity[name][spanStart : spanEnd])
+                                       for name, cType, dtype in polarityColumnFormat)
+        try:
+            for task in tasks:
+                WriteFrame(ReconstructFrame(task))
+        finally:
+            workerState.clear()
+        video.flush()
+        return deltas
+
+    rawColumns = {}
+    for name, cType, dtype in polarityColumnFormat:
+        # A RawArray can't be empty
+        rawColumns[name] = RawArray(cType, max(spanEnd - spanStart, 1))
+        SharedColumnArray(rawColumns[name], dtype)[0 : spanEnd - spanStart] \
+            = polarity[name][spanStart : spanEnd]
+
+    print 'Reconstructing %d frames on %d workers ...' % (numFrames, workers)
+    pool = multiprocessing.Pool(workers, InitialiseWorker, (rawColumns,))
+    try:
+        # Results are collected in frame order; no more than
+        # maxPendingFrames are submitted ahead of the next to be written
+        pending = []
+        for task in tasks:
+            pending.append(pool.apply_async(ReconstructFrame, (task,)))
+            if len(pending) >= maxPendingFrames:
+                WriteFrame(pending.pop(0).get())
+        for result in pending:
+            WriteFrame(result.get())
+    finally:
+        pool.close()
+        pool.join()
+    video.flush()
+    return deltas
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""
+TVNorm
+
+The energy by which the contrast threshold c is chosen, as in TVnorm.m:
+tvWeight times the total variation of the latent frame, less the
+cross-correlation of its edges with the edge map - where the events around
+the reference time say the edges are - so that the best c gives a frame
+which is smooth, except at those edges.
+im_edge_crossc is only available as a .p file; here the edge
+cross-correlation is the sum over pixels of the gradient magnitude of the
+frame times the edge map, scaled to a maximum of 1. The estimate of c
+depends on this approximation, so where c is known for a sensor it is
+better given.
+"""
+
+import numpy as np
+
+def GradientMagnitude(image):
+    """
+    Forward differences, with the last column and row replicated (dxp and
+    dyp in TVnorm.m).
+    """
+
+    dx = np.zeros_like(image)
+    dy = np.zeros_like(image)
+    dx[..., :, 0 : -1] = image[..., :, 1 : ] - image[..., :, 0 : -1]
+    dy[..., 0 : -1, :] = image[..., 1 : , :] - image[..., 0 : -1, :]
+    return np.sqrt(dx ** 2 + dy ** 2)
+
+def TVNorm(image, edgeMap=None, tvWeight=0.2):
+    """
+    image is the latent frame, or a (C, H, W) stack of latent frames, whose
+    energies are returned as an array; edgeMap, if given, is e.g. the number
+    of events at each pixel around the reference time.
+    """
+
+    gradientMagnitude = GradientMagnitude(image)
+    energy = tvWeight * gradientMagnitude.sum(axis=(-2, -1))
+    if edgeMap is not None and edgeMap.max() > 0:
+        gradientMagnitude *= edgeMap
+        energy -= gradientMagnitude.sum(axis=(-2, -1)) / float(edgeMap.max())
+    return energy
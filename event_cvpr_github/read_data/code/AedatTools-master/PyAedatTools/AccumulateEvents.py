@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+AccumulateEvents
+
+Builds event-count frames from polarity events - the frames which
+PlotPolarity builds with accumarray, and which the EDI reconstruction
+integrates between timestamps - for many windows in one call.
+
+Each window is a range of events, given either by time (events with
+windowStart <= timeStamp < windowEnd, found by bisection, which assumes
+monotonic timestamps) or by event number (windowStart <= event <
+windowEnd). Frame k of the output holds, for each pixel, the number of on
+events minus the number of off events in window k (or, if signed is False,
+the number of events).
+
+The events of a block of windows are counted with a single np.bincount on
+their linearised (window, y, x) indices, and the counts are written into the
+preallocated (K, H, W) output; events beyond the frame size are dropped.
+Where the windows overlap (e.g. windows all starting from a reference time,
+as in EDI), the events between successive window boundaries are counted
+once, the counts are summed cumulatively, and each window is the difference
+of the sums at its ends - so no event is counted more than once whatever
+the overlap.
+"""
+
+import numpy as np
+
+# The events of as many windows are counted at once as fit in this many bins
+accumulateBlockSize = 2 ** 22
+
+def AccumulateEventRanges(polarity, starts, ends, height, width, out, signed):
+    """
+    Counts the events of the non-overlapping, ordered event ranges
+    [starts[k], ends[k]) into out[k].
+    """
+
+    numPixels = height * width
+    numBins = numPixels * 2 if signed else numPixels
+    windowsPerBlock = max(accumulateBlockSize // numBins, 1)
+    for blockStart in range(0, len(starts), windowsPerBlock):
+        blockStarts = starts[blockStart : blockStart + windowsPerBlock]
+        blockEnds = ends[blockStart : blockStart + windowsPerBlock]
+        numWindows = len(blockStarts)
+        lengths = blockEnds - blockStarts
+        if np.all(blockStarts[1 : ] == blockEnds[0 : -1]):
+            # Back-to-back windows are a view onto the columns
+            eventIndices = slice(blockStarts[0], blockEnds[-1])
+        else:
+            eventIndices = np.arange(lengths.sum()) \
+                + np.repeat(blockStarts - np.concatenate([[0], np.cumsum(lengths)[0 : -1]]), lengths)
+        x = polarity['x'][eventIndices].astype(np.intp)
+        y = polarity['y'][eventIndices].astype(np.intp)
+        pixelIndices = np.repeat(np.arange(numWindows) * numPixels, lengths)
+        pixelIndices += y * width
+        pixelIndices += x
+        inFrame = None
+        if len(x) > 0 and (x.max() >= width or y.max() >= height):
+            inFrame = np.logical_and(x < width, y < height)
+        del x, y
+        blockOut = out[blockStart : blockStart + numWindows]
+        if signed and len(pixelIndices) < numWindows * numPixels:
+            # Few events per pixel: weigh on events +1 and off events -1,
+            # which needs half as many bins as counting them apart
+            weights = polarity['polarity'][eventIndices] * 2.0 - 1
+            if inFrame is not None:
+                pixelIndices = pixelIndices[inFrame]
+                weights = weights[inFrame]
+            counts = np.bincount(pixelIndices, weights, numWindows * numPixels)
+            blockOut[...] = counts.reshape(numWindows, height, width)
+        elif signed:
+            # Off and on events of each pixel go in adjacent bins
+            pixelIndices *= 2
+            pixelIndices += polarity['polarity'][eventIndices]
+            if inFrame is not None:
+                pixelIndices = pixelIndices[inFrame]
+            counts = np.bincount(pixelIndices, minlength=numWindows * numBins) \
+                .reshape(numWindows, height, width, 2)
+            np.subtract(counts[..., 1], counts[..., 0], out=blockOut, casting='unsafe')
+        else:
+            if inFrame is not None:
+                pixelIndices = pixelIndices[inFrame]
+            counts = np.bincount(pixelIndices, minlength=numWindows * numBins)
+            blockOut[...] = counts.reshape(numWindows, height, width)
+    return out
+
+def AccumulateEvents(polarity, windowStarts, windowEnds, distributeBy='time',
+                     height=None, width=None, out=None, signed=True):
+    """
+    Parameters
+    ----------
+    polarity :
+        the polarity events, with the layout of aedat['data']['polarity']
+        (or an EventStream).
+    windowStarts, windowEnds :
+        the start and end of each of the K windows; timestamps (us) if
+        distributeBy is 'time', event numbers if it is 'events'.
+    height, width :
+        the frame size; by default, that of out if it is given, else large
+        enough for all the events.
+    out :
+        optional (K, H, W) array to write the frames into; whatever it held
+        is overwritten. Otherwise an int32 array is allocated.
+    signed :
+        if True, on events count +1 and off events -1; otherwise each event
+        counts 1.
+
+    Returns
+    -------
+    :
+        the (K, H, W) array of frames.
+    """
+
+    windowStarts = np.atleast_1d(windowStarts)
+    windowEnds = np.atleast_1d(windowEnds)
+    if len(windowStarts) != len(windowEnds):
+        raise Exception('There are %d window starts, but %d window ends'
+                        % (len(windowStarts), len(windowEnds)))
+    if distributeBy == 'time':
+        timeStamps = polarity['timeStamp']
+        starts = np.searchsorted(timeStamps, windowStarts, 'left')
+        ends = np.searchsorted(timeStamps, windowEnds, 'left')
+    elif distributeBy == 'events':
+        numEvents = len(polarity['timeStamp'])
+        starts = np.clip(windowStarts.astype(np.int64), 0, numEvents)
+        ends = np.clip(windowEnds.astype(np.int64), 0, numEvents)
+    else:
+        raise Exception('distributeBy should be \'time\' or \'events\', not %s' % distributeBy)
+    ends = np.maximum(starts, ends)
+
+    if out is not None and out.ndim == 3 and height is None and width is None:
+        height, width = out.shape[1 : ]
+    if height is None:
+        height = int(polarity['y'].max()) + 1 if len(polarity['y']) > 0 else 1
+    if width is None:
+        width = int(polarity['x'].max()) + 1 if len(polarity['x']) > 0 else 1
+    if out is None:
+        out = np.zeros((len(starts), height, width), np.int32)
+    elif out.shape != (len(starts), height, width):
+        raise Exception('The output array has shape %s, rather than %s'
+                        % (out.shape, (len(starts), height, width)))
+    if len(starts) == 0:
+        return out
+
+    if np.all(starts[1 : ] >= ends[0 : -1]):
+        return AccumulateEventRanges(polarity, starts, ends, height, width, out, signed)
+
+    # Overlapping windows: count the events between successive boundaries,
+    # sum cumulatively, and take differences
+    boundaries, boundaryIndices = np.unique(np.concatenate([starts, ends]), return_inverse=True)
+    cumulative = np.zeros((len(boundaries), height, width),
+                          np.int64 if out.dtype.kind in 'iu' else out.dtype)
+    AccumulateEventRanges(polarity, boundaries[0 : -1], boundaries[1 : ],
+                          height, width, cumulative[1 : ], signed)
+    np.cumsum(cumulative, axis=0, out=cumulative)
+    for window in range(len(starts)):
+        np.subtract(cumulative[boundaryIndices[len(starts) + window]],
+                    cumulative[boundaryIndices[window]],
+                    out=out[window], casting='unsafe')
+    return out
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the export of polarity events to a ROS bag.
+
+Makes numEvents synthetic polarity events from a DAVIS240C, exports them with
+ExportRosbag, reads the bag back (with the minimal record parser below, so
+no ROS install is needed), checks the events in the EventArray messages
+against what was exported, and prints the export rate in messages/second
+and events/second.
+
+Usage:
+    python BenchmarkExportRosbag.py [numEvents] [numEventsPerArray]
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import time
+import numpy as np
+from PyAedatTools.ExportRosbag import ExportRosbag, EventArrayFormat, eventArrayType
+
+numEvents = int(float(sys.argv[1])) if len(sys.argv) > 1 else int(1e7)
+numEventsPerArray = int(float(sys.argv[2])) if len(sys.argv) > 2 else 25000
+xLength = 240
+yLength = 180
+
+randomState = np.random.RandomState(0)
+aedat = {'info': {'source': 'Davis240C'},
+         'exportParams': {'filePath': os.path.join(tempfile.mkdtemp(), 'benchmark.aedat'),
+                          'numEventsPerArray': numEventsPerArray},
+         'data': {'polarity': {
+             'x': randomState.randint(0, xLength, numEvents).astype(np.uint16),
+             'y': randomState.randint(0, yLength, numEvents).astype(np.uint16),
+             'polarity': randomState.randint(0, 2, numEvents).astype(bool),
+             'timeStamp': np.cumsum(randomState.randint(0, 3, numEvents)).astype(np.uint64)}}}
+bagFilePath = os.path.splitext(aedat['exportParams']['filePath'])[0] + '.bag'
+
+def ReadHeader(header):
+    fields = {}
+    while header:
+        fieldLength = struct.unpack('<i', header[0 : 4])[0]
+        name, value = header[4 : 4 + fieldLength].split('=', 1)
+        fields[name] = value
+        header = header[4 + fieldLength : ]
+    return fields
+
+def ReadRecords(data):
+    """
+    Yields the (header fields, data) of each record in data.
+    """
+
+    position = 0
+    while position < len(data):
+        headerLength = struct.unpack('<i', data[position : position + 4])[0]
+        header = ReadHeader(data[position + 4 : position + 4 + headerLength])
+        position += 4 + headerLength
+        dataLength = struct.unpack('<i', data[position : position + 4])[0]
+        yield header, data[position + 4 : position + 4 + dataLength]
+        position += 4 + dataLength
+
+def CheckBag():
+    with open(bagFilePath, 'rb') as bagFile:
+        bagData = bagFile.read()
+    eventArrayConnections = set()
+    events = []
+    for header, data in ReadRecords(bagData[len('#ROSBAG V2.0\n') : ]):
+        if header['op'] != '\x05':
+            continue
+        for recordHeader, recordData in ReadRecords(data):
+            if recordHeader['op'] == '\x07' \
+                    and ReadHeader(recordData)['type'] == eventArrayType:
+                eventArrayConnections.add(recordHeader['conn'])
+            elif recordHeader['op'] == '\x02' and recordHeader['conn'] in eventArrayConnections:
+                numMessageEvents = struct.unpack('<i', recordData[24 : 28])[0]
+                message = np.frombuffer(recordData, EventArrayFormat(numMessageEvents))[0]
+                assert message['width'] == xLength and message['height'] == yLength
+                events.append(message['events'])
+    events = np.concatenate(events)
+    polarity = aedat['data']['polarity']
+    assert np.array_equal(events['x'], xLength - 1 - polarity['x'])
+    assert np.array_equal(events['y'], polarity['y'])
+    assert np.array_equal(events['polarity'], polarity['polarity'])
+    assert np.array_equal(events['secs'].astype(np.uint64) * 1000000 + events['nsecs'] // 1000,
+                          polarity['timeStamp'])
+
+print 'Exporting %d events to %s ...' % (numEvents, bagFilePath)
+startTime = time.time()
+aedat = ExportRosbag(aedat)
+exportTime = time.time() - startTime
+CheckBag()
+numMessages = -(-numEvents // numEventsPerArray)
+print 'Exported %d events in %d messages in %.2f s: %.1f messages/second, %.2f M events/second' \
+    % (numEvents, numMessages, exportTime, numMessages / exportTime, numEvents / exportTime / 1e6)
+
+os.remove(bagFilePath)
+os.rmdir(os.path.dirname(bagFilePath))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the import of aedat3.x polarity events.
+
+Writes a synthetic aedat3.1 file of polarity packets (with a timestamp
+overflow half way through), imports it with ImportAedat on 1 to maxWorkers
+worker processes (by default, one per core), checks the decoded events against
+what was written each time, and prints the import rate in events/second and
+the speed-up over the serial import.
+
+Usage:
+    python BenchmarkImportAedatDataVersion3.py [numEvents] [eventsPerPacket] [maxWorkers]
+"""
+
+import multiprocessing
+import os
+import sys
+import struct
+import tempfile
+import time
+import numpy as np
+from PyAedatTools.ImportAedat import ImportAedat
+
+numEvents = int(float(sys.argv[1])) if len(sys.argv) > 1 else int(5e6)
+eventsPerPacket = int(float(sys.argv[2])) if len(sys.argv) > 2 else 4096
+maxWorkers = int(sys.argv[3]) if len(sys.argv) > 3 else multiprocessing.cpu_count()
+xLength = 240
+yLength = 180
+
+# Make the events: x, y and polarity at random, with increasing timestamps
+randomState = np.random.RandomState(0)
+x = randomState.randint(0, xLength, numEvents).astype(np.uint32)
+y = randomState.randint(0, yLength, numEvents).astype(np.uint32)
+polarity = randomState.randint(0, 2, numEvents).astype(np.uint32)
+timeStamp = np.cumsum(randomState.randint(0, 3, numEvents)).astype(np.uint64)
+# Overflow at the packet boundary nearest half way through, so that the 
+# 64 bit timestamps are exercised
+overflowEvent = numEvents // 2 // eventsPerPacket * eventsPerPacket
+timeStamp[overflowEvent : ] += np.uint64(2 ** 31)
+
+polarityDataFormat = np.dtype([('address', '<u4'), ('timeStamp', '<i4')])
+events = np.zeros(numEvents, polarityDataFormat)
+events['address'] = 1 | (polarity << 1) | (y << 2) | (x << 17)
+events['timeStamp'] = np.bitwise_and(timeStamp, 2 ** 31 - 1)
+
+filePath = os.path.join(tempfile.mkdtemp(), 'benchmark.aedat')
+print 'Writing %d events to %s ...' % (numEvents, filePath)
+with open(filePath, 'wb') as fileHandle:
+    fileHandle.write('#!AER-DAT3.1\r\n')
+    fileHandle.write('#Source 1: DAVIS240C\r\n')
+    fileHandle.write('#!END-HEADER\r\n')
+    for packetStart in range(0, numEvents, eventsPerPacket):
+        packetEnd = min(packetStart + eventsPerPacket, numEvents)
+        eventNumber = packetEnd - packetStart
+        tsOverflow = int(timeStamp[packetStart] >> np.uint64(31))
+        # type, source, eventSize, tsOffset, tsOverflow, capacity, number, valid
+        fileHandle.write(struct.pack('<hhiiiiii', 1, 1, 8, 4, tsOverflow,
+                                     eventNumber, eventNumber, eventNumber))
+        fileHandle.write(events[packetStart : packetEnd].tostring())
+
+def CheckPolarityData(aedat):
+    polarityData = aedat['data']['polarity']
+    assert np.array_equal(polarityData['x'], x)
+    assert np.array_equal(polarityData['y'], y)
+    assert np.array_equal(polarityData['polarity'], polarity.astype(bool))
+    assert np.array_equal(polarityData['timeStamp'], timeStamp)
+    assert polarityData['valid'].all()
+
+# Import with 1 worker (the serial import), then with 2 .. maxWorkers
+importTimes = {}
+for workers in range(1, maxWorkers + 1):
+    aedat = {}
+    aedat['importParams'] = {}
+    aedat['importParams']['filePath'] = filePath
+    aedat['importParams']['packetIndexFile'] = False
+    aedat['importParams']['workers'] = workers
+
+    startTime = time.time()
+    aedat = ImportAedat(aedat)
+    importTimes[workers] = time.time() - startTime
+    CheckPolarityData(aedat)
+    del aedat
+
+for workers in range(1, maxWorkers + 1):
+    print 'Imported %d events on %d worker(s) in %.2f s: %.2f M events/second, speed-up %.2f' \
+        % (numEvents, workers, importTimes[workers],
+           numEvents / importTimes[workers] / 1e6, importTimes[1] / importTimes[workers])
+
+os.remove(filePath)
+os.rmdir(os.path.dirname(filePath))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+ColumnBuffer
+
+A set of growable, equal-length numpy columns, used by
+ImportAedatDataVersion3 to collect the events of each type as packets are
+read.
+
+Appending doesn't reallocate every time: when there isn't room, the capacity
+is (at least) doubled, so the cost of copying is amortised over all the
+events. The columns are cut down to the number of events actually held only
+once, by trim, at the end of the import.
+
+A capacity hint can be given up front (e.g. the number of events of this
+type in the packet index), and a limit can be put on each growth step (e.g.
+the number of events of this size which could still fit in the rest of the
+file), so that the buffer never has to grow much beyond what is needed.
+
+A column may hold arrays rather than scalars (e.g. frame samples); the shape
+of its elements can be grown with reserveShape, e.g. when a larger frame
+turns up.
+"""
+
+import numpy as np
+
+class ColumnBuffer(object):
+
+    def __init__(self, columnFormat, capacity=0):
+        """
+        columnFormat is a list of (name, dtype) or (name, dtype, shape)
+        tuples, one per column; shape gives the shape of each element of a
+        column, for columns of arrays (e.g. frame samples).
+        capacity is the number of events to allocate room for initially.
+        """
+
+        self.numEvents = 0
+        self.columns = {}
+        self.columnNames = []
+        for column in columnFormat:
+            shape = column[2] if len(column) > 2 else ()
+            self.columns[column[0]] = np.zeros((int(capacity), ) + tuple(shape), column[1])
+            self.columnNames.append(column[0])
+
+    def __len__(self):
+        return self.numEvents
+
+    def capacity(self):
+        return len(self.columns[self.columnNames[0]])
+
+    def reserve(self, numEvents, maxCapacity=None):
+        """
+        Makes sure that there is room for numEvents more events, growing the
+        columns if necessary. The capacity is doubled (or more, if that's
+        not enough), but not beyond maxCapacity, if that is given.
+        """
+
+        requiredCapacity = self.numEvents + int(numEvents)
+        capacity = self.capacity()
+        if requiredCapacity <= capacity:
+            return
+        newCapacity = max(2 * capacity, requiredCapacity)
+        if maxCapacity is not None:
+            newCapacity = max(min(newCapacity, int(maxCapacity)), requiredCapacity)
+        for name in self.columnNames:
+            column = self.columns[name]
+            newColumn = np.zeros((newCapacity, ) + column.shape[1 : ], column.dtype)
+            newColumn[0 : self.numEvents] = column[0 : self.numEvents]
+            self.columns[name] = newColumn
+
+    def reserveShape(self, name, shape):
+        """
+        Makes sure that each element of the named column (a column of
+        arrays) is at least the given shape, growing it if necessary; the
+        elements already held are kept at the start of each dimension, and
+        padded with zeros.
+        """
+
+        column = self.columns[name]
+        newShape = tuple(int(length) for length in np.maximum(column.shape[1 : ], shape))
+        if newShape == column.shape[1 : ]:
+            return
+        newColumn = np.zeros((len(column), ) + newShape, column.dtype)
+        newColumn[tuple([slice(0, self.numEvents)] 
+                        + [slice(0, length) for length in column.shape[1 : ]])] \
+            = column[0 : self.numEvents]
+        self.columns[name] = newColumn
+
+    def extend(self, numEvents, maxCapacity=None):
+        """
+        Makes room for numEvents more events and counts them in, returning
+        the (start, end) indices of the rows they are to be written to.
+        """
+
+        self.reserve(numEvents, maxCapacity)
+        start = self.numEvents
+        self.numEvents = self.numEvents + int(numEvents)
+        return start, self.numEvents
+
+    def trim(self):
+        """
+        Returns a dict of the columns, cut down to the number of events held.
+        """
+
+        trimmed = {}
+        for name in self.columnNames:
+            column = self.columns[name]
+            if len(column) == self.numEvents:
+                trimmed[name] = column
+            else:
+                # Copy, so that the unused capacity can be freed
+                trimmed[name] = column[0 : self.numEvents].copy()
+        return trimmed
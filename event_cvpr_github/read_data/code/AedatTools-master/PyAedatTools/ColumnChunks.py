@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+ColumnChunks
+
+The columns of the events of one data type (as in aedat['data'][dataType])
+kept in chunks, one .npz file per chunk. With the first and last timestamps
+of each chunk noted in an index, a window of time can be read by loading
+only the chunks which overlap it. ExportColumnar lays out its tables of .npz
+files, and EventStore its stores of .npz files, in this way.
+
+The samples of frames are held as an array of frames, as ImportAedat gives
+them; frames of different sizes are padded with zeros to the size of the
+largest, their own sizes being in xLength and yLength.
+"""
+
+import numpy as np
+
+def ChunkFileName(prefix, chunkNumber):
+    return '%s%06d.npz' % (prefix, chunkNumber)
+
+def PadFrames(pieces):
+    """
+    Joins arrays of frames into one, padding frames smaller than the
+    largest with zeros.
+    """
+
+    pieces = [np.asarray(piece) for piece in pieces]
+    frameShape = tuple(np.max([piece.shape[1 : ] for piece in pieces], axis=0))
+    if all(piece.shape[1 : ] == frameShape for piece in pieces):
+        return np.concatenate(pieces)
+    frames = np.zeros((sum(len(piece) for piece in pieces), ) + frameShape, pieces[0].dtype)
+    start = 0
+    for piece in pieces:
+        frames[tuple([slice(start, start + len(piece))]
+                     + [slice(0, length) for length in piece.shape[1 : ]])] = piece
+        start = start + len(piece)
+    return frames
+
+def FrameSamplesArray(frame):
+    """
+    The samples of frames (with the layout of aedat['data']['frame']) as one
+    array of frames; a list of frames of different sizes is padded, which
+    needs their sizes in xLength and yLength.
+    """
+
+    samples = frame['samples']
+    if isinstance(samples, np.ndarray) and samples.dtype != object:
+        return samples
+    samples = [np.asarray(frameSamples) for frameSamples in samples]
+    if len(samples) == 0:
+        return np.zeros((0, 0, 0), np.uint16)
+    if all(frameSamples.shape == samples[0].shape for frameSamples in samples):
+        return np.stack(samples)
+    if 'xLength' not in frame or 'yLength' not in frame:
+        raise Exception('The frames are of different sizes, but have no xLength and yLength columns to give their sizes')
+    return PadFrames([frameSamples[np.newaxis] for frameSamples in samples])
+
+def ConcatenateColumns(pieces, names):
+    """
+    Joins a list of dicts of columns into one dict of columns.
+    """
+
+    columns = {}
+    for name in names:
+        if name == 'samples':
+            columns[name] = PadFrames([piece[name] for piece in pieces])
+        else:
+            columns[name] = np.concatenate([np.asarray(piece[name]) for piece in pieces])
+    return columns
+
+def SaveChunk(filePath, columns, compress=False):
+    """
+    Writes a dict of columns to an .npz file.
+    """
+
+    save = np.savez_compressed if compress else np.savez
+    save(filePath, **columns)
+
+def LoadChunks(filePaths):
+    """
+    Reads the .npz files of some chunks (in order), returning a dict of
+    their columns, joined.
+    """
+
+    pieces = []
+    for filePath in filePaths:
+        with np.load(filePath) as chunkFile:
+            pieces.append(dict((name, chunkFile[name]) for name in chunkFile.files))
+    return ConcatenateColumns(pieces, sorted(pieces[0]))
+
+def TimeMask(timeStamps, startTimeStamp, endTimeStamp):
+    """
+    True for the timestamps from startTimeStamp to endTimeStamp, either of
+    which may be None.
+    """
+
+    mask = np.ones(len(timeStamps), bool)
+    if startTimeStamp is not None:
+        mask &= timeStamps >= startTimeStamp
+    if endTimeStamp is not None:
+        mask &= timeStamps <= endTimeStamp
+    return mask
+
+def OverlappingChunks(chunkStartTimeStamps, chunkEndTimeStamps, startTimeStamp, endTimeStamp):
+    """
+    True for the chunks, given their first and last timestamps, which
+    overlap the window from startTimeStamp to endTimeStamp (either of which
+    may be None).
+    """
+
+    return TimeMask(np.asarray(chunkStartTimeStamps), None, endTimeStamp) \
+        & TimeMask(np.asarray(chunkEndTimeStamps), startTimeStamp, None)
@@ -29,6 +29,6 @@ def DeviceAddressSpace(deviceName):
 			'DavisHet640Rgbw':	'Special handling required',
 			'Das1':				'Special handling required'}
    
-    return devices.get(inp, 'DEVICE NOT FOUND')
+    return devices.get(deviceName, 'DEVICE NOT FOUND')
 
 
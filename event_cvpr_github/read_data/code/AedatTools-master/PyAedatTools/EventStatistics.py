@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+EventStatistics
+
+Summary statistics of the events of each data type, accumulated while they
+are decoded (packet by packet for aedat3.x, run by run for aedat version 1
+or 2), so that nothing has to go back over the data arrays afterwards.
+The importers leave them in aedat['info']['eventStatistics'], a dict with
+an entry per data type imported, holding:
+    numEvents
+    firstTimeStamp, lastTimeStamp - the min and max timestamps (for frames,
+        of the start and end timestamps), which don't rely on the events
+        being in time order
+    rateBinWidth - width of the bins of the rate histogram (us)
+    rateHistogramStart - timestamp at which the first bin starts (us)
+    rateHistogram - number of events starting in each bin
+and, for polarity events:
+    numOn, numOff - the number of events of each polarity
+    onRatio - numOn / numEvents
+
+The statistics are plain dicts and arrays, so they can be passed between
+processes; MergeEventStatistics combines those of several runs of the same
+recording.
+"""
+
+import numpy as np
+
+# Default width of the rate histogram bins (us); importParams['rateBinWidth']
+# sets it in seconds
+defaultRateBinWidth = 1000000
+
+def RateBinWidth(importParams):
+    if 'rateBinWidth' in importParams:
+        return max(int(round(importParams['rateBinWidth'] * 1e6)), 1)
+    return defaultRateBinWidth
+
+def AddToRateHistogram(typeStatistics, firstBin, counts):
+    """
+    Adds counts to the rate histogram, starting at bin number firstBin,
+    growing the histogram at either end as necessary.
+    """
+
+    binWidth = typeStatistics['rateBinWidth']
+    histogram = typeStatistics['rateHistogram']
+    startBin = typeStatistics['rateHistogramStart'] // binWidth
+    if len(histogram) == 0:
+        startBin = firstBin
+    newStartBin = min(startBin, firstBin)
+    newEndBin = max(startBin + len(histogram), firstBin + len(counts))
+    if newStartBin < startBin or newEndBin > startBin + len(histogram):
+        grown = np.zeros(newEndBin - newStartBin, 'int64')
+        grown[startBin - newStartBin : startBin - newStartBin + len(histogram)] = histogram
+        histogram = grown
+        typeStatistics['rateHistogram'] = histogram
+        typeStatistics['rateHistogramStart'] = newStartBin * binWidth
+    histogram[firstBin - newStartBin : firstBin - newStartBin + len(counts)] += counts
+
+def AccumulateEventStatistics(statistics, dataType, timeStamps,
+                              lastTimeStamps=None, polarity=None,
+                              binWidth=defaultRateBinWidth):
+    """
+    Adds a run of events of dataType to statistics (updated in place).
+    timeStamps are the events' timestamps (for frames, their start
+    timestamps), and lastTimeStamps, if given, their end timestamps.
+    polarity is given for polarity events.
+    """
+
+    numEvents = len(timeStamps)
+    if numEvents == 0:
+        return statistics
+    firstTimeStamp = int(timeStamps.min())
+    maxTimeStamp = int(timeStamps.max())
+    if lastTimeStamps is None:
+        lastTimeStamp = maxTimeStamp
+    else:
+        lastTimeStamp = int(lastTimeStamps.max())
+
+    if dataType not in statistics:
+        statistics[dataType] = {'numEvents': 0,
+                                'firstTimeStamp': firstTimeStamp,
+                                'lastTimeStamp': lastTimeStamp,
+                                'rateBinWidth': binWidth,
+                                'rateHistogramStart': 0,
+                                'rateHistogram': np.zeros(0, 'int64')}
+        if polarity is not None:
+            statistics[dataType]['numOn'] = 0
+            statistics[dataType]['numOff'] = 0
+    typeStatistics = statistics[dataType]
+    typeStatistics['numEvents'] += numEvents
+    typeStatistics['firstTimeStamp'] = min(typeStatistics['firstTimeStamp'], firstTimeStamp)
+    typeStatistics['lastTimeStamp'] = max(typeStatistics['lastTimeStamp'], lastTimeStamp)
+
+    # Most runs (e.g. aedat3.x packets) fall within a single bin, which is
+    # usually already in the histogram
+    firstBin = firstTimeStamp // binWidth
+    if maxTimeStamp // binWidth == firstBin:
+        histogramBin = firstBin - typeStatistics['rateHistogramStart'] // binWidth
+        if 0 <= histogramBin < len(typeStatistics['rateHistogram']):
+            typeStatistics['rateHistogram'][histogramBin] += numEvents
+        else:
+            AddToRateHistogram(typeStatistics, firstBin, np.array([numEvents], 'int64'))
+    else:
+        bins = np.floor_divide(timeStamps, timeStamps.dtype.type(binWidth))
+        AddToRateHistogram(typeStatistics, firstBin,
+                           np.bincount((bins - bins.dtype.type(firstBin)).astype(np.intp)))
+
+    if polarity is not None:
+        numOn = int(np.count_nonzero(polarity))
+        typeStatistics['numOn'] += numOn
+        typeStatistics['numOff'] += numEvents - numOn
+        typeStatistics['onRatio'] = float(typeStatistics['numOn']) / typeStatistics['numEvents']
+    return statistics
+
+def MergeEventStatistics(statistics, other):
+    """
+    Adds the statistics of another run of the same recording (other) to
+    statistics, in place.
+    """
+
+    for dataType in other:
+        otherType = other[dataType]
+        if dataType not in statistics:
+            statistics[dataType] = dict(otherType)
+            statistics[dataType]['rateHistogram'] = otherType['rateHistogram'].copy()
+            continue
+        typeStatistics = statistics[dataType]
+        if typeStatistics['rateBinWidth'] != otherType['rateBinWidth']:
+            raise Exception('The rate histograms of the %s events have bins of %d and %d us'
+                            % (dataType, typeStatistics['rateBinWidth'], otherType['rateBinWidth']))
+        typeStatistics['numEvents'] += otherType['numEvents']
+        typeStatistics['firstTimeStamp'] = min(typeStatistics['firstTimeStamp'],
+                                               otherType['firstTimeStamp'])
+        typeStatistics['lastTimeStamp'] = max(typeStatistics['lastTimeStamp'],
+                                              otherType['lastTimeStamp'])
+        AddToRateHistogram(typeStatistics,
+                           otherType['rateHistogramStart'] // otherType['rateBinWidth'],
+                           otherType['rateHistogram'])
+        if 'numOn' in otherType:
+            typeStatistics['numOn'] += otherType['numOn']
+            typeStatistics['numOff'] += otherType['numOff']
+            typeStatistics['onRatio'] = float(typeStatistics['numOn']) / typeStatistics['numEvents']
+    return statistics
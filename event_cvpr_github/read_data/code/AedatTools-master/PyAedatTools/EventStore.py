@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+"""
+EventStore
+
+A store of the events of a recording, from which a window of time, or some
+of the frames, can be read without loading the rest - e.g. by deblurring
+jobs (see PyEDI.ReconstructVideo), which only need a few frames and the
+events around them.
+
+The events of each data type are held in chunks, optionally compressed:
+polarity, imu6, special etc events in chunks of chunkSize events, and frames
+in chunks of frameChunkSize frames. Every column of the data type is kept
+(including 'valid', where the import kept invalid events). For each data
+type there is an index of the first and last timestamps (the first
+timestamp column, for frames) and the number of events of each chunk; a
+read of [startTime, endTime] looks up the chunks which overlap it in the
+index, and a read of some frames (frameIndices) the chunks which hold them,
+and only those chunks are loaded.
+
+The samples of frames are held as an array of frames, padded as in
+ColumnChunks (frames of different sizes without xLength and yLength can't be
+stored).
+
+The store is either:
+    a directory of .npz files, needing only numpy, laid out as in
+        ColumnChunks: index.npz, and polarity000000.npz,
+        polarity000001.npz, ..., frame000000.npz, ... (one per chunk);
+    an HDF5 file, if the path ends in .h5 or .hdf5 (this needs h5py): a
+        group per data type, holding a dataset per column, chunked as the
+        events are (and gzip compressed, if asked for), and the index. A
+        slice of a dataset only reads the chunks it overlaps.
+
+ExportEventStore writes the output of ImportAedat, or a series of chunks of
+it, e.g. from ImportAedatChunks, so that the recording is never held whole:
+
+    chunks = ImportAedatChunks({'importParams': {'filePath': 'rec.aedat'}})
+    ExportEventStore({'exportParams': {'filePath': 'rec.events', 'compress': True}},
+                     chunks)
+
+ImportEventStore returns an aedat dict laid out as ImportAedat's.
+"""
+
+import os
+import numpy as np
+from PyAedatTools.EventStream import StreamsFromData
+from PyAedatTools.ColumnChunks import ChunkFileName
+from PyAedatTools.ColumnChunks import FrameSamplesArray
+from PyAedatTools.ColumnChunks import ConcatenateColumns
+from PyAedatTools.ColumnChunks import SaveChunk
+from PyAedatTools.ColumnChunks import LoadChunks
+from PyAedatTools.ColumnChunks import TimeMask
+from PyAedatTools.ColumnChunks import OverlappingChunks
+from PyAedatTools.NumEventsByType import NumEventsByType
+from PyAedatTools.FindFirstAndLastTimeStamps import FindFirstAndLastTimeStamps
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+indexFields = ('chunkStartTimeStamps', 'chunkEndTimeStamps', 'chunkNumEvents')
+
+defaultChunkSize = 2 ** 20
+defaultFrameChunkSize = 16
+
+def IsHdf5Path(filePath):
+    return os.path.splitext(filePath)[1].lower() in ('.h5', '.hdf5')
+
+class EventStoreWriter(object):
+
+    def __init__(self, filePath, chunkSize=defaultChunkSize, compress=False, source='',
+                 frameChunkSize=defaultFrameChunkSize):
+        """
+        Events are added with append, and the store is finished by close.
+        """
+
+        if chunkSize < 1:
+            raise Exception('The chunkSize parameter is %d, but must be at least 1' % chunkSize)
+        if frameChunkSize < 1:
+            raise Exception('The frameChunkSize parameter is %d, but must be at least 1' % frameChunkSize)
+        self.filePath = filePath
+        self.chunkSize = int(chunkSize)
+        self.frameChunkSize = int(frameChunkSize)
+        self.compress = compress
+        self.source = source
+        # Events not yet written, as lists of dicts of columns, by data type
+        self.pending = {}
+        self.numPending = {}
+        # The columns and timestamp column of each data type, and the index
+        # of its chunks
+        self.columnNames = {}
+        self.timeStampColumns = {}
+        self.index = {}
+        if IsHdf5Path(filePath):
+            if h5py is None:
+                raise Exception('h5py is needed to write %s; use a path without a .h5 or .hdf5 extension for a store of .npz files' % filePath)
+            self.hdf5File = h5py.File(filePath, 'w')
+        else:
+            self.hdf5File = None
+            if not os.path.isdir(filePath):
+                os.makedirs(filePath)
+
+    def typeChunkSize(self, dataType):
+        return self.frameChunkSize if dataType == 'frame' else self.chunkSize
+
+    def append(self, aedat):
+        """
+        Adds the events in aedat['data'] (with the layout of ImportAedat's
+        output); the events of each data type are expected to come in time
+        order.
+        """
+
+        streams = StreamsFromData(aedat['data'])
+        for dataType in sorted(streams):
+            stream = streams[dataType]
+            if stream.numEvents == 0:
+                continue
+            columns = dict(stream.columns)
+            if dataType == 'frame':
+                columns['samples'] = FrameSamplesArray(columns)
+            if dataType not in self.columnNames:
+                self.columnNames[dataType] = sorted(columns)
+                self.timeStampColumns[dataType] = stream.firstTimeStampColumn()
+                self.index[dataType] = dict((field, []) for field in indexFields)
+                self.pending[dataType] = []
+                self.numPending[dataType] = 0
+            elif sorted(columns) != self.columnNames[dataType]:
+                raise Exception('The %s events have the columns %s, but earlier ones had %s'
+                                % (dataType, ', '.join(sorted(columns)),
+                                   ', '.join(self.columnNames[dataType])))
+            self.pending[dataType].append(columns)
+            self.numPending[dataType] += stream.numEvents
+            while self.numPending[dataType] >= self.typeChunkSize(dataType):
+                self.writePending(dataType, self.typeChunkSize(dataType))
+
+    def writePending(self, dataType, numEvents):
+        names = self.columnNames[dataType]
+        pending = ConcatenateColumns(self.pending[dataType], names)
+        chunk = dict((name, pending[name][0 : numEvents]) for name in names)
+        remainder = dict((name, pending[name][numEvents : ]) for name in names)
+        self.pending[dataType] = [remainder]
+        self.numPending[dataType] -= numEvents
+        self.writeChunk(dataType, chunk)
+
+    def writeChunk(self, dataType, chunk):
+        index = self.index[dataType]
+        chunkNumber = len(index['chunkNumEvents'])
+        timeStamps = chunk[self.timeStampColumns[dataType]]
+        index['chunkStartTimeStamps'].append(timeStamps.min())
+        index['chunkEndTimeStamps'].append(timeStamps.max())
+        index['chunkNumEvents'].append(len(timeStamps))
+        if self.hdf5File is None:
+            SaveChunk(os.path.join(self.filePath, ChunkFileName(dataType, chunkNumber)),
+                      chunk, self.compress)
+            return
+        for name in self.columnNames[dataType]:
+            column = chunk[name]
+            path = dataType + '/' + name
+            if path not in self.hdf5File:
+                # Frames are chunked one by one, the other columns as the
+                # events are; the samples may grow to fit larger frames
+                self.hdf5File.create_dataset(
+                    path, (0, ) + column.shape[1 : ], column.dtype,
+                    maxshape=(None, ) * column.ndim,
+                    chunks=(1, ) + column.shape[1 : ] if name == 'samples'
+                        else (self.typeChunkSize(dataType), ) + column.shape[1 : ],
+                    compression='gzip' if self.compress else None)
+            dataset = self.hdf5File[path]
+            dataset.resize((dataset.shape[0] + len(column), )
+                           + tuple(np.maximum(dataset.shape[1 : ], column.shape[1 : ])))
+            dataset[tuple([slice(dataset.shape[0] - len(column), None)]
+                          + [slice(0, length) for length in column.shape[1 : ]])] = column
+
+    def close(self):
+        """
+        Writes the events still pending and the index.
+        """
+
+        for dataType in sorted(self.pending):
+            if self.numPending[dataType] > 0:
+                self.writePending(dataType, self.numPending[dataType])
+        index = {'dataTypes': np.array(sorted(self.index), str),
+                 'timeStampColumns': np.array([self.timeStampColumns[dataType]
+                                               for dataType in sorted(self.index)], str),
+                 'chunkSize': self.chunkSize,
+                 'frameChunkSize': self.frameChunkSize,
+                 'source': self.source}
+        for dataType in self.index:
+            typeIndex = self.index[dataType]
+            index[dataType + '_chunkStartTimeStamps'] = np.array(typeIndex['chunkStartTimeStamps'], np.uint64)
+            index[dataType + '_chunkEndTimeStamps'] = np.array(typeIndex['chunkEndTimeStamps'], np.uint64)
+            index[dataType + '_chunkNumEvents'] = np.array(typeIndex['chunkNumEvents'], np.int64)
+
+        if self.hdf5File is None:
+            # The index goes last, so a store without it is known to be
+            # unfinished
+            np.savez(os.path.join(self.filePath, 'index.npz'), **index)
+        else:
+            for name in index:
+                self.hdf5File.create_dataset('index/' + name, data=index[name])
+            self.hdf5File.close()
+        for dataType in sorted(self.index):
+            print 'Wrote %d chunks of %s events to %s' \
+                % (len(self.index[dataType]['chunkNumEvents']), dataType, self.filePath)
+
+def ExportEventStore(aedat, chunks=None):
+    """
+    Parameters
+    ----------
+    aedat :
+        dict with an 'exportParams' dict:
+            filePath - the store to write
+            chunkSize - events per chunk (default defaultChunkSize)
+            frameChunkSize - frames per chunk (default defaultFrameChunkSize)
+            compress - if True, the chunks are compressed
+        and, unless chunks is given, the 'data' to write, as from
+        ImportAedat.
+    chunks :
+        optional iterable of aedat dicts (e.g. from ImportAedatChunks),
+        whose data is written in turn.
+    """
+
+    if 'exportParams' not in aedat or 'filePath' not in aedat['exportParams']:
+        raise Exception('Missing parameter exportParams.filePath')
+    exportParams = aedat['exportParams']
+    writer = EventStoreWriter(exportParams['filePath'],
+                              exportParams.get('chunkSize', defaultChunkSize),
+                              exportParams.get('compress', False),
+                              aedat.get('info', {}).get('source', ''),
+                              exportParams.get('frameChunkSize', defaultFrameChunkSize))
+    if chunks is None:
+        chunks = [aedat]
+    for chunk in chunks:
+        if not writer.source:
+            writer.source = chunk.get('info', {}).get('source', '')
+        writer.append(chunk)
+    writer.close()
+    return aedat
+
+def LoadIndex(filePath):
+    """
+    Returns the index of a store (a dict, by data type, of the
+    indexFields and the timeStampColumn), its source, and its open HDF5
+    file (or None, for a store of .npz files).
+    """
+
+    if IsHdf5Path(filePath):
+        if h5py is None:
+            raise Exception('h5py is needed to read %s' % filePath)
+        hdf5File = h5py.File(filePath, 'r')
+        if 'index' not in hdf5File:
+            hdf5File.close()
+            raise Exception('%s is not a finished event store' % filePath)
+        indexFile = dict((str(name), hdf5File['index/' + name][()]) for name in hdf5File['index'])
+    else:
+        hdf5File = None
+        indexFilePath = os.path.join(filePath, 'index.npz')
+        if not os.path.isfile(indexFilePath):
+            raise Exception('%s is not a finished event store' % filePath)
+        with np.load(indexFilePath) as npzFile:
+            indexFile = dict((name, npzFile[name]) for name in npzFile.files)
+    index = {}
+    for dataType, timeStampColumn in zip(indexFile['dataTypes'], indexFile['timeStampColumns']):
+        dataType = str(dataType)
+        index[dataType] = dict((field, indexFile[dataType + '_' + field]) for field in indexFields)
+        index[dataType]['timeStampColumn'] = str(timeStampColumn)
+    return index, str(indexFile['source']), hdf5File
+
+def EventStoreNumEvents(filePath):
+    """
+    Returns the number of events (frames, for frames) of each data type in
+    a store, from its index.
+    """
+
+    index, source, hdf5File = LoadIndex(filePath)
+    if hdf5File is not None:
+        hdf5File.close()
+    return dict((dataType, int(index[dataType]['chunkNumEvents'].sum())) for dataType in index)
+
+def ReadChunks(filePath, hdf5File, dataType, typeIndex, chunks):
+    """
+    Reads the given chunks (in order) of a data type, returning a dict of
+    columns.
+    """
+
+    if hdf5File is None:
+        return LoadChunks([os.path.join(filePath, ChunkFileName(dataType, chunkNumber))
+                           for chunkNumber in chunks])
+    # Runs of consecutive chunks are one slice
+    chunkStarts = np.append(0, np.cumsum(typeIndex['chunkNumEvents']))
+    runStarts = np.flatnonzero(np.diff(np.append(-2, chunks)) != 1)
+    runEnds = np.append(runStarts[1 : ], len(chunks)) - 1
+    group = hdf5File[dataType]
+    pieces = []
+    for runStart, runEnd in zip(chunks[runStarts], chunks[runEnds]):
+        pieces.append(dict((str(name), group[name][chunkStarts[runStart] : chunkStarts[runEnd + 1]])
+                           for name in group))
+    return ConcatenateColumns(pieces, sorted(pieces[0]))
+
+def ImportEventStore(aedat):
+    """
+    Parameters, in aedat['importParams']:
+        filePath - the store
+        startTime, endTime - in seconds, as for ImportAedat
+        dataTypes - the data types to import; by default, all of them
+        frameIndices - 0-based indices, in the store, of the frames to
+            import (they are returned in the order they are stored in); by
+            default, all of them
+    The numbers of chunks read and in the store, by data type, are left in
+    info['chunksRead'] and info['numChunks'].
+    """
+
+    importParams = aedat['importParams']
+    filePath = importParams['filePath']
+    startTimeStamp = importParams['startTime'] * 1e6 if 'startTime' in importParams else None
+    endTimeStamp = importParams['endTime'] * 1e6 if 'endTime' in importParams else None
+    if startTimeStamp is not None and endTimeStamp is not None and startTimeStamp > endTimeStamp:
+        raise Exception('The startTime parameter is %d, but the endTime parameter is %d'
+                        % (importParams['startTime'], importParams['endTime']))
+    dataTypes = importParams.get('dataTypes')
+    frameIndices = None
+    if 'frameIndices' in importParams:
+        frameIndices = np.unique(np.asarray(importParams['frameIndices'], np.int64))
+
+    index, source, hdf5File = LoadIndex(filePath)
+    info = aedat.get('info', {})
+    info['source'] = source
+    info['chunksRead'] = {}
+    info['numChunks'] = {}
+    data = {}
+    try:
+        for dataType in sorted(index):
+            if dataTypes is not None and dataType not in dataTypes:
+                continue
+            typeIndex = index[dataType]
+            # The chunks overlapping the window
+            chunkMask = OverlappingChunks(typeIndex['chunkStartTimeStamps'],
+                                          typeIndex['chunkEndTimeStamps'],
+                                          startTimeStamp, endTimeStamp)
+            chunkStarts = np.append(0, np.cumsum(typeIndex['chunkNumEvents']))
+            if dataType == 'frame' and frameIndices is not None:
+                if len(frameIndices) > 0 and (frameIndices[0] < 0 or frameIndices[-1] >= chunkStarts[-1]):
+                    raise Exception('The store holds %d frames, so frame %d can\'t be imported'
+                                    % (chunkStarts[-1], frameIndices[0] if frameIndices[0] < 0
+                                                        else frameIndices[-1]))
+                # ... and holding the frames asked for
+                frameChunks = np.zeros(len(chunkMask), bool)
+                frameChunks[np.searchsorted(chunkStarts, frameIndices, 'right') - 1] = True
+                chunkMask &= frameChunks
+            chunks = np.flatnonzero(chunkMask)
+            info['chunksRead'][dataType] = len(chunks)
+            info['numChunks'][dataType] = len(chunkMask)
+            if len(chunks) == 0:
+                continue
+            columns = ReadChunks(filePath, hdf5File, dataType, typeIndex, chunks)
+            mask = TimeMask(columns[typeIndex['timeStampColumn']], startTimeStamp, endTimeStamp)
+            if dataType == 'frame' and frameIndices is not None:
+                # The index in the store of each frame read
+                storeIndices = np.concatenate([np.arange(chunkStarts[chunk], chunkStarts[chunk + 1])
+                                               for chunk in chunks])
+                mask &= np.in1d(storeIndices, frameIndices)
+            if not mask.all():
+                columns = dict((name, columns[name][mask]) for name in columns)
+            if len(mask) > 0 and mask.any():
+                data[dataType] = columns
+    finally:
+        if hdf5File is not None:
+            hdf5File.close()
+
+    aedat['info'] = info
+    aedat['data'] = data
+    aedat = NumEventsByType(aedat)
+    aedat = FindFirstAndLastTimeStamps(aedat)
+    return aedat
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+EventStream
+
+A compact container for the events of one data type: a set of equal-length
+numpy columns (e.g. 'timeStamp', 'x', 'y', 'polarity'), as held in
+aedat['data'][dataType].
+
+The conversion to and from the dict layout of aedat['data'] doesn't copy the
+columns, so a stream can be made from what ImportAedat returns, worked on,
+and put back:
+
+    polarity = EventStream.fromDict('polarity', aedat['data']['polarity'])
+    aedat['data']['polarity'] = polarity.timeWindow(1e6, 2e6).toDict()
+
+Slicing a stream with a slice (stream[a : b]) gives views onto its columns,
+so it costs O(1) whatever the number of events; indexing with a bool or
+index array gives copies, as it does in numpy.
+The number of events and the first and last timestamps are worked out once
+and cached.
+
+FrameStream does the same for frames, whose number is given by the
+'samples' column, and whose timestamps are the start and end of each frame
+(timeStampStart / timeStampEnd, or timeStampExposureStart /
+timeStampExposureEnd if the frame timestamps weren't simplified).
+
+StreamsFromData and DataFromStreams convert the whole of aedat['data'].
+"""
+
+import numpy as np
+
+class EventStream(object):
+
+    __slots__ = ('dataType', 'columns', '_numEvents', '_firstTimeStamp',
+                 '_lastTimeStamp')
+
+    def __init__(self, dataType, columns):
+        """
+        columns is a dict of equal-length numpy arrays, which are held, not
+        copied.
+        """
+
+        self.dataType = dataType
+        self.columns = columns
+        self._numEvents = None
+        self._firstTimeStamp = None
+        self._lastTimeStamp = None
+        numEvents = len(self)
+        for name in columns:
+            if len(columns[name]) != numEvents:
+                raise Exception('The %s column of the %s events holds %d events, rather than %d'
+                                % (name, dataType, len(columns[name]), numEvents))
+
+    @classmethod
+    def fromDict(cls, dataType, typeData):
+        """
+        Makes a stream from a dict of the layout of aedat['data'][dataType];
+        'numEvents' is dropped, as it's worked out from the columns.
+        """
+
+        columns = {}
+        for name in typeData:
+            if name != 'numEvents':
+                columns[name] = typeData[name]
+        return cls(dataType, columns)
+
+    def toDict(self):
+        """
+        Returns a dict of the layout of aedat['data'][dataType], holding the
+        stream's columns, with 'numEvents' filled in.
+        """
+
+        typeData = dict(self.columns)
+        typeData['numEvents'] = self.numEvents
+        return typeData
+
+    def lengthColumn(self):
+        return 'timeStamp'
+
+    def firstTimeStampColumn(self):
+        return 'timeStamp'
+
+    def lastTimeStampColumn(self):
+        return 'timeStamp'
+
+    @property
+    def numEvents(self):
+        if self._numEvents is None:
+            self._numEvents = len(self.columns[self.lengthColumn()])
+        return self._numEvents
+
+    def __len__(self):
+        return self.numEvents
+
+    @property
+    def firstTimeStamp(self):
+        """
+        The earliest timestamp (None if there are no events).
+        """
+
+        if self._firstTimeStamp is None and self.numEvents > 0:
+            self._firstTimeStamp = self.columns[self.firstTimeStampColumn()].min()
+        return self._firstTimeStamp
+
+    @property
+    def lastTimeStamp(self):
+        """
+        The latest timestamp (None if there are no events).
+        """
+
+        if self._lastTimeStamp is None and self.numEvents > 0:
+            self._lastTimeStamp = self.columns[self.lastTimeStampColumn()].max()
+        return self._lastTimeStamp
+
+    def __getitem__(self, index):
+        """
+        stream['x'] returns a column; stream[a : b] a stream of views onto
+        the columns; stream[logical] or stream[indices] a stream of copies.
+        """
+
+        if isinstance(index, basestring):
+            return self.columns[index]
+        columns = {}
+        for name in self.columns:
+            columns[name] = self.columns[name][index]
+        return self.__class__(self.dataType, columns)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def timeWindow(self, startTimeStamp=None, endTimeStamp=None):
+        """
+        Returns a view onto the events with first timestamps from
+        startTimeStamp up to and including endTimeStamp (in us), found by
+        bisection; this assumes that the timestamps are monotonic.
+        """
+
+        timeStamps = self.columns[self.firstTimeStampColumn()]
+        start = 0
+        end = self.numEvents
+        if startTimeStamp is not None:
+            start = np.searchsorted(timeStamps, startTimeStamp, 'left')
+        if endTimeStamp is not None:
+            end = np.searchsorted(timeStamps, endTimeStamp, 'right')
+        return self[start : max(start, end)]
+
+class FrameStream(EventStream):
+
+    __slots__ = ()
+
+    def lengthColumn(self):
+        return 'samples'
+
+    def firstTimeStampColumn(self):
+        if 'timeStampExposureStart' in self.columns:
+            return 'timeStampExposureStart'
+        return 'timeStampStart'
+
+    def lastTimeStampColumn(self):
+        if 'timeStampExposureEnd' in self.columns:
+            return 'timeStampExposureEnd'
+        return 'timeStampEnd'
+
+def StreamsFromData(data):
+    """
+    Returns a dict of an EventStream (a FrameStream for frames) per data type
+    in data, which has the layout of aedat['data'].
+    """
+
+    streams = {}
+    for dataType in data:
+        if dataType == 'frame':
+            streams[dataType] = FrameStream.fromDict(dataType, data[dataType])
+        else:
+            streams[dataType] = EventStream.fromDict(dataType, data[dataType])
+    return streams
+
+def DataFromStreams(streams):
+    """
+    Returns a dict of the layout of aedat['data'] from a dict of streams.
+    """
+
+    data = {}
+    for dataType in streams:
+        data[dataType] = streams[dataType].toDict()
+    return data
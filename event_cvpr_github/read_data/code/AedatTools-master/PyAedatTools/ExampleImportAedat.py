@@ -29,6 +29,20 @@ aedat['importParams']['startEvent'] = 1e6;
 aedat['importParams']['startTime'] = 48;
 aedat['importParams']['endTime'] = 48.1;
 
+# This example maps the file into memory rather than reading it, so that
+# nothing is loaded until it is decoded (aedat fileFormat 1 or 2 only):
+aedat['importParams']['memoryMap'] = True
+
+# This example decodes the events on 8 processes (aedat fileFormat 1 or 2,
+# DAVIS sources only):
+aedat['importParams']['workers'] = 8
+
+# This example writes the reset-subtracted frames into an existing uint16
+# array of shape (maxNumFrames, H, W), rather than allocating a new one 
+# (aedat fileFormat 1 or 2 only):
+import numpy as np
+aedat['importParams']['frameBuffer'] = np.zeros((1000, 180, 240), 'uint16')
+
 # This example only reads out from packets 1000 to 2000 (aedat3.x only)
 aedat['importParams']['startPacket'] = 1000;
 aedat['importParams']['endPacket'] = 2000;
@@ -41,9 +55,20 @@ aedat['importParams']['dataTypes'] = {'frame'};
 # Setting the dataTypes empty tells the function to not import any data;
 # You get the header info, plus packet indices info for Aedat3.x
 
+# For Aedat3.x, the packet index is kept in a sidecar file next to the .aedat
+# file ('<filePath>.index.npz'); this example stops it being read or written:
+aedat['importParams']['packetIndexFile'] = False
+
 # Working with a file where the source hasn't been declared - do this explicitly:
 aedat['importParams']['source'] = 'Davis240b';
 
 # Invoke the function
 aedat = ImportAedat(aedat)
 
+
+# Alternatively, stream the file in chunks, so that the whole recording never
+# has to be held in memory at once; here, in chunks of 100 ms:
+from pyAedatTools.ImportAedatChunks import ImportAedatChunks
+aedat['importParams']['chunkDuration'] = 0.1
+for chunk in ImportAedatChunks(aedat):
+    print chunk['info']['firstTimeStamp'], chunk['info']['lastTimeStamp']
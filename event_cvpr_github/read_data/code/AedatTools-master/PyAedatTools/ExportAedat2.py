@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+"""
+ExportAedat2
+
+Exports data to a .aedat file in format version 2, as ExportAedat2.m does:
+a header, then a big-endian uint32 address and a uint32 timestamp for each
+event. The .aedat file format is documented here:
+http://inilabs.com/support/software/fileformat/
+
+Polarity, special, frame and imu6 data are exported, each packed into
+addresses with the masks and shifts with which ImportAedatDataVersion1or2
+decodes them, so that the file imports back to the same data:
+    polarity - y, x and polarity, or'd together in one pass
+    special - the special event flag
+    frame - for each frame, a reset read (all samples at full scale) then a
+        signal read (full scale less the sample), which the importer
+        subtracts to give the sample back; a frame which still has its
+        'reset' flag (imported with subtractResetRead False) is written as
+        the single read it is. All the samples take the frame's start
+        timestamp, except the last, which takes its end timestamp.
+    imu6 - 7 words per sample: accel x, y, z, temperature, gyro x, y, z
+For a Dvs128 source, polarity and special events are packed as the Dvs128
+lays them out instead.
+
+The events of all the types are merged in time order, and written a chunk
+of exportChunkSize events at a time, so the output is never held in memory
+as a whole. The merge keeps the order of the events within each type; if
+their timestamps go backwards (e.g. after a timestamp reset), they are merged
+as though each timestamp were the latest up to it.
+Timestamps are written modulo 2^32, as a device would; the importer unwraps
+them again.
+
+Parameters, in aedat['exportParams']:
+    filePath
+    source - overrides aedat['info']['source'], so that data from one sensor
+        can masquerade as data from another
+    dataTypes - the data types to export; by default, all of them
+    noHeader - if True, only the events are written
+"""
+
+import numpy as np
+from PyAedatTools.MemmapAedatDataVersion1or2 import EventFormatVersion1or2
+from PyAedatTools.ImportAedatDataVersion1or2 import apsOrImuMask
+from PyAedatTools.ImportAedatDataVersion1or2 import signalOrSpecialMask
+from PyAedatTools.ImportAedatDataVersion1or2 import ImuOrPolarityMask
+from PyAedatTools.ImportAedatDataVersion1or2 import yShiftBits
+from PyAedatTools.ImportAedatDataVersion1or2 import xShiftBits
+from PyAedatTools.ImportAedatDataVersion1or2 import frameSampleMask
+from PyAedatTools.ImportAedatDataVersion1or2 import imuDataShiftBits
+from PyAedatTools.EventStream import FrameStream
+
+# DAVIS: the polarity bit (ImuOrPolarityMask), and the flags of IMU samples,
+# whose type (0 to 6, in the order in which they are sent) goes in bits 29-31
+# (1-based)
+polarityShiftBits = 11
+imuFlags = apsOrImuMask | ImuOrPolarityMask | signalOrSpecialMask
+imuTypeShiftBits = 28
+
+# Dvs128. In the 16-bit address:
+# bit 1 (1-based) is polarity, bits 2-8 x, bits 9-15 y, and bit 16 special
+dvs128YShiftBits = 8
+dvs128XShiftBits = 1
+dvs128PolarityShiftBits = 0
+dvs128SpecialMask = int('8000', 16)
+
+# The inverse of the importer's conversion factors: jaer defaults of 8 g
+# full scale for accel and 1000 deg/s for gyro, over 16 bit samples
+accelScale = 8192.0
+gyroScale = 65.535
+temperatureScale = 340.0
+temperatureOffset = 35.0
+
+# Events are merged and written this many at a time (roughly; frames are
+# not split between chunks)
+exportChunkSize = 2 ** 22
+# Size of the buffer of the output file (bytes)
+exportBufferSize = 2 ** 24
+
+def MonotonicKeys(timeStamps):
+    """
+    Returns the timestamps as uint64 if they never go backwards (without a
+    copy, if they are already uint64), or else the latest timestamp up to
+    each one.
+    """
+
+    timeStamps = np.asarray(timeStamps)
+    for blockStart in range(0, len(timeStamps), exportChunkSize):
+        block = timeStamps[blockStart : blockStart + exportChunkSize + 1]
+        if np.any(block[1 : ] < block[0 : -1]):
+            return np.maximum.accumulate(timeStamps.astype(np.uint64))
+    return timeStamps.astype(np.uint64, copy=False)
+
+def LowTimeStamps(timeStamps):
+    """
+    The timestamps modulo 2^32.
+    """
+
+    return np.asarray(timeStamps).astype(np.uint32)
+
+def EncodePolarity(polarity, start, end, dvs128):
+    y = polarity['y'][start : end].astype(np.uint32)
+    x = polarity['x'][start : end].astype(np.uint32)
+    polarityBit = polarity['polarity'][start : end].astype(np.uint32)
+    if dvs128:
+        np.left_shift(y, dvs128YShiftBits, out=y)
+        np.left_shift(x, dvs128XShiftBits, out=x)
+        np.left_shift(polarityBit, dvs128PolarityShiftBits, out=polarityBit)
+    else:
+        np.left_shift(y, yShiftBits, out=y)
+        np.left_shift(x, xShiftBits, out=x)
+        np.left_shift(polarityBit, polarityShiftBits, out=polarityBit)
+    address = np.bitwise_or(y, x, out=y)
+    np.bitwise_or(address, polarityBit, out=address)
+    return address, LowTimeStamps(polarity['timeStamp'][start : end])
+
+def EncodeSpecial(special, start, end, dvs128):
+    address = np.empty(end - start, np.uint32)
+    address[:] = dvs128SpecialMask if dvs128 else signalOrSpecialMask
+    return address, LowTimeStamps(special['timeStamp'][start : end])
+
+def FrameGeometry(frame, frameIndex):
+    """
+    Returns (xPosition, yPosition, xLength, yLength) of a frame.
+    """
+
+    samples = frame['samples'][frameIndex]
+    if 'xLength' in frame and 'yLength' in frame:
+        xLength = int(frame['xLength'][frameIndex])
+        yLength = int(frame['yLength'][frameIndex])
+    else:
+        yLength, xLength = samples.shape[0 : 2]
+    xPosition = int(frame['xPosition'][frameIndex]) if 'xPosition' in frame else 0
+    yPosition = int(frame['yPosition'][frameIndex]) if 'yPosition' in frame else 0
+    return xPosition, yPosition, xLength, yLength
+
+def FrameGeometries(frame, start, end):
+    """
+    Returns arrays of the xPosition, yPosition, xLength and yLength of the
+    frames from start to end - 1, as FrameGeometry gives them.
+    """
+
+    numFrames = end - start
+    samples = frame['samples']
+    if 'xLength' in frame and 'yLength' in frame:
+        xLengths = np.asarray(frame['xLength'][start : end], np.int64)
+        yLengths = np.asarray(frame['yLength'][start : end], np.int64)
+    elif isinstance(samples, np.ndarray) and samples.dtype != object:
+        xLengths = np.full(numFrames, samples.shape[2], np.int64)
+        yLengths = np.full(numFrames, samples.shape[1], np.int64)
+    else:
+        shapes = np.array([np.shape(samples[frameIndex])[0 : 2]
+                           for frameIndex in range(start, end)], np.int64).reshape(-1, 2)
+        yLengths = shapes[:, 0]
+        xLengths = shapes[:, 1]
+    if 'xPosition' in frame:
+        xPositions = np.asarray(frame['xPosition'][start : end], np.int64)
+    else:
+        xPositions = np.zeros(numFrames, np.int64)
+    if 'yPosition' in frame:
+        yPositions = np.asarray(frame['yPosition'][start : end], np.int64)
+    else:
+        yPositions = np.zeros(numFrames, np.int64)
+    return xPositions, yPositions, xLengths, yLengths
+
+def EncodeFrames(frame, start, end, dvs128):
+    frameStream = FrameStream.fromDict('frame', frame)
+    startTimeStamps = np.asarray(frame[frameStream.firstTimeStampColumn()][start : end])
+    endTimeStamps = np.asarray(frame[frameStream.lastTimeStampColumn()][start : end])
+    geometries = np.stack(FrameGeometries(frame, start, end), 1)
+    numReads = 1 if 'reset' in frame else 2
+    frameSizes = numReads * geometries[:, 2] * geometries[:, 3]
+    frameEnds = np.cumsum(frameSizes)
+    timeStamps = np.repeat(startTimeStamps.astype(np.uint64), frameSizes)
+    timeStamps[frameEnds[frameSizes > 0] - 1] = endTimeStamps[frameSizes > 0]
+
+    # The frames of each geometry are encoded together, the pixel addresses
+    # being worked out once and or'd into the samples of all of them
+    shapes, shapeIndices = np.unique(geometries, axis=0, return_inverse=True)
+    addresses = np.empty(frameEnds[-1], np.uint32)
+    for shapeIndex, (xPosition, yPosition, xLength, yLength) in enumerate(shapes):
+        numPixels = xLength * yLength
+        if numPixels == 0:
+            continue
+        frameIndices = np.flatnonzero(shapeIndices == shapeIndex)
+        # Samples are read out column by column, x going up and y coming down
+        x = np.repeat(np.arange(xPosition, xPosition + xLength, dtype=np.uint32), yLength)
+        y = np.tile(np.arange(yPosition + yLength - 1, yPosition - 1, -1, dtype=np.uint32), xLength)
+        pixelAddress = np.left_shift(y, yShiftBits)
+        pixelAddress |= np.left_shift(x, xShiftBits)
+        pixelAddress |= apsOrImuMask
+        if isinstance(frame['samples'], np.ndarray) and frame['samples'].dtype != object:
+            samples = frame['samples'][start + frameIndices, 0 : yLength, 0 : xLength]
+        else:
+            samples = np.stack([np.asarray(frame['samples'][start + frameIndex])[0 : yLength, 0 : xLength]
+                                for frameIndex in frameIndices])
+        samples = samples.reshape(len(frameIndices), yLength, xLength)[:, ::-1, :]
+        samples = np.bitwise_and(samples.transpose(0, 2, 1), frameSampleMask).astype(np.uint32)
+        samples = samples.reshape(len(frameIndices), numPixels)
+        reads = np.empty((len(frameIndices), numReads, numPixels), np.uint32)
+        if 'reset' in frame:
+            # A reset read, or a signal read, as the frame was imported
+            readFlags = np.where(np.asarray(frame['reset'])[start + frameIndices],
+                                 0, signalOrSpecialMask).astype(np.uint32)
+            np.bitwise_or(samples, readFlags[:, np.newaxis], out=reads[:, 0, :])
+            np.bitwise_or(reads[:, 0, :], pixelAddress, out=reads[:, 0, :])
+        else:
+            reads[:, 0, :] = pixelAddress | frameSampleMask
+            np.subtract(frameSampleMask, samples, out=reads[:, 1, :])
+            np.bitwise_or(reads[:, 1, :], pixelAddress | signalOrSpecialMask, out=reads[:, 1, :])
+        reads = reads.reshape(len(frameIndices), numReads * numPixels)
+        if len(shapes) == 1:
+            addresses = reads.ravel()
+        else:
+            addresses[(frameEnds[frameIndices] - reads.shape[1])[:, np.newaxis]
+                      + np.arange(reads.shape[1])] = reads
+    return addresses, LowTimeStamps(timeStamps)
+
+def FrameSizes(frame):
+    """
+    The number of events written for each frame.
+    """
+
+    numReads = 1 if 'reset' in frame else 2
+    xPositions, yPositions, xLengths, yLengths = FrameGeometries(frame, 0, len(frame['samples']))
+    return numReads * xLengths * yLengths
+
+def EncodeImu6(imu6, start, end, dvs128):
+    numSamples = end - start
+    values = np.zeros((numSamples, 7))
+    values[:, 0] = imu6['accelX'][start : end] * accelScale
+    values[:, 1] = imu6['accelY'][start : end] * accelScale
+    values[:, 2] = imu6['accelZ'][start : end] * accelScale
+    if 'temperature' in imu6:
+        values[:, 3] = (imu6['temperature'][start : end] - temperatureOffset) * temperatureScale
+    values[:, 4] = imu6['gyroX'][start : end] * gyroScale
+    values[:, 5] = imu6['gyroY'][start : end] * gyroScale
+    values[:, 6] = imu6['gyroZ'][start : end] * gyroScale
+    # Each value is an int16, held in bits 13-28 (1-based)
+    values = np.clip(np.round(values), -32768, 32767).astype(np.int16)
+    address = values.view(np.uint16).astype(np.uint32)
+    np.left_shift(address, imuDataShiftBits, out=address)
+    address |= np.left_shift(np.arange(7, dtype=np.uint32), imuTypeShiftBits)
+    address |= imuFlags
+    timeStamps = np.repeat(LowTimeStamps(imu6['timeStamp'][start : end]), 7)
+    return address.ravel(), timeStamps
+
+def ExportAedat2(aedat):
+
+    if 'exportParams' not in aedat or 'filePath' not in aedat['exportParams']:
+        raise Exception('Missing parameter exportParams.filePath')
+    exportParams = aedat['exportParams']
+
+    # For source, use an override if it has been given. This allows data from
+    # one sensor to masquerade as data from another sensor.
+    if 'source' in exportParams:
+        source = exportParams['source']
+    else:
+        source = aedat['info'].get('source', 'Davis240C')
+    dvs128 = source == 'Dvs128'
+
+    # For each data type: the (monotonic) merge key of each unit - an event,
+    # a frame or an IMU sample - the number of events written per unit, and
+    # the function which encodes a range of units
+    streams = []
+    data = aedat['data']
+    for dataType, encode in (('special', EncodeSpecial),
+                             ('polarity', EncodePolarity),
+                             ('frame', EncodeFrames),
+                             ('imu6', EncodeImu6)):
+        if dataType not in data \
+                or ('dataTypes' in exportParams and dataType not in exportParams['dataTypes']):
+            continue
+        if dataType == 'frame':
+            frameStream = FrameStream.fromDict('frame', data['frame'])
+            if frameStream.numEvents == 0:
+                continue
+            keys = MonotonicKeys(data['frame'][frameStream.firstTimeStampColumn()])
+            unitSizes = FrameSizes(data['frame'])
+        else:
+            keys = MonotonicKeys(data[dataType]['timeStamp'])
+            unitSizes = np.full(len(keys), 7 if dataType == 'imu6' else 1, np.int64)
+        if len(keys) > 0:
+            streams.append((data[dataType], keys, unitSizes, encode))
+
+    # The chunks are cut at the units of the type with the most events
+    largestStream = max(streams, key=lambda stream: stream[2].sum()) if streams else None
+    if largestStream is None:
+        chunkBoundaries = []
+    else:
+        unitsPerChunk = max(exportChunkSize * len(largestStream[2]) // largestStream[2].sum(), 1)
+        chunkBoundaries = largestStream[1][unitsPerChunk : : unitsPerChunk]
+
+    numBytesPerEvent, eventFormat = EventFormatVersion1or2(2)
+    numEventsWritten = 0
+    with open(exportParams['filePath'], 'wb', exportBufferSize) as fileHandle:
+        if not exportParams.get('noHeader', False):
+            # CRLF \r\n is needed to not break header parsing in jAER
+            fileHandle.write('#!AER-DAT2.0\r\n')
+            fileHandle.write('# This is a raw AE data file created by an export function in the AedatTools library\r\n')
+            fileHandle.write('# Data format is int32 address, int32 timestamp (8 bytes total), repeated for each event\r\n')
+            fileHandle.write('# Timestamps tick is 1 us\r\n')
+            fileHandle.write('# AEChip: ' + source + '\r\n')
+            fileHandle.write('# End of ASCII Header\r\n')
+
+        unitStarts = [0] * len(streams)
+        for chunk in range(len(chunkBoundaries) + 1):
+            chunkAddresses = []
+            chunkTimeStamps = []
+            chunkKeys = []
+            for streamIndex, (typeData, keys, unitSizes, encode) in enumerate(streams):
+                start = unitStarts[streamIndex]
+                if chunk < len(chunkBoundaries):
+                    end = max(int(np.searchsorted(keys, chunkBoundaries[chunk], 'left')), start)
+                else:
+                    end = len(keys)
+                if end == start:
+                    continue
+                address, timeStamps = encode(typeData, start, end, dvs128)
+                chunkAddresses.append(address)
+                chunkTimeStamps.append(timeStamps)
+                chunkKeys.append(np.repeat(keys[start : end], unitSizes[start : end]))
+                unitStarts[streamIndex] = end
+            if len(chunkAddresses) == 0:
+                continue
+
+            events = np.empty(sum(len(address) for address in chunkAddresses), eventFormat)
+            if len(chunkAddresses) == 1:
+                events['addr'] = chunkAddresses[0]
+                events['ts'] = chunkTimeStamps[0]
+            else:
+                # A stable sort, so the order within each type is kept
+                order = np.argsort(np.concatenate(chunkKeys), kind='mergesort')
+                events['addr'] = np.concatenate(chunkAddresses)[order]
+                events['ts'] = np.concatenate(chunkTimeStamps)[order]
+            events.tofile(fileHandle)
+            numEventsWritten += len(events)
+
+    print 'Wrote %d events to %s' % (numEventsWritten, exportParams['filePath'])
+    return aedat
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+"""
+ExportAedat3
+
+Exports data to a .aedat file in format version 3.1, as ExportAedat3.m does
+(for point2D only), and as ImportAedatDataVersion3 reads it. The .aedat file
+format is documented here:
+http://inilabs.com/support/software/fileformat/
+
+The file is a header ending in '#!END-HEADER', then packets, each a 28 byte
+header (eventType, eventSource, eventSize, eventTSOffset, eventTSOverflow,
+eventCapacity, eventNumber, eventValid) followed by the events of one type.
+Special, polarity, frame, imu6 and point1D-3D data are exported; each type
+is cut into packets of up to packetSize events (frames: as many as fit in
+maxPacketBytes), whose events are encoded from the columns in one go, and
+the packets of all the types are written in time order of their first
+events.
+
+The 32 bit timestamps in a packet are relative to its eventTSOverflow (in
+units of 2^31 us) and to the last TIMESTAMP_RESET special event before it in
+the file; packets are cut wherever either changes, so that the importer
+gets the same uint64 timestamps back. Timestamps are taken to be monotonic
+within each type. Special events without an address (e.g. from an aedat2
+file) are written as external input pulses.
+
+The packet index which ImportAedatDataVersion3 would build for the file is
+collected as the packets are written, and saved in the sidecar file (see
+PacketIndex), so the file needn't be indexed before its first import.
+
+Parameters, in aedat['exportParams']:
+    filePath
+    source - overrides aedat['info']['source'], so that data from one sensor
+        can masquerade as data from another
+    dataTypes - the data types to export; by default, all of them
+    packetSize - the most events in a packet (default defaultPacketSize)
+    packetIndexFile - if False, the packet index sidecar isn't written
+"""
+
+import struct
+import time
+import numpy as np
+from PyAedatTools.ImportAedatDataVersion3 import timeStampResetType
+from PyAedatTools.ExportAedat2 import MonotonicKeys
+from PyAedatTools.ExportAedat2 import FrameGeometry
+from PyAedatTools.EventStream import FrameStream
+from PyAedatTools.PacketIndex import SavePacketIndex
+
+# Packet event types, by data type, in the order in which packets with the
+# same first timestamp are written
+eventTypesByDataType = (('special', 0),
+                        ('polarity', 1),
+                        ('frame', 2),
+                        ('imu6', 3),
+                        ('point1D', 8),
+                        ('point2D', 9),
+                        ('point3D', 10))
+
+# The layouts of the events of each type, as the importer reads them
+specialDataFormat = np.dtype([('info', '<u4'), ('timeStamp', '<i4')])
+polarityDataFormat = np.dtype([('address', '<u4'), ('timeStamp', '<i4')])
+imu6DataFormat = np.dtype([('info', '<u4'),
+                           ('timeStamp', '<i4'),
+                           ('accelX', '<f4'),
+                           ('accelY', '<f4'),
+                           ('accelZ', '<f4'),
+                           ('gyroX', '<f4'),
+                           ('gyroY', '<f4'),
+                           ('gyroZ', '<f4'),
+                           ('temperature', '<f4')])
+point1DDataFormat = np.dtype([('info', '<u4'),
+                              ('x', '<f4'),
+                              ('timeStamp', '<i4')])
+point2DDataFormat = np.dtype([('info', '<u4'),
+                              ('x', '<f4'),
+                              ('y', '<f4'),
+                              ('timeStamp', '<i4')])
+point3DDataFormat = np.dtype([('info', '<u4'),
+                              ('x', '<f4'),
+                              ('y', '<f4'),
+                              ('z', '<f4'),
+                              ('timeStamp', '<i4')])
+frameHeaderLength = 36
+
+def FrameDataFormat(eventSize):
+    return np.dtype({
+        'names': ['info', 'timeStamps', 'xLength', 'yLength',
+                  'xPosition', 'yPosition', 'samples'],
+        'formats': ['<u4', ('<i4', (4, )), '<i4', '<i4',
+                    '<i4', '<i4', ('<u2', ((eventSize - frameHeaderLength) // 2, ))],
+        'offsets': [0, 4, 20, 24, 28, 32, 36],
+        'itemsize': eventSize})
+
+# The special event type written for special events without an address
+externalInputPulseType = 4
+
+polarityYShiftBits = 2
+polarityXShiftBits = 17
+frameColorChannelsShiftBits = 1
+frameColorFilterShiftBits = 4
+frameRoiIdShiftBits = 7
+# aedat3 uses left-justified 16 bit samples
+frameSampleShiftBits = 6
+
+# eventTSOverflow counts in these
+timeStampOverflowPeriod = 2 ** 31
+
+defaultPacketSize = 4096
+# Packets of frames are cut to about this size (bytes)
+maxPacketBytes = 2 ** 22
+# Size of the buffer of the output file (bytes)
+exportBufferSize = 2 ** 24
+
+def ValidBits(typeData, start, end):
+    if 'valid' in typeData:
+        return typeData['valid'][start : end].astype(np.uint32)
+    return np.ones(end - start, np.uint32)
+
+def RawTimeStamps(timeStamps, timeStampBase):
+    """
+    The timestamps as written: relative to the packet's timestamp base
+    (reset offset + overflow).
+    """
+
+    return np.asarray(timeStamps).astype(np.uint64) - np.uint64(timeStampBase)
+
+def EncodeSpecial(special, start, end, timeStampBase):
+    events = np.empty(end - start, specialDataFormat)
+    if 'address' in special:
+        address = special['address'][start : end].astype(np.uint32)
+    else:
+        address = np.full(end - start, externalInputPulseType, np.uint32)
+    events['info'] = np.bitwise_or(ValidBits(special, start, end), np.left_shift(address, 1))
+    events['timeStamp'] = RawTimeStamps(special['timeStamp'][start : end], timeStampBase)
+    return events
+
+def EncodePolarity(polarity, start, end, timeStampBase):
+    events = np.empty(end - start, polarityDataFormat)
+    address = ValidBits(polarity, start, end)
+    address |= np.left_shift(polarity['polarity'][start : end].astype(np.uint32), 1)
+    address |= np.left_shift(polarity['y'][start : end].astype(np.uint32), polarityYShiftBits)
+    address |= np.left_shift(polarity['x'][start : end].astype(np.uint32), polarityXShiftBits)
+    events['address'] = address
+    events['timeStamp'] = RawTimeStamps(polarity['timeStamp'][start : end], timeStampBase)
+    return events
+
+def EncodeImu6(imu6, start, end, timeStampBase):
+    events = np.zeros(end - start, imu6DataFormat)
+    events['info'] = ValidBits(imu6, start, end)
+    events['timeStamp'] = RawTimeStamps(imu6['timeStamp'][start : end], timeStampBase)
+    for field in ('accelX', 'accelY', 'accelZ', 'gyroX', 'gyroY', 'gyroZ', 'temperature'):
+        if field in imu6:
+            events[field] = imu6[field][start : end]
+    return events
+
+def EncodePoint(dataFormat, fields):
+    def EncodePointType(point, start, end, timeStampBase):
+        events = np.empty(end - start, dataFormat)
+        info = ValidBits(point, start, end)
+        if 'type' in point:
+            info |= np.left_shift(point['type'][start : end].astype(np.uint32), 1)
+        events['info'] = info
+        for field in fields:
+            events[field] = point[field][start : end]
+        events['timeStamp'] = RawTimeStamps(point['timeStamp'][start : end], timeStampBase)
+        return events
+    return EncodePointType
+
+def FrameTimeStampColumns(frame):
+    """
+    The columns of the frame start, frame end, exposure start and exposure
+    end timestamps; if the frame timestamps have been simplified away, the
+    exposure timestamps stand in for them.
+    """
+
+    frameStream = FrameStream.fromDict('frame', frame)
+    exposureStart = frameStream.firstTimeStampColumn()
+    exposureEnd = frameStream.lastTimeStampColumn()
+    return (frame.get('timeStampFrameStart', frame[exposureStart]),
+            frame.get('timeStampFrameEnd', frame[exposureEnd]),
+            frame[exposureStart],
+            frame[exposureEnd])
+
+def FrameSamples(frame, frameIndex):
+    """
+    The samples of a frame as a (yLength, xLength, colorChannels) array.
+    """
+
+    xPosition, yPosition, xLength, yLength = FrameGeometry(frame, frameIndex)
+    samples = frame['samples'][frameIndex]
+    if samples.ndim == 2:
+        samples = samples[:, :, np.newaxis]
+    colorChannels = int(frame['colorChannels'][frameIndex]) \
+        if 'colorChannels' in frame else samples.shape[2]
+    return samples[0 : yLength, 0 : xLength, 0 : colorChannels]
+
+def FrameEventSizes(frame):
+    return np.array([frameHeaderLength + 2 * FrameSamples(frame, frameIndex).size
+                     for frameIndex in range(len(frame['samples']))], np.int64)
+
+def EncodeFrames(frame, start, end, timeStampBase):
+    # eventSize allows for the largest frame in the packet
+    eventSize = frameHeaderLength + 2 * max(FrameSamples(frame, frameIndex).size
+                                            for frameIndex in range(start, end))
+    events = np.zeros(end - start, FrameDataFormat(eventSize))
+    info = ValidBits(frame, start, end)
+    for column, shiftBits in (('colorFilter', frameColorFilterShiftBits),
+                              ('roiId', frameRoiIdShiftBits)):
+        if column in frame:
+            info |= np.left_shift(frame[column][start : end].astype(np.uint32), shiftBits)
+    for position, timeStamps in enumerate(FrameTimeStampColumns(frame)):
+        events['timeStamps'][:, position] = RawTimeStamps(timeStamps[start : end], timeStampBase)
+    for frameIndex in range(start, end):
+        xPosition, yPosition, xLength, yLength = FrameGeometry(frame, frameIndex)
+        samples = FrameSamples(frame, frameIndex)
+        info[frameIndex - start] |= samples.shape[2] << frameColorChannelsShiftBits
+        event = events[frameIndex - start]
+        event['xLength'] = xLength
+        event['yLength'] = yLength
+        event['xPosition'] = xPosition
+        event['yPosition'] = yPosition
+        # Interleaved by colour channel, then along x, then y
+        event['samples'][0 : samples.size] = np.left_shift(
+            samples.ravel().astype(np.uint16), frameSampleShiftBits)
+    events['info'] = info
+    return events
+
+encodersByDataType = {'special': EncodeSpecial,
+                      'polarity': EncodePolarity,
+                      'frame': EncodeFrames,
+                      'imu6': EncodeImu6,
+                      'point1D': EncodePoint(point1DDataFormat, ('x', )),
+                      'point2D': EncodePoint(point2DDataFormat, ('x', 'y')),
+                      'point3D': EncodePoint(point3DDataFormat, ('x', 'y', 'z'))}
+
+def PacketBoundaries(numEvents, packetSize, cuts):
+    """
+    Returns the (starts, ends) of packets of up to packetSize events, which
+    are also cut at each position in cuts.
+    """
+
+    cuts = np.unique(np.concatenate(([0, numEvents], np.asarray(cuts, np.int64))))
+    cuts = cuts[np.logical_and(cuts >= 0, cuts <= numEvents)]
+    starts = np.concatenate([np.arange(segmentStart, segmentEnd, packetSize, dtype=np.int64)
+                             for segmentStart, segmentEnd in zip(cuts[0 : -1], cuts[1 : ])]
+                            + [np.zeros(0, np.int64)])
+    return starts, np.append(starts[1 : ], numEvents).astype(np.int64)
+
+def OverflowBoundaries(resetTimeStamps, lastTimeStamp):
+    """
+    The timestamps at which the eventTSOverflow of a packet goes up:
+    every 2^31 us after each reset (or 0).
+    """
+
+    boundaries = []
+    epochStarts = [0] + list(resetTimeStamps)
+    epochEnds = list(resetTimeStamps) + [lastTimeStamp + 1]
+    for epochStart, epochEnd in zip(epochStarts, epochEnds):
+        boundaries.extend(range(epochStart + timeStampOverflowPeriod, epochEnd,
+                                timeStampOverflowPeriod))
+    return np.array(boundaries, np.uint64)
+
+def ExportAedat3(aedat):
+
+    if 'exportParams' not in aedat or 'filePath' not in aedat['exportParams']:
+        raise Exception('Missing parameter exportParams.filePath')
+    exportParams = aedat['exportParams']
+
+    # For source, use an override if it has been given. This allows data from
+    # one sensor to masquerade as data from another sensor.
+    if 'source' in exportParams:
+        source = exportParams['source']
+    else:
+        source = aedat['info'].get('source', 'Davis240C')
+    packetSize = int(exportParams.get('packetSize', defaultPacketSize))
+    if packetSize < 1:
+        raise Exception('The packetSize parameter is %d, but must be at least 1' % packetSize)
+
+    data = aedat['data']
+    dataTypes = [(dataType, eventType) for dataType, eventType in eventTypesByDataType
+                 if dataType in data
+                 and ('dataTypes' not in exportParams or dataType in exportParams['dataTypes'])]
+
+    # The (monotonic) timestamps which order the events of each type; frames
+    # are ordered by their frame start
+    keysByDataType = {}
+    for dataType, eventType in dataTypes:
+        if dataType == 'frame':
+            keysByDataType[dataType] = MonotonicKeys(FrameTimeStampColumns(data['frame'])[0])
+        else:
+            keysByDataType[dataType] = MonotonicKeys(data[dataType]['timeStamp'])
+    lastTimeStamp = max([int(keys[-1]) for keys in keysByDataType.values() if len(keys) > 0] + [0])
+
+    # After each TIMESTAMP_RESET special event, time carries on from the
+    # reset's timestamp
+    resetIndices = np.zeros(0, np.int64)
+    if 'special' in keysByDataType and 'address' in data['special']:
+        resetLogical = data['special']['address'] == timeStampResetType
+        if 'valid' in data['special']:
+            resetLogical = np.logical_and(resetLogical, data['special']['valid'])
+        resetIndices = np.flatnonzero(resetLogical)
+    resetTimeStamps = keysByDataType['special'][resetIndices] if len(resetIndices) > 0 \
+        else np.zeros(0, np.uint64)
+    resetOffsets = np.append(np.uint64(0), resetTimeStamps).astype(np.uint64)
+    overflowBoundaries = OverflowBoundaries([int(resetTimeStamp) for resetTimeStamp in resetTimeStamps],
+                                            lastTimeStamp)
+
+    # Cut each type into packets, and find each packet's timestamp base and
+    # its place in the file
+    packetDataTypes = []
+    packetColumns = {'eventType': [], 'start': [], 'end': [], 'key': [],
+                     'firstTimeStamp': [], 'resetOffset': [], 'overflow': []}
+    for dataType, eventType in dataTypes:
+        keys = keysByDataType[dataType]
+        numEvents = len(keys)
+        if numEvents == 0:
+            continue
+        typePacketSize = packetSize
+        if dataType == 'frame':
+            typePacketSize = max(min(packetSize,
+                                     maxPacketBytes // int(FrameEventSizes(data['frame']).max())), 1)
+        cuts = np.searchsorted(keys, overflowBoundaries, 'left')
+        if dataType == 'special':
+            # Special packets end at each reset, so that the reset applies
+            # from the next packet on
+            cuts = np.append(cuts, resetIndices + 1)
+        else:
+            cuts = np.append(cuts, np.searchsorted(keys, resetTimeStamps, 'left'))
+        starts, ends = PacketBoundaries(numEvents, typePacketSize, cuts)
+        firstTimeStamps = keys[starts]
+        if dataType == 'special':
+            epochs = np.searchsorted(resetIndices, starts, 'left')
+            # A packet ending in a reset goes in the file at the reset's time
+            packetKeys = np.where(np.in1d(ends - 1, resetIndices), keys[ends - 1], firstTimeStamps)
+        else:
+            epochs = np.searchsorted(resetTimeStamps, firstTimeStamps, 'right')
+            packetKeys = firstTimeStamps
+        packetResetOffsets = resetOffsets[epochs]
+        packetDataTypes.extend([dataType] * len(starts))
+        packetColumns['eventType'].append(np.full(len(starts), eventType, np.int64))
+        packetColumns['start'].append(starts)
+        packetColumns['end'].append(ends)
+        packetColumns['key'].append(packetKeys.astype(np.uint64))
+        packetColumns['firstTimeStamp'].append(firstTimeStamps.astype(np.uint64))
+        packetColumns['resetOffset'].append(packetResetOffsets)
+        packetColumns['overflow'].append(
+            (firstTimeStamps - packetResetOffsets) // np.uint64(timeStampOverflowPeriod))
+    for column in packetColumns:
+        packetColumns[column] = np.concatenate(packetColumns[column] + [np.zeros(0, np.int64)])
+    numPackets = len(packetDataTypes)
+    # By time, then by type, then in order within the type
+    packetOrder = np.lexsort((np.arange(numPackets), packetColumns['eventType'],
+                              packetColumns['key']))
+
+    # The packet index, as ImportAedatDataVersion3 builds it
+    info = {'packetTypes': packetColumns['eventType'][packetOrder].astype(np.uint16),
+            'packetPointers': np.zeros(numPackets, np.uint64),
+            'packetTimeStamps': packetColumns['firstTimeStamp'][packetOrder].astype(np.uint64),
+            'packetEventNumbers': (packetColumns['end'] - packetColumns['start'])[packetOrder].astype(np.uint32),
+            'packetResetOffsets': packetColumns['resetOffset'][packetOrder].astype(np.uint64),
+            'packetIndexComplete': True,
+            'numPackets': numPackets}
+
+    numEventsWritten = 0
+    with open(exportParams['filePath'], 'wb', exportBufferSize) as fileHandle:
+        # CRLF \r\n is needed to not break header parsing in jAER
+        fileHandle.write('#!AER-DAT3.1\r\n')
+        fileHandle.write('#Format: RAW\r\n')
+        fileHandle.write('#Source 0: ' + source + '\r\n')
+        fileHandle.write('#Start-Time: ' + time.strftime('%Y-%m-%d %H:%M:%S (TZ%z)') + '\r\n')
+        fileHandle.write('#!END-HEADER\r\n')
+        info['beginningOfDataPointer'] = fileHandle.tell()
+
+        for packetNumber, packet in enumerate(packetOrder):
+            dataType = packetDataTypes[packet]
+            start = int(packetColumns['start'][packet])
+            end = int(packetColumns['end'][packet])
+            timeStampBase = int(packetColumns['resetOffset'][packet]) \
+                + int(packetColumns['overflow'][packet]) * timeStampOverflowPeriod
+            events = encodersByDataType[dataType](data[dataType], start, end, timeStampBase)
+            eventSize = events.dtype.itemsize
+            eventTsOffset = events.dtype.fields['timeStamps' if dataType == 'frame' else 'timeStamp'][1]
+            # The first field of every type holds the valid bit
+            numValid = int(np.count_nonzero(np.bitwise_and(events[events.dtype.names[0]], 0x1)))
+            info['packetPointers'][packetNumber] = fileHandle.tell()
+            fileHandle.write(struct.pack('<hhIIIIII', packetColumns['eventType'][packet], 0,
+                                         eventSize, eventTsOffset,
+                                         int(packetColumns['overflow'][packet]),
+                                         len(events), len(events), numValid))
+            events.tofile(fileHandle)
+            numEventsWritten += len(events)
+
+    print 'Wrote %d events in %d packets to %s' % (numEventsWritten, numPackets, exportParams['filePath'])
+
+    if exportParams.get('packetIndexFile', True):
+        SavePacketIndex({'importParams': {'filePath': exportParams['filePath']}, 'info': info})
+    return aedat
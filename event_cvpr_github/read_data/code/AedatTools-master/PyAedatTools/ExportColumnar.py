@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+"""
+ExportColumnar
+
+Exports the data of an aedat dict (e.g. from ImportAedat) to a columnar
+store, so that it can be read back (with ImportColumnar) without parsing the
+.aedat file again.
+
+exportParams['filePath'] is a directory, into which one table per data type
+is written (polarity, frame, imu6, special, point1D etc). Each holds the
+columns of its data type, in row groups of rowGroupSize events, sorted by
+timestamp (events which aren't in time order are sorted, stably), with the
+min/max of every column in each row group, so that a reader can skip the row
+groups outside a time window.
+
+A table is either:
+    a directory of .npz files, needing only numpy (the default), with the
+        row groups as the chunks of ColumnChunks: rowGroup000000.npz,
+        rowGroup000001.npz, ..., and index.npz, holding the number of rows
+        and the min/max of each column for every row group;
+    a Parquet file, <dataType>.parquet, if format is 'parquet' (this needs
+        pyarrow), whose own row group statistics hold the min/max. (Arrow
+        IPC files aren't written, as they keep no statistics to skip row
+        groups by.)
+
+Frames are ordered by their first timestamp column (see FrameStream). Their
+samples are held as an array of frames, padded where the frames are of
+different sizes (see ColumnChunks); in a Parquet file, the samples of each
+frame are a binary value, with the frame's shape in samplesHeight,
+samplesWidth and samplesChannels (0 for frames without a colour channel
+axis). Row groups of frames are cut to about rowGroupBytes.
+
+Each table is written under a temporary name and moved into place, so a
+reader never sees half of one; a manifest (manifest.npz), written last,
+lists the tables of the export, their formats and timestamp columns, and
+info['source']. Tables left in the directory by an earlier export, which
+aren't in the manifest, aren't read.
+
+Parameters, in aedat['exportParams']:
+    filePath - the directory; it is made if it doesn't exist
+    dataTypes - the data types to export; by default, all of them
+    rowGroupSize - events per row group (default defaultRowGroupSize)
+    format - 'npz' (default) or 'parquet'
+    compression - for 'npz', True to compress the row groups (default
+        False); for 'parquet', as for pyarrow.parquet (default 'snappy')
+"""
+
+import os
+import shutil
+import numpy as np
+from PyAedatTools.EventStream import FrameStream
+from PyAedatTools.EventStream import StreamsFromData
+from PyAedatTools.ColumnChunks import ChunkFileName
+from PyAedatTools.ColumnChunks import FrameSamplesArray
+from PyAedatTools.ColumnChunks import SaveChunk
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+defaultRowGroupSize = 2 ** 20
+# Row groups of frames are cut to about this size (bytes)
+rowGroupBytes = 2 ** 26
+
+samplesShapeColumns = ('samplesHeight', 'samplesWidth', 'samplesChannels')
+tableFormats = ('npz', 'parquet')
+
+def ManifestFilePath(directory):
+    return os.path.join(directory, 'manifest.npz')
+
+def TablePath(directory, dataType, tableFormat):
+    if tableFormat == 'parquet':
+        return os.path.join(directory, dataType + '.parquet')
+    return os.path.join(directory, dataType)
+
+def RowGroupFilePath(tablePath, rowGroup):
+    return os.path.join(tablePath, ChunkFileName('rowGroup', rowGroup))
+
+def RemovePath(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def ColumnsFromStream(stream):
+    """
+    Returns the columns of an EventStream as a list of (name, array), with
+    the timestamp column first and the rest in name order.
+    """
+
+    timeStampColumn = stream.firstTimeStampColumn()
+    return [(name, np.asarray(stream.columns[name])) for name
+            in sorted(stream.columns, key=lambda name: (name != timeStampColumn, name))]
+
+def WriteNpzTable(tablePath, stream, numRows, compression):
+    """
+    Writes the row groups of a stream, and their index, into a directory of
+    .npz files.
+    """
+
+    os.makedirs(tablePath)
+    numRowsByGroup = []
+    minimums = {}
+    maximums = {}
+    for start in range(0, stream.numEvents, numRows):
+        columns = ColumnsFromStream(stream[start : start + numRows])
+        for name, column in columns:
+            if name != 'samples':
+                minimums.setdefault(name, []).append(column.min())
+                maximums.setdefault(name, []).append(column.max())
+        SaveChunk(RowGroupFilePath(tablePath, len(numRowsByGroup)), dict(columns), compression)
+        numRowsByGroup.append(len(columns[0][1]))
+    index = {'numRows': np.array(numRowsByGroup, np.int64),
+             'columnNames': np.array([name for name, column in columns])}
+    for name in minimums:
+        index['minimum_' + name] = np.array(minimums[name])
+        index['maximum_' + name] = np.array(maximums[name])
+    np.savez(os.path.join(tablePath, 'index.npz'), **index)
+
+def WriteParquetTable(tablePath, stream, numRows, compression, metadata):
+    """
+    Writes the row groups of a stream into a Parquet file.
+    """
+
+    writer = None
+    try:
+        for start in range(0, stream.numEvents, numRows):
+            names = []
+            arrays = []
+            for name, column in ColumnsFromStream(stream[start : start + numRows]):
+                if name == 'samples':
+                    names.append(name)
+                    arrays.append(pa.array([np.ascontiguousarray(frameSamples, np.uint16).tostring()
+                                            for frameSamples in column], pa.binary()))
+                    frameShape = np.zeros(3, np.int32)
+                    frameShape[0 : column.ndim - 1] = column.shape[1 : ]
+                    for axis, shapeColumn in enumerate(samplesShapeColumns):
+                        names.append(shapeColumn)
+                        arrays.append(pa.array(np.repeat(frameShape[axis], len(column))))
+                else:
+                    names.append(name)
+                    arrays.append(pa.array(column))
+            table = pa.Table.from_arrays(arrays, names, metadata=metadata)
+            if writer is None:
+                # Format version 2.0 keeps uint32 columns as uint32
+                writer = pq.ParquetWriter(tablePath, table.schema, version='2.0',
+                                          compression=compression)
+            writer.write_table(table, row_group_size=table.num_rows)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def ExportColumnar(aedat):
+
+    if 'exportParams' not in aedat or 'filePath' not in aedat['exportParams']:
+        raise Exception('Missing parameter exportParams.filePath')
+    exportParams = aedat['exportParams']
+    directory = exportParams['filePath']
+    tableFormat = exportParams.get('format', 'npz')
+    if tableFormat not in tableFormats:
+        raise Exception('The format parameter should be \'npz\' or \'parquet\', not %s' % tableFormat)
+    if tableFormat == 'parquet' and pa is None:
+        raise Exception('pyarrow is needed to write Parquet files; leave out the format parameter for tables of .npz files')
+    rowGroupSize = int(exportParams.get('rowGroupSize', defaultRowGroupSize))
+    if rowGroupSize < 1:
+        raise Exception('The rowGroupSize parameter is %d, but must be at least 1' % rowGroupSize)
+    if tableFormat == 'parquet':
+        compression = exportParams.get('compression', 'snappy')
+    else:
+        compression = exportParams.get('compression', False)
+    source = aedat.get('info', {}).get('source', '')
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Until the new manifest is written, the directory is an unfinished export
+    RemovePath(ManifestFilePath(directory))
+
+    streams = StreamsFromData(aedat['data'])
+    manifest = {'dataTypes': [], 'formats': [], 'timeStampColumns': []}
+    for dataType in sorted(streams):
+        if 'dataTypes' in exportParams and dataType not in exportParams['dataTypes']:
+            continue
+        stream = streams[dataType]
+        if stream.numEvents == 0:
+            continue
+        numRows = rowGroupSize
+        if dataType == 'frame':
+            columns = dict(stream.columns)
+            columns['samples'] = FrameSamplesArray(columns)
+            stream = FrameStream(dataType, columns)
+            numRows = max(min(rowGroupSize, rowGroupBytes // max(stream['samples'][0].nbytes, 1)), 1)
+        timeStampColumn = stream.firstTimeStampColumn()
+        timeStamps = np.asarray(stream[timeStampColumn])
+        if np.any(timeStamps[1 : ] < timeStamps[0 : -1]):
+            stream = stream[np.argsort(timeStamps, kind='mergesort')]
+
+        tablePath = TablePath(directory, dataType, tableFormat)
+        tempTablePath = tablePath + '.tmp'
+        RemovePath(tempTablePath)
+        try:
+            if tableFormat == 'parquet':
+                metadata = {'dataType': dataType,
+                            'timeStampColumn': timeStampColumn,
+                            'source': source}
+                WriteParquetTable(tempTablePath, stream, numRows, compression, metadata)
+            else:
+                WriteNpzTable(tempTablePath, stream, numRows, compression)
+        except:
+            RemovePath(tempTablePath)
+            raise
+        # A table of the other format, from an earlier export, goes too
+        for otherFormat in tableFormats:
+            RemovePath(TablePath(directory, dataType, otherFormat))
+        os.rename(tempTablePath, tablePath)
+        manifest['dataTypes'].append(dataType)
+        manifest['formats'].append(tableFormat)
+        manifest['timeStampColumns'].append(timeStampColumn)
+        print 'Wrote %d %s events to %s' % (stream.numEvents, dataType, tablePath)
+
+    np.savez(ManifestFilePath(directory), source=source,
+             **dict((field, np.array(manifest[field], str)) for field in manifest))
+    return aedat
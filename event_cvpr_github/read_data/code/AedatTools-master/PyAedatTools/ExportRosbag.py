@@ -2,133 +2,241 @@
 
 # Henri Rebecq contributed the core of this code
 
-import sys
-sys.path.append('/usr/local/lib/python2.7/site-packages')
-sys.path.append('/opt/ros/kinetic/lib')
-sys.path.append('/opt/ros/kinetic/lib/python2.7/dist-packages')
-sys.path.append('/home/sim/catkin_ws/devel/lib/python2.7/dist-packages')
+"""
+Exports frames, polarity events and imu6 samples to a ROS bag, with the
+topics and message types of rpg_dvs_ros:
+    /dvs/image_raw - sensor_msgs/Image
+    /dvs/events - dvs_msgs/EventArray, of numEventsPerArray events each
+    /dvs/imu - sensor_msgs/Imu
+The bag is written by RosbagWriter, so no ROS install is needed.
+
+Rather than building a message object per event, the messages are
+serialised in bulk: each message type is laid out as a numpy structured
+dtype (EventArrayFormat etc), and the x, y, timeStamp and polarity columns
+are copied straight into an array of many messages at once. Since every
+EventArray message but the last holds the same number of events, they all
+have the same layout.
+
+The sensor size given in the EventArray messages comes from
+DeviceAddressSpace (of info['source']), or else from exportParams['width']
+and exportParams['height'], or else from the extent of the events.
+As in the original export, x is flipped (x' = width - 1 - x), unless
+exportParams['flipX'] is False.
+
+The rate of the polarity export is reported, and left in
+info['eventArrayExportRate'] (messages/second).
+"""
+
 import os
+import time
 import numpy as np
-#import cv2
-import rosbag
-from dvs_msgs.msg import Event, EventArray
-#from sensor_msgs.msg import CameraInfo
-#from sensor_msgs.msg import Image
-from sensor_msgs.msg import Imu
-from geometry_msgs.msg import Vector3
-from cv_bridge import CvBridge #, CvBridgeError
-import rospy
+from PyAedatTools.RosbagWriter import RosbagWriter
+from PyAedatTools.DeviceAddressSpace import DeviceAddressSpace
+
+separator = '=' * 80 + '\n'
+headerDefinition = 'MSG: std_msgs/Header\nuint32 seq\ntime stamp\nstring frame_id\n'
+
+eventArrayType = 'dvs_msgs/EventArray'
+eventArrayMd5 = '5e8beee5a6c107e504c2e78903c224b8'
+eventArrayDefinition = 'std_msgs/Header header\nuint32 height\nuint32 width\n' \
+    'dvs_msgs/Event[] events\n' + separator + headerDefinition + separator \
+    + 'MSG: dvs_msgs/Event\nuint16 x\nuint16 y\ntime ts\nbool polarity\n'
+
+imageType = 'sensor_msgs/Image'
+imageMd5 = '060021388200f6f0f447d0fcd9c64743'
+imageDefinition = 'std_msgs/Header header\nuint32 height\nuint32 width\n' \
+    'string encoding\nuint8 is_bigendian\nuint32 step\nuint8[] data\n' \
+    + separator + headerDefinition
+
+imuType = 'sensor_msgs/Imu'
+imuMd5 = '6a62c6daae103f4ff57a132d6f95cec2'
+imuDefinition = 'std_msgs/Header header\ngeometry_msgs/Quaternion orientation\n' \
+    'float64[9] orientation_covariance\ngeometry_msgs/Vector3 angular_velocity\n' \
+    'float64[9] angular_velocity_covariance\ngeometry_msgs/Vector3 linear_acceleration\n' \
+    'float64[9] linear_acceleration_covariance\n' + separator + headerDefinition \
+    + separator + 'MSG: geometry_msgs/Quaternion\nfloat64 x\nfloat64 y\nfloat64 z\nfloat64 w\n' \
+    + separator + 'MSG: geometry_msgs/Vector3\nfloat64 x\nfloat64 y\nfloat64 z\n'
+
+# std_msgs/Header, with an empty frame_id
+headerFormat = [('seq', '<u4'), ('secs', '<u4'), ('nsecs', '<u4'), ('frameIdLength', '<u4')]
+eventFormat = np.dtype([('x', '<u2'), ('y', '<u2'), ('secs', '<u4'), ('nsecs', '<u4'),
+                        ('polarity', 'u1')])
+vector3Format = [('x', '<f8'), ('y', '<f8'), ('z', '<f8')]
+imuFormat = np.dtype(headerFormat
+                     + [('orientation', '<f8', (4,)), ('orientationCovariance', '<f8', (9,)),
+                        ('angularVelocity', vector3Format),
+                        ('angularVelocityCovariance', '<f8', (9,)),
+                        ('linearAcceleration', vector3Format),
+                        ('linearAccelerationCovariance', '<f8', (9,))])
+
+def EventArrayFormat(numEvents):
+    return np.dtype(headerFormat
+                    + [('height', '<u4'), ('width', '<u4'), ('numEvents', '<u4'),
+                       ('events', eventFormat, (numEvents,))])
+
+def ImageFormat(height, width):
+    return np.dtype(headerFormat
+                    + [('height', '<u4'), ('width', '<u4'),
+                       ('encodingLength', '<u4'), ('encoding', 'S5'),
+                       ('isBigEndian', 'u1'), ('step', '<u4'),
+                       ('dataLength', '<u4'), ('data', 'u1', (height, width))])
+
+# Number of events in each EventArray message
+defaultNumEventsPerArray = 25000
+# Messages are serialised this many bytes at a time
+exportBlockSize = 2 ** 25
+
+def SplitTimeStamps(timeStamps):
+    """
+    Splits timestamps in us into ros times: (secs, nsecs).
+    """
+
+    timeStamps = np.asarray(timeStamps).astype(np.uint64)
+    return timeStamps // 1000000, timeStamps % 1000000 * 1000
+
+def MessageData(messages):
+    return messages.view(np.uint8).reshape(len(messages), messages.dtype.itemsize)
+
+def SensorSize(aedat):
+    """
+    Returns (width, height) of the sensor.
+    """
+
+    addressSpace = DeviceAddressSpace(aedat['info'].get('source', ''))
+    if isinstance(addressSpace, list) and len(addressSpace) == 2:
+        return addressSpace[0], addressSpace[1]
+    exportParams = aedat['exportParams']
+    if 'width' in exportParams and 'height' in exportParams:
+        return exportParams['width'], exportParams['height']
+    polarity = aedat['data']['polarity']
+    return int(polarity['x'].max()) + 1, int(polarity['y'].max()) + 1
+
+def WriteEventArrays(bag, connection, polarity, firstEvent, numMessages,
+                     numEventsPerArray, width, height, flipX):
+    """
+    Writes numMessages EventArray messages of numEventsPerArray events
+    each, starting from event number firstEvent.
+    """
+
+    lastEvent = firstEvent + numMessages * numEventsPerArray
+    messages = np.zeros(numMessages, EventArrayFormat(numEventsPerArray))
+    events = messages['events']
+    x = polarity['x'][firstEvent : lastEvent].reshape(numMessages, numEventsPerArray)
+    if flipX:
+        events['x'] = width - 1 - x.astype(np.int32)
+    else:
+        events['x'] = x
+    events['y'] = polarity['y'][firstEvent : lastEvent].reshape(numMessages, numEventsPerArray)
+    secs, nsecs = SplitTimeStamps(polarity['timeStamp'][firstEvent : lastEvent])
+    events['secs'] = secs.reshape(numMessages, numEventsPerArray)
+    events['nsecs'] = nsecs.reshape(numMessages, numEventsPerArray)
+    events['polarity'] = polarity['polarity'][firstEvent : lastEvent].reshape(numMessages, numEventsPerArray)
+    messages['height'] = height
+    messages['width'] = width
+    messages['numEvents'] = numEventsPerArray
+    # The message is stamped with the time of its last event
+    messages['secs'] = events['secs'][:, -1]
+    messages['nsecs'] = events['nsecs'][:, -1]
+    bag.writeMessages(connection, messages['secs'], messages['nsecs'], MessageData(messages))
+
+def ExportPolarity(bag, aedat):
+    """
+    Returns the number of EventArray messages written.
+    """
+
+    exportParams = aedat['exportParams']
+    polarity = aedat['data']['polarity']
+    numEventsPerArray = int(exportParams.get('numEventsPerArray', defaultNumEventsPerArray))
+    flipX = exportParams.get('flipX', True)
+    width, height = SensorSize(aedat)
+    numEvents = len(polarity['timeStamp'])
+    connection = bag.addConnection('/dvs/events', eventArrayType, eventArrayMd5,
+                                   eventArrayDefinition)
+
+    numFullMessages = numEvents // numEventsPerArray
+    messagesPerBlock = max(exportBlockSize // EventArrayFormat(numEventsPerArray).itemsize, 1)
+    for blockStart in range(0, numFullMessages, messagesPerBlock):
+        numMessages = min(messagesPerBlock, numFullMessages - blockStart)
+        print 'Writing event array messages', blockStart + 1, 'to', \
+            blockStart + numMessages, 'of', -(-numEvents // numEventsPerArray), '...'
+        WriteEventArrays(bag, connection, polarity, blockStart * numEventsPerArray,
+                         numMessages, numEventsPerArray, width, height, flipX)
+    # The last message may hold fewer events
+    if numEvents > numFullMessages * numEventsPerArray:
+        WriteEventArrays(bag, connection, polarity, numFullMessages * numEventsPerArray, 1,
+                         numEvents - numFullMessages * numEventsPerArray, width, height, flipX)
+    return -(-numEvents // numEventsPerArray)
+
+def ExportFrames(bag, frame):
+    connection = bag.addConnection('/dvs/image_raw', imageType, imageMd5, imageDefinition)
+    if 'timeStampStart' in frame:
+        timeStamps = frame['timeStampStart']
+    else:
+        timeStamps = frame['timeStampExposureStart']
+    secs, nsecs = SplitTimeStamps(timeStamps)
+    numFrames = len(frame['samples'])
+    # Runs of frames of the same size are written together
+    runStart = 0
+    while runStart < numFrames:
+        height, width = frame['samples'][runStart].shape[0 : 2]
+        runEnd = runStart + 1
+        while runEnd < numFrames and frame['samples'][runEnd].shape[0 : 2] == (height, width):
+            runEnd += 1
+        print 'Writing img messages', runStart + 1, 'to', runEnd, 'of', numFrames, '...'
+        messages = np.zeros(runEnd - runStart, ImageFormat(height, width))
+        messages['secs'] = secs[runStart : runEnd]
+        messages['nsecs'] = nsecs[runStart : runEnd]
+        messages['height'] = height
+        messages['width'] = width
+        messages['encodingLength'] = 5
+        messages['encoding'] = 'mono8'
+        messages['step'] = width
+        messages['dataLength'] = height * width
+        for messageIndex in range(runEnd - runStart):
+            # The sample is really 10 bits, but held in a uint16;
+            # convert to uint8, dropping the least significant 2 bits
+            messages['data'][messageIndex] = np.right_shift(
+                frame['samples'][runStart + messageIndex], 2)
+        bag.writeMessages(connection, messages['secs'], messages['nsecs'], MessageData(messages))
+        runStart = runEnd
+
+def ExportImu6(bag, imu6):
+    connection = bag.addConnection('/dvs/imu', imuType, imuMd5, imuDefinition)
+    messages = np.zeros(len(imu6['timeStamp']), imuFormat)
+    messages['secs'], messages['nsecs'] = SplitTimeStamps(imu6['timeStamp'])
+    # Accel is imported as g; we want m/s^2
+    messages['linearAcceleration']['x'] = imu6['accelX'] * 9.8
+    messages['linearAcceleration']['y'] = imu6['accelY'] * 9.8
+    messages['linearAcceleration']['z'] = imu6['accelZ'] * 9.8
+    # Angular velocity is imported as deg/s; we want rad/s
+    messages['angularVelocity']['x'] = imu6['gyroX'] * 0.01745
+    messages['angularVelocity']['y'] = imu6['gyroY'] * 0.01745
+    messages['angularVelocity']['z'] = imu6['gyroZ'] * 0.01745
+    bag.writeMessages(connection, messages['secs'], messages['nsecs'], MessageData(messages))
 
 def ExportRosbag(aedat):
-    
+
     # bag file name and path will be the same as origin .aedat file, unless overruled
     bagFilePath = os.path.splitext(aedat['exportParams']['filePath'])[0] + '.bag'
-    
-    # Open bag
-    bag = rosbag.Bag(bagFilePath, 'w')
 
-#%% Frames
+    bag = RosbagWriter(bagFilePath)
 
     if 'frame' in aedat['data'] \
-        and ('dataTypes' not in aedat['info'] or 'frame' in aedat['info']['dataTypes']): 
-        bridge = CvBridge()
-        for frameIndex in range(0, aedat['data']['frame']['numEvents']):
-            if frameIndex % 10 == 9:
-                print 'Writing img message', frameIndex + 1, 'of', aedat['data']['frame']['numEvents'], ' ...'
-            img = aedat['data']['frame']['samples'][frameIndex]
-            # The sample is really 10 bits, but held in a uint16; 
-            # convert to uint8, dropping the least significant 2 bits
-            img = np.right_shift(img, 2)
-            img = img.astype('uint8')
-    
-            # To do: make compatible with aedat3 imports, with different timestamp fields
-            timeStamp = rospy.Time(secs=aedat['data']['frame']['timeStampStart'][frameIndex]/1000000.0)
-            img_msg = bridge.cv2_to_imgmsg(img, 'mono8')
-            img_msg.header.stamp = timeStamp
-            bag.write(topic='/dvs/image_raw', msg=img_msg, t=timeStamp)
-    
-#%% Polarity
-    
-    # Put several events into an array in a single ros message, for efficiency     
-    
+        and ('dataTypes' not in aedat['info'] or 'frame' in aedat['info']['dataTypes']):
+        ExportFrames(bag, aedat['data']['frame'])
+
     if 'polarity' in aedat['data'] \
-        and ('dataTypes' not in aedat['info'] or 'polarity' in aedat['info']['dataTypes']): 
-        countMsgs = 0
-        numEventsPerArray = 25000 # Could be a parameter
-        numEvents = aedat['data']['polarity']['numEvents']
-        numArrays = - (- numEvents / numEventsPerArray) # The subtraction allows rounding up
-    
-        # Construct the event array object - a definition from rpg_dvs_ros
-        # Use this repeatedly for each message        
-        eventArrayObject = EventArray()
-        # The following properties don't change
-        eventArrayObject.width = 240 # HARDCODED CONSTANT - RESOLVE ON A RAINY DAY
-        eventArrayObject.height = 180 # HARDCODED CONSTANT - RESOLVE ON A RAINY DAY
-        # Use the following object array repeatedly to construct the contents 
-        # of each ros message
-        eventArray = np.empty(-(-numEventsPerArray), 'object')
-        # Outer loop over arrays or ros messages
-        for startPointer in range(0, numEvents, numEventsPerArray):         
-            countMsgs = countMsgs + 1        
-            print 'Writing event array message', countMsgs, 'of', numArrays, ' ...'
-            endPointer = min(startPointer + numEventsPerArray, numEvents)            
-            # Break the data vectors out of the dict for efficiency, 
-            # but do this message by message to avoid memory problems
-            arrayX        = aedat['data']['polarity']['x'][startPointer : endPointer] 
-            arrayY        = aedat['data']['polarity']['y'][startPointer : endPointer] 
-            arrayPolarity = aedat['data']['polarity']['polarity'][startPointer : endPointer]
-            # Convert timestamps to seconds (ros, however, stores timestamps to ns precision)            
-            arrayTimeStamp = aedat['data']['polarity']['timeStamp'][startPointer : endPointer]/1000000.0 
-
-            # Iterate through all the events in the intended event array
-            for eventIndex in range (0, endPointer - startPointer):
-                # The Event object definition comes from rpg_dvs_ros
-                e = Event()
-                e.x = 239 - arrayX[eventIndex] # Flip X - I don't know why this is necessary
-                e.y = arrayY[eventIndex]
-                e.ts = rospy.Time(arrayTimeStamp[eventIndex])
-                e.polarity = arrayPolarity[eventIndex]
-                eventArray[eventIndex] = e;
-            # The last array may be smaller than numEventsPerArray, so clip the object array
-            if endPointer == numEvents:
-                eventArray = eventArray[0 : endPointer - startPointer]
-            # Assume that the ros message is sent at the time of the last event in the message
-            eventArrayObject.header.stamp = e.ts
-            eventArrayObject.events = eventArray
-            bag.write(topic='/dvs/events', msg=eventArrayObject, t=e.ts)
-            
-    #%% IMU6
-    
-    # Put several events into an array in a single ros message, for efficiency     
+        and ('dataTypes' not in aedat['info'] or 'polarity' in aedat['info']['dataTypes']):
+        startTime = time.time()
+        numMessages = ExportPolarity(bag, aedat)
+        exportTime = max(time.time() - startTime, 1e-9)
+        aedat['info']['eventArrayExportRate'] = numMessages / exportTime
+        print 'Wrote %d event array messages in %.2f s: %d messages/second' \
+            % (numMessages, exportTime, aedat['info']['eventArrayExportRate'])
+
     if 'imu6' in aedat['data'] \
-        and ('dataTypes' not in aedat['info'] or 'imu6' in aedat['info']['dataTypes']): 
-        # Break the IMU events out of the dict, for efficiency
-        # Accel is imported as g; we want m/s^2
-        arrayAccelX = aedat['data']['imu6']['accelX'] * 9.8
-        arrayAccelY = aedat['data']['imu6']['accelY'] * 9.8
-        arrayAccelZ = aedat['data']['imu6']['accelZ'] * 9.8
-        # Angular velocity is imported as deg/s; we want rad/s
-        arrayGyroX = aedat['data']['imu6']['gyroX'] * 0.01745
-        arrayGyroY = aedat['data']['imu6']['gyroY'] * 0.01745
-        arrayGyroZ = aedat['data']['imu6']['gyroZ'] * 0.01745
-            # Convert timestamps to seconds (ros, however, stores timestamps to ns precision)            
-        arrayTimeStamp = aedat['data']['imu6']['timeStamp']/1000000.0 
-        numEvents = aedat['data']['imu6']['numEvents']
-        # Use the following containers repeatedly during the export
-        imuMsg = Imu()
-        accel = Vector3()
-        gyro = Vector3()
-        # I guess these assignments only need to be made once
-        imuMsg.linear_acceleration = accel
-        imuMsg.angular_velocity = gyro
-        for eventIndex in range(0, numEvents):         
-            imuMsg.header.stamp = rospy.Time(arrayTimeStamp[eventIndex])            
-            accel.x = arrayAccelX[eventIndex]
-            accel.y = arrayAccelY[eventIndex]
-            accel.z = arrayAccelZ[eventIndex]
-            gyro.x = arrayGyroX[eventIndex]
-            gyro.y = arrayGyroY[eventIndex]
-            gyro.z = arrayGyroZ[eventIndex]
-            bag.write(topic='/dvs/imu', msg=imuMsg, t=imuMsg.header.stamp)
-    bag.close()
+        and ('dataTypes' not in aedat['info'] or 'imu6' in aedat['info']['dataTypes']):
+        ExportImu6(bag, aedat['data']['imu6'])
 
+    bag.close()
+    return aedat
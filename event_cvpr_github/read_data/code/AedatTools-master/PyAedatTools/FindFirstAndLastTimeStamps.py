@@ -1,89 +1,43 @@
 
 import numpy as np
+from PyAedatTools.EventStream import StreamsFromData
 
 def FindFirstAndLastTimeStamps(aedat):
     '''
-    This is a sub-function of importAedat. 
-    For each field in aedat['data'], it finds the first and last timestamp. 
+    This is a sub-function of importAedat.
+    For each field in aedat['data'], it finds the first and last timestamp.
     The min and max of these respectively are put into aedat.info
+    Where the import has left statistics for every data type in
+    aedat['info']['eventStatistics'] (see EventStatistics), these are used,
+    rather than going over the timestamps again.
     '''
-    
-    # Clip arrays to correct size and add them to the output structure.
-    # Also find first and last timeStamps
-    
+
     if not 'data' in aedat:
         print 'No data found from which to extract time stamps'
         return aedat
-    
+
     firstTimeStamp = np.inf
     lastTimeStamp = 0
-    
-    if 'special' in aedat['data']:
-    	if aedat['data']['special']['timeStamp'][0] < firstTimeStamp:
-    		firstTimeStamp = aedat['data']['special.timeStamp'][0]
-    	if aedat['data']['special']['timeStamp'][-1] > lastTimeStamp:
-    		lastTimeStamp = aedat['data']['special']['timeStamp'][-1]
-    
-    if 'polarity' in aedat['data']:
-    	if aedat['data']['polarity']['timeStamp'][0] < firstTimeStamp:
-    		firstTimeStamp = aedat['data']['polarity']['timeStamp'][0]
-    	if aedat['data']['polarity']['timeStamp'][-1] > lastTimeStamp:
-    		lastTimeStamp = aedat['data']['polarity']['timeStamp'][-1]
-    
-    if 'frame' in aedat['data']:    
-        if 'timeStampExposureStart' in aedat['data']['frame']:
-            if aedat['data']['frame']['timeStampExposureStart'][0] < firstTimeStamp:
-                firstTimeStamp = aedat['data']['frame']['timeStampExposureStart'][0]
-            if aedat['data']['frame']['timeStampExposureEnd'][-1] > lastTimeStamp:
-                lastTimeStamp = aedat['data']['frame']['timeStampExposureEnd'][-1]
-        else:
-            if aedat['data']['frame']['timeStampStart'][0] < firstTimeStamp:
-                firstTimeStamp = aedat['data']['frame']['timeStampStart'][0]
-            if aedat['data']['frame']['timeStampEnd'][-1] > lastTimeStamp:
-                lastTimeStamp = aedat['data']['frame']['timeStampEnd'][-1]
-    
-    if 'imu6' in aedat['data']:
-    	if aedat['data']['imu6']['timeStamp'][0] < firstTimeStamp:
-    		firstTimeStamp = aedat['data']['imu6']['timeStamp'][0]
-    	if aedat['data']['imu6']['timeStamp'][-1] > lastTimeStamp:
-    		lastTimeStamp = aedat['data']['imu6']['timeStamp'][-1]
-    
-    if 'sample' in aedat['data']:
-    	if aedat['data']['sample']['timeStamp'][0] < firstTimeStamp:
-    		firstTimeStamp = aedat['data']['sample']['timeStamp'][0]
-    	if aedat['data']['sample']['timeStamp'][-1] > lastTimeStamp:
-    		lastTimeStamp = aedat['data']['sample']['timeStamp'][-1]
-    
-    if 'ear' in aedat['data']:
-    	if aedat['data']['ear']['timeStamp'][0] < firstTimeStamp:
-    		firstTimeStamp = aedat['data']['ear']['timeStamp'][0]
-    	if aedat['data']['ear']['timeStamp'][-1] > lastTimeStamp:
-    		lastTimeStamp = aedat['data']['ear']['timeStamp'][-1]
-    
-    if 'point1D' in aedat['data']:
-    	if aedat['data']['point1D']['timeStamp'][0] < firstTimeStamp:
-    		firstTimeStamp = aedat['data']['point1D']['timeStamp'][0]
-    	if aedat['data']['point1D']['timeStamp'][-1] > lastTimeStamp:
-    		lastTimeStamp = aedat['data']['point1D']['timeStamp'][-1]
-    
-    if 'point2D' in aedat['data']:
-    	if aedat['data']['point2D']['timeStamp'][0] < firstTimeStamp:
-    		firstTimeStamp = aedat['data']['point2D']['timeStamp'][0]
-    	if aedat['data']['point2D']['timeStamp'][-1] > lastTimeStamp:
-    		lastTimeStamp = aedat['data']['point2D']['timeStamp'][-1]
 
-    if 'point3D' in aedat['data']:
-    	if aedat['data']['point3D']['timeStamp'][0] < firstTimeStamp:
-    		firstTimeStamp = aedat['data']['point3D']['timeStamp'][0]
-    	if aedat['data']['point3D']['timeStamp'][-1] > lastTimeStamp:
-    		lastTimeStamp = aedat['data']['point3D']['timeStamp'][-1]
+    statistics = aedat['info'].get('eventStatistics', {})
+    streams = StreamsFromData(aedat['data'])
+    for dataType in streams:
+        # Statistics only hold for the data as it was imported
+        if dataType in statistics \
+                and statistics[dataType]['numEvents'] == streams[dataType].numEvents:
+            typeFirstTimeStamp = statistics[dataType]['firstTimeStamp']
+            typeLastTimeStamp = statistics[dataType]['lastTimeStamp']
+        elif streams[dataType].numEvents > 0:
+            # The min and max, as the timestamps may not be in order
+            typeFirstTimeStamp = streams[dataType].firstTimeStamp
+            typeLastTimeStamp = streams[dataType].lastTimeStamp
+        else:
+            continue
+        if typeFirstTimeStamp < firstTimeStamp:
+            firstTimeStamp = typeFirstTimeStamp
+        if typeLastTimeStamp > lastTimeStamp:
+            lastTimeStamp = typeLastTimeStamp
 
-    if 'point4D' in aedat['data']:
-    	if aedat['data']['point4D']['timeStamp'][0] < firstTimeStamp:
-    		firstTimeStamp = aedat['data']['point4D']['timeStamp'][0]
-    	if aedat['data']['point4D']['timeStamp'][-1] > lastTimeStamp:
-    		lastTimeStamp = aedat['data']['point4D']['timeStamp'][-1]
-    
     aedat['info']['firstTimeStamp'] = firstTimeStamp
     aedat['info']['lastTimeStamp'] = lastTimeStamp
 
@@ -9,6 +9,8 @@ Code contributions from Bodo Rueckhauser
 from PyAedatTools.ImportAedatHeaders import ImportAedatHeaders
 from PyAedatTools.ImportAedatDataVersion1or2 import ImportAedatDataVersion1or2
 from PyAedatTools.ImportAedatDataVersion3 import ImportAedatDataVersion3
+from PyAedatTools.ParallelImportAedatDataVersion3 import ParallelImportAedatDataVersion3
+from PyAedatTools.PacketIndex import IndexAedatDataVersion3
 
 def ImportAedat(aedat):
     """
@@ -27,5 +29,14 @@ def ImportAedat(aedat):
         if aedat['info']['fileFormat'] < 3:
             return ImportAedatDataVersion1or2(aedat)
         else:
+            # Index the packets first (or load the index from its sidecar
+            # file), so that range reads can seek straight to their packets
+            if 'packetIndexFile' not in aedat['importParams'] \
+                    or aedat['importParams']['packetIndexFile']:
+                aedat = IndexAedatDataVersion3(aedat)
+                if aedat['importParams'].get('noData', False):
+                    return aedat
+            if aedat['importParams'].get('workers', 1) > 1:
+                return ParallelImportAedatDataVersion3(aedat)
             return ImportAedatDataVersion3(aedat)
  
\ No newline at end of file
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+"""
+ImportAedatChunks
+
+A generator version of ImportAedat. Rather than materialising the whole file
+into aedat['data'], it yields the file as a series of chunks, each of which
+is a dict with 'importParams', 'info' and 'data' fields laid out just as
+ImportAedat would lay them out for that stretch of the recording. Peak memory
+is therefore bounded by the chunk size rather than the file size.
+
+The chunk size is set in importParams, by either:
+    'chunkEvents' - the number of events in each chunk (for aedat3.x files,
+        whole packets are gathered until at least this many events are
+        held), or
+    'chunkDuration' - the duration of each chunk in seconds.
+By default, chunks of 1e6 events are used.
+
+All the other importParams of ImportAedat are honoured (apart from
+'memoryMap', since the version 1 or 2 data are always mapped here).
+
+For aedat version 1 or 2 files, a frame (or a block of 7 IMU samples) may
+straddle the boundary between two chunks; its samples are held over and
+decoded with the next chunk, so every frame and IMU sample appears whole in
+exactly one chunk. Where reset reads are subtracted, a reset frame is held
+over together with the signal frame which follows it.
+Unless importParams['unwrapTimeStamps'] is False, the timestamps are
+unwrapped (see UnwrapTimeStamps) with the state carried from chunk to chunk,
+so they match those of ImportAedat.
+
+For aedat3.x files, the file is first indexed (if info doesn't already
+hold an index, and it can't be loaded from the sidecar file - see
+PacketIndex), then each chunk is imported by ImportAedatDataVersion3
+from a range of packets.
+"""
+
+import numpy as np
+from PyAedatTools.ImportAedatHeaders import ImportAedatHeaders
+from PyAedatTools.ImportAedatDataVersion1or2 import DecodeAedatDataVersion1or2
+from PyAedatTools.ImportAedatDataVersion1or2 import FrameStartsVersion1or2
+from PyAedatTools.ImportAedatDataVersion1or2 import ClassifyAddressesVersion1or2
+from PyAedatTools.ImportAedatDataVersion1or2 import frameTypeCode, imuTypeCode
+from PyAedatTools.ImportAedatDataVersion1or2 import signalOrSpecialMask
+from PyAedatTools.ImportAedatDataVersion1or2 import xMask, xShiftBits
+from PyAedatTools.ImportAedatDataVersion1or2 import yMask, yShiftBits
+from PyAedatTools.ImportAedatDataVersion3 import ImportAedatDataVersion3
+from PyAedatTools.PacketIndex import IndexAedatDataVersion3
+from PyAedatTools.MemmapAedatDataVersion1or2 import MemmapAedatDataVersion1or2
+from PyAedatTools.MemmapAedatDataVersion1or2 import SeekTimeStampVersion1or2
+from PyAedatTools.UnwrapTimeStamps import UnwrapTimeStamps
+from PyAedatTools.UnwrapTimeStamps import SampleUnwrapState
+from PyAedatTools.UnwrapTimeStamps import SeekUnwrappedTimeStamp
+from PyAedatTools.FindFirstAndLastTimeStamps import FindFirstAndLastTimeStamps
+from PyAedatTools.NumEventsByType import NumEventsByType
+
+def ImportAedatChunks(aedat):
+    """
+    Parameters
+    ----------
+    aedat :
+        dict with an 'importParams' dict, as for ImportAedat.
+
+    Yields
+    ------
+    :
+        One dict per chunk, with 'importParams', 'info' and 'data' fields.
+    """
+
+    with open(aedat['importParams']['filePath'], 'rb') as aedat['importParams']['fileHandle']:
+        aedat = ImportAedatHeaders(aedat)
+        if aedat['info']['fileFormat'] < 3:
+            chunks = ImportAedatChunksVersion1or2(aedat)
+        else:
+            chunks = ImportAedatChunksVersion3(aedat)
+        for chunk in chunks:
+            yield chunk
+
+def ImportAedatChunksVersion1or2(aedat):
+
+    info = aedat['info']
+    importParams = aedat['importParams']
+
+    if 'chunkDuration' in importParams:
+        chunkDuration = importParams['chunkDuration'] * 1e6
+        chunkEvents = None
+    else:
+        chunkDuration = None
+        chunkEvents = int(importParams.get('chunkEvents', 1e6))
+
+    # The whole event range is mapped rather than read; only one chunk at a
+    # time is ever brought into memory
+    startEvent = int(importParams.get('startEvent', 0))
+    if 'endEvent' in importParams:
+        allEvents = MemmapAedatDataVersion1or2(
+            aedat, startEvent, int(importParams['endEvent']) - startEvent + 1)
+    else:
+        allEvents = MemmapAedatDataVersion1or2(aedat, startEvent)
+
+    # The timestamps are unwrapped chunk by chunk, carrying the unwrap state
+    # from one chunk to the next, as ImportAedatDataVersion1or2 would unwrap
+    # them
+    unwrapTimeStamps = importParams.get('unwrapTimeStamps', True)
+    if unwrapTimeStamps:
+        allMappedTs = MemmapAedatDataVersion1or2(aedat)['ts']
+
+    # Narrow the mapped events down to the time window, as
+    # ImportAedatDataVersion1or2 does
+    if importParams.get('seekByTime', True):
+        if 'startTime' in importParams:
+            if unwrapTimeStamps:
+                windowStart = SeekUnwrappedTimeStamp(
+                    allEvents['ts'], importParams['startTime'] * 1e6, 'left',
+                    SampleUnwrapState(allMappedTs, startEvent))
+            else:
+                windowStart = SeekTimeStampVersion1or2(
+                    allEvents['ts'], importParams['startTime'] * 1e6, 'left')
+            allEvents = allEvents[windowStart : ]
+            startEvent = startEvent + windowStart
+        if 'endTime' in importParams:
+            if unwrapTimeStamps:
+                windowEnd = SeekUnwrappedTimeStamp(
+                    allEvents['ts'], importParams['endTime'] * 1e6, 'right',
+                    SampleUnwrapState(allMappedTs, startEvent))
+            else:
+                windowEnd = SeekTimeStampVersion1or2(
+                    allEvents['ts'], importParams['endTime'] * 1e6, 'right')
+            allEvents = allEvents[ : windowEnd]
+    numEvents = len(allEvents)
+    allTs = allEvents['ts']
+    if unwrapTimeStamps:
+        unwrapState = SampleUnwrapState(allMappedTs, startEvent)
+        del allMappedTs
+
+    subtractResetRead = 'subtractResetRead' not in importParams \
+                        or importParams['subtractResetRead']
+
+    # Frame and IMU samples held over from the previous chunk
+    heldAddr = np.zeros(0, np.uint32)
+    heldTs = np.zeros(0, np.uint64 if unwrapTimeStamps else np.uint32)
+
+    chunkStart = 0
+    chunkIndex = 0
+    while chunkStart < numEvents:
+        if chunkDuration is None:
+            chunkEnd = min(chunkStart + chunkEvents, numEvents)
+        else:
+            # Step through the (monotonic) timestamps a block at a time until
+            # the end of the chunk's time window is found
+            if unwrapTimeStamps:
+                scanState = dict(unwrapState)
+            endTimeStamp = None
+            chunkEnd = chunkStart
+            while chunkEnd < numEvents:
+                if unwrapTimeStamps:
+                    block = UnwrapTimeStamps(allTs[chunkEnd : chunkEnd + 1000000],
+                                             state=scanState)
+                else:
+                    block = np.array(allTs[chunkEnd : chunkEnd + 1000000], np.uint32)
+                if endTimeStamp is None:
+                    endTimeStamp = int(block[0]) + chunkDuration
+                blockEnd = np.searchsorted(block, endTimeStamp)
+                chunkEnd = chunkEnd + blockEnd
+                if blockEnd < len(block):
+                    break
+            chunkEnd = max(chunkEnd, chunkStart + 1)
+        lastChunk = chunkEnd == numEvents
+
+        # Bring the chunk into memory, behind anything held over
+        chunkAddr = np.concatenate([heldAddr, allEvents['addr'][chunkStart : chunkEnd]])
+        if unwrapTimeStamps:
+            chunkTs = np.concatenate([heldTs, UnwrapTimeStamps(allTs[chunkStart : chunkEnd],
+                                                               state=unwrapState)])
+        else:
+            chunkTs = np.concatenate([heldTs, allTs[chunkStart : chunkEnd]])
+        chunkStart = chunkEnd
+
+        # Trim events outside time window
+        if 'startTime' in importParams:
+            tempIndex = np.nonzero(chunkTs >= importParams['startTime'] * 1e6)
+            chunkAddr = chunkAddr[tempIndex]
+            chunkTs = chunkTs[tempIndex]
+        if 'endTime' in importParams:
+            tempIndex = np.nonzero(chunkTs <= importParams['endTime'] * 1e6)
+            chunkAddr = chunkAddr[tempIndex]
+            chunkTs = chunkTs[tempIndex]
+
+        # Hold over any frame or IMU samples which may continue into the
+        # next chunk. This only applies to DAVIS sources
+        holdLogical = np.zeros(len(chunkAddr), bool)
+        if not lastChunk and info['source'] not in ('Das1', 'Dvs128'):
+            typeCode = ClassifyAddressesVersion1or2(chunkAddr)
+
+            # IMU samples come in blocks of 7; hold over any incomplete block
+            imuIndices = np.flatnonzero(typeCode == imuTypeCode)
+            numImuToHold = len(imuIndices) % 7
+            if numImuToHold > 0:
+                holdLogical[imuIndices[-numImuToHold : ]] = True
+
+            # The last frame can't be known to be complete until the first
+            # sample of the one after it turns up
+            frameIndices = np.flatnonzero(typeCode == frameTypeCode)
+            del typeCode
+            if len(frameIndices) > 0:
+                frameData = chunkAddr[frameIndices]
+                frameX = np.array(np.right_shift(np.bitwise_and(frameData, xMask), xShiftBits), 'int16')
+                frameY = np.array(np.right_shift(np.bitwise_and(frameData, yMask), yShiftBits), 'int16')
+                frameStarts = FrameStartsVersion1or2(frameX, frameY)
+                holdFrom = frameStarts[-2]
+                # A reset frame is only of use with the signal frame after it
+                if subtractResetRead and len(frameStarts) > 2 \
+                        and not np.bitwise_and(frameData[frameStarts[-3]],
+                                               signalOrSpecialMask):
+                    holdFrom = frameStarts[-3]
+                holdLogical[frameIndices[holdFrom : ]] = True
+
+        heldAddr = chunkAddr[holdLogical]
+        heldTs = chunkTs[holdLogical]
+        keepLogical = np.logical_not(holdLogical)
+        chunkAddr = chunkAddr[keepLogical]
+        chunkTs = chunkTs[keepLogical]
+
+        chunk = {}
+        chunk['importParams'] = importParams
+        chunk['info'] = dict(info)
+        chunk['info']['chunkIndex'] = chunkIndex
+        chunk['data'] = DecodeAedatDataVersion1or2(chunkAddr, chunkTs,
+                                                   chunk['info'], importParams)
+        chunk = FindFirstAndLastTimeStamps(chunk)
+        chunk = NumEventsByType(chunk)
+        chunkIndex = chunkIndex + 1
+        yield chunk
+
+def ImportAedatChunksVersion3(aedat):
+
+    info = aedat['info']
+    importParams = aedat['importParams']
+
+    # Index the file, unless that has already been done
+    aedat = IndexAedatDataVersion3(aedat)
+    info = aedat['info']
+    numPackets = len(info['packetPointers'])
+
+    startPacket = int(importParams.get('startPacket', 1))
+    endPacket = int(min(importParams.get('endPacket', numPackets), numPackets))
+
+    # Gather packets into chunks - packet numbers here are 1-based, as for
+    # the startPacket and endPacket importParams
+    if 'chunkDuration' in importParams:
+        chunkDuration = importParams['chunkDuration'] * 1e6
+        # Packets of different types overlap in time, so their first
+        # timestamps aren't in order; the running maximum of them is, so each
+        # chunk is found with a search from where the last one ended
+        packetTimeStamps = np.maximum.accumulate(info['packetTimeStamps'].astype(np.float64))
+    else:
+        chunkEvents = int(importParams.get('chunkEvents', 1e6))
+        # Events up to and including each packet, so that each chunk is found
+        # with a search from where the last one ended
+        cumulativeEvents = np.cumsum(info['packetEventNumbers'].astype(np.int64))
+
+    chunkStart = startPacket
+    chunkIndex = 0
+    while chunkStart <= endPacket:
+        if 'chunkDuration' in importParams:
+            endTimeStamp = packetTimeStamps[chunkStart - 1] + chunkDuration
+            chunkEnd = chunkStart - 1 + np.searchsorted(
+                packetTimeStamps[chunkStart - 1 : endPacket], endTimeStamp)
+        else:
+            eventsBefore = cumulativeEvents[chunkStart - 2] if chunkStart > 1 else 0
+            chunkEnd = chunkStart + np.searchsorted(
+                cumulativeEvents[chunkStart - 1 : endPacket], eventsBefore + chunkEvents)
+        chunkEnd = int(min(max(chunkEnd, chunkStart), endPacket))
+
+        chunkParams = dict(importParams)
+        chunkParams['startPacket'] = chunkStart
+        chunkParams['endPacket'] = chunkEnd
+        chunk = {}
+        chunk['importParams'] = chunkParams
+        chunk['info'] = dict(info)
+        chunk = ImportAedatDataVersion3(chunk)
+        chunk['info']['chunkIndex'] = chunkIndex
+        chunkIndex = chunkIndex + 1
+        chunkStart = chunkEnd + 1
+        yield chunk
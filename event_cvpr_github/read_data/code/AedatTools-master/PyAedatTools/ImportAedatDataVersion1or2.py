@@ -7,9 +7,62 @@ Import aedat version 1 or 2.
 """
 
 import numpy as np
+from PyAedatTools.MemmapAedatDataVersion1or2 import EventFormatVersion1or2
+from PyAedatTools.MemmapAedatDataVersion1or2 import MemmapAedatDataVersion1or2
+from PyAedatTools.MemmapAedatDataVersion1or2 import SeekTimeStampVersion1or2
+from PyAedatTools.UnwrapTimeStamps import UnwrapTimeStamps
+from PyAedatTools.UnwrapTimeStamps import SampleUnwrapState
+from PyAedatTools.UnwrapTimeStamps import SeekUnwrappedTimeStamp
+from PyAedatTools.EventStatistics import RateBinWidth
+from PyAedatTools.EventStatistics import AccumulateEventStatistics
 from PyAedatTools.FindFirstAndLastTimeStamps import FindFirstAndLastTimeStamps
 from PyAedatTools.NumEventsByType import NumEventsByType
 
+"""
+DAVIS. In the 32-bit address:
+bit 32 (1-based) being 1 indicates an APS sample
+bit 11 (1-based) being 1 indicates a special event
+bits 11 and 32 (1-based) both being zero signals a polarity event
+
+These masks are also used by ImportAedatChunks, to find the frame and IMU
+samples which have to be held over from one chunk to the next.
+"""
+apsOrImuMask = int('80000000', 16)
+signalOrSpecialMask = int('400', 16)
+ImuOrPolarityMask = int('800', 16)
+
+# These masks are used for both frames and polarity events
+yMask = int('7FC00000', 16)
+yShiftBits = 22
+xMask = int('003FF000', 16)
+xShiftBits = 12
+polarityMask = int('00000800', 16)
+
+frameSampleMask = int('1111111111', 2)
+
+imuDataMask = int('0FFFF000', 16)
+imuDataShiftBits = 12
+
+"""
+Each DAVIS event is classified by a small type code, looked up from bits
+32, 12 and 11 (1-based) of its address:
+bit 32 being 0: bit 11 being 1 indicates a special event, else polarity
+bit 32 being 1: bit 12 being 1 indicates an IMU sample, else an APS sample
+"""
+polarityTypeCode = 0
+specialTypeCode = 1
+frameTypeCode = 2
+imuTypeCode = 3
+numTypeCodes = 4
+typeCodeTable = np.array([polarityTypeCode, specialTypeCode,
+                          polarityTypeCode, specialTypeCode,
+                          frameTypeCode, frameTypeCode,
+                          imuTypeCode, imuTypeCode], 'uint8')
+
+# Addresses are classified and partitioned this many at a time, which bounds
+# the size of the temporary arrays
+classifyBlockSize = 2 ** 20
+
 def ImportAedatDataVersion1or2(aedat):
     """
     Later ;)
@@ -21,12 +74,7 @@ def ImportAedatDataVersion1or2(aedat):
     fileHandle = importParams['fileHandle']
 
     # The formatVersion dictates whether there are 6 or 8 bytes per event.
-    if info['fileFormat'] == 1:
-        numBytesPerEvent = 6
-        addrPrecision = np.dtype([('addr', '>u2'), ('ts', '>u4')])
-    else:
-        numBytesPerEvent = 8
-        addrPrecision = np.dtype([('addr', '>u4'), ('ts', '>u4')])
+    numBytesPerEvent, addrPrecision = EventFormatVersion1or2(info['fileFormat'])
 
     # Find the number of events, assuming that the file position is just at the
     # end of the headers.
@@ -37,12 +85,12 @@ def ImportAedatDataVersion1or2(aedat):
 
     # Check the startEvent and endEvent parameters
     if 'startEvent' in importParams:
-        startEvent = importParams['startEvent']
+        startEvent = int(importParams['startEvent'])
     else:
         startEvent = 0
     assert startEvent <= info['numEventsInFile']
     if 'endEvent' in importParams:
-        endEvent = importParams['endEvent']
+        endEvent = int(importParams['endEvent'])
     else:
         endEvent = info['numEventsInFile']
     assert endEvent <= info['numEventsInFile']    
@@ -54,32 +102,276 @@ def ImportAedatDataVersion1or2(aedat):
               "available for .aedat version < 3 files")
     assert startEvent <= endEvent
 
-    numEventsToRead = endEvent - startEvent + 1
+    # Don't ask for more events than there are left in the file
+    numEventsToRead = min(endEvent - startEvent + 1,
+                          info['numEventsInFile'] - startEvent)
+
+    # By default, a time window is found by bisecting on the timestamps in
+    # the file, so only the events inside it are read. This assumes monotonic
+    # timestamps; set seekByTime to False to scan the whole event range
+    # instead.
+    if 'seekByTime' in importParams:
+        seekByTime = importParams['seekByTime']
+    else:
+        seekByTime = True
+
+    # By default, the 32 bit timestamps, which wrap about every 71 minutes,
+    # are unwrapped into monotonic uint64 timestamps, and startTime and 
+    # endTime refer to these. Set unwrapTimeStamps to False for the raw
+    # uint32 timestamps.
+    if 'unwrapTimeStamps' in importParams:
+        unwrapTimeStamps = importParams['unwrapTimeStamps']
+    else:
+        unwrapTimeStamps = True
+
+    if seekByTime and ('startTime' in importParams or 'endTime' in importParams):
+        print 'Seeking events by time ...'
+        mappedTs = MemmapAedatDataVersion1or2(aedat, startEvent,
+                                              numEventsToRead)['ts']
+        if unwrapTimeStamps:
+            # Count the wraps before startEvent
+            unwrapState = SampleUnwrapState(MemmapAedatDataVersion1or2(aedat)['ts'], 
+                                            startEvent)
+        windowStart = 0
+        windowEnd = len(mappedTs)
+        if 'startTime' in importParams:
+            if unwrapTimeStamps:
+                windowStart = SeekUnwrappedTimeStamp(
+                    mappedTs, importParams['startTime'] * 1e6, 'left', unwrapState)
+            else:
+                windowStart = SeekTimeStampVersion1or2(
+                    mappedTs, importParams['startTime'] * 1e6, 'left')
+        if 'endTime' in importParams:
+            if unwrapTimeStamps:
+                windowEnd = SeekUnwrappedTimeStamp(
+                    mappedTs, importParams['endTime'] * 1e6, 'right', unwrapState)
+            else:
+                windowEnd = SeekTimeStampVersion1or2(
+                    mappedTs, importParams['endTime'] * 1e6, 'right')
+        del mappedTs
+        startEvent = startEvent + windowStart
+        numEventsToRead = max(windowEnd - windowStart, 0)
+
+    # By default, read the events into memory. With memoryMap set, map them
+    # instead, so nothing is read until the decoding below touches it
+    if 'memoryMap' in importParams:
+        memoryMap = importParams['memoryMap']
+    else:
+        memoryMap = False
+
+    # By default, decode in this process. With workers set above 1, DAVIS
+    # events are decoded on that many processes
+    if 'workers' in importParams:
+        workers = int(importParams['workers'])
+    else:
+        workers = 1
+
+    if workers > 1 and info['source'] not in ('Das1', 'Dvs128'):
+        # Imported here, as that module imports this one
+        from PyAedatTools.ParallelDecodeAedatDataVersion1or2 \
+            import ParallelDecodeAedatDataVersion1or2
+        outputData = ParallelDecodeAedatDataVersion1or2(aedat, startEvent, 
+                                                        numEventsToRead, workers)
+    else:
+        # Read events
+        if memoryMap:
+            print 'Mapping events ...'
+            allEvents = MemmapAedatDataVersion1or2(aedat, startEvent,
+                                                   numEventsToRead)
+        else:
+            print 'Reading events ...'
+            fileHandle.seek(info['beginningOfDataPointer'] + numBytesPerEvent *
+                             startEvent)
+            allEvents = np.fromfile(fileHandle, addrPrecision, numEventsToRead)
+
+        # These are views onto allEvents, not copies
+        allAddr = allEvents['addr']
+        allTs = allEvents['ts']
+
+        if unwrapTimeStamps:
+            print 'Unwrapping timestamps ...'
+            allTs = UnwrapTimeStamps(allTs, state=SampleUnwrapState(
+                MemmapAedatDataVersion1or2(aedat)['ts'], startEvent))
+
+        # Trim events outside time window.
+        # This is an inefficent implementation, which allows for non-monotonic
+        # timestamps. Where the window has already been found by seekByTime,
+        # this only checks the events read.
+
+        if 'startTime' in importParams:
+            print 'Cropping events by time ...'
+            tempIndex = np.nonzero(allTs >= importParams['startTime'] * 1e6)
+            allAddr = allAddr[tempIndex]
+            allTs = allTs[tempIndex]
+
+        if 'endTime' in importParams:
+            print 'Cropping events by time ...'
+            tempIndex = np.nonzero(allTs <= importParams['endTime'] * 1e6)
+            allAddr = allAddr[tempIndex]
+            allTs = allTs[tempIndex]
+
+        outputData = DecodeAedatDataVersion1or2(allAddr, allTs, info, importParams)
+
+    # If you want to do chip-specific address shifts or subtractions,
+    # this would be the place to do it.
+
+    # calculate numEvents fields  also find first and last timeStamps
+    info['firstTimeStamp'] = np.infty
+    info['lastTimeStamp'] = 0
+
+    aedat['info'] = info
+    aedat['data'] = outputData
+
+    # Find first and last time stamps        
+    aedat = FindFirstAndLastTimeStamps(aedat)
+    
+    # Add NumEvents field for each data type
+    aedat = NumEventsByType(aedat)
+       
+    return aedat
+
+def FrameStartsVersion1or2(frameX, frameY):
+    """
+    Takes the x and y addresses (as int16) of a run of APS samples and returns
+    the indices of the first sample in each frame, plus an additional index
+    just beyond the end of the array.
+    """
+
+    # In general the ramp of address values could be in either
+    # direction and either x or y could be the outer(inner) loop
+    # Search for a discontinuity in both x and y simultaneously
+    frameXDiscont = abs(frameX[1 : ] - frameX[0 : -1]) > 1 
+    frameYDiscont = abs(frameY[1 : ] - frameY[0 : -1]) > 1
+    frameDiscontIndex = np.where(np.logical_and(frameXDiscont, frameYDiscont))
+    frameDiscontIndex = frameDiscontIndex[0] # The last line produces a tuple - we only want the array
+    return np.concatenate([[0], frameDiscontIndex  + 1, [frameX.size]])
+
+def SubtractResetReadVersion1or2(frame, samplesBuffer=None):
+    """
+    Takes the frame dict built by DecodeAedatDataVersion1or2 - with a 'reset'
+    flag per frame and all the frames in one (numFrames, H, W) 'samples'
+    array - and returns it with the reset reads subtracted from the signal
+    reads; only the signal frames are kept, and 'reset' is removed.
+    Each signal frame is paired with the latest reset frame before it. If
+    there is no such reset frame, or it has a different position or size, 
+    the signal frame is passed through as is.
+    If samplesBuffer is given - a uint16 array of the same frame size, with
+    room for at least as many frames as there are signal frames - the
+    result is written into (the start of) it, rather than into a new array.
+    """
+
+    reset = frame['reset']
+    samples = frame['samples']
+    frameIndices = np.arange(reset.size)
+
+    # Pair frames by index arithmetic: for every frame, the index of the
+    # latest reset frame at or before it (-1 if there is none)
+    latestReset = np.maximum.accumulate(np.where(reset, frameIndices, -1))
+    signalIndices = frameIndices[np.logical_not(reset)]
+    resetIndices = latestReset[signalIndices]
+    subtract = resetIndices >= 0
+    for field in ('xPosition', 'yPosition', 'xLength', 'yLength'):
+        subtract = np.logical_and(subtract, 
+            frame[field][resetIndices] == frame[field][signalIndices])
+    numSignalFrames = signalIndices.size
+
+    if samplesBuffer is None:
+        signalSamples = np.empty((numSignalFrames, ) + samples.shape[1 : ], 'uint16')
+    else:
+        if samplesBuffer.dtype != np.uint16 \
+                or samplesBuffer.shape[1 : ] != samples.shape[1 : ] \
+                or samplesBuffer.shape[0] < numSignalFrames:
+            raise Exception('The frame buffer must be a uint16 array of at least %d frames of %d x %d' 
+                            % ((numSignalFrames, ) + samples.shape[1 : ]))
+        signalSamples = samplesBuffer[0 : numSignalFrames]
+    np.take(samples, signalIndices, axis=0, out=signalSamples)
+
+    # Do the subtraction for all the paired frames at once
+    subtractIndices = np.flatnonzero(subtract)
+    if subtractIndices.size > 0:
+        difference = samples[resetIndices[subtractIndices]]
+        np.subtract(difference, signalSamples[subtractIndices], out=difference)
+        # This operation was on unsigned integers, set negatives to zero
+        difference[difference > 32767] = 0
+        signalSamples[subtractIndices] = difference
+        del difference
+
+    for field in ('timeStampStart', 'timeStampEnd', 
+                  'xPosition', 'yPosition', 'xLength', 'yLength'):
+        frame[field] = frame[field][signalIndices]
+    frame['samples'] = signalSamples
+    del frame['reset']   # reset is no longer needed
+    return frame
+
+def ClassifyAddressesVersion1or2(allAddr):
+    """
+    Returns a uint8 type code (polarityTypeCode, specialTypeCode, 
+    frameTypeCode or imuTypeCode) for each DAVIS address in allAddr, 
+    computed in one pass over the addresses.
+    """
 
-    # Read events
-    print 'Reading events ...'
-    fileHandle.seek(info['beginningOfDataPointer'] + numBytesPerEvent *
-                     startEvent)
-    allEvents = np.fromfile(fileHandle, addrPrecision, numEventsToRead)
+    typeCode = np.empty(len(allAddr), 'uint8')
+    for blockStart in range(0, len(allAddr), classifyBlockSize):
+        blockAddr = allAddr[blockStart : blockStart + classifyBlockSize]
+        # Bit 32 goes to bit 3 of the lookup index, bits 12 and 11 to bits
+        # 2 and 1
+        lookupIndex = np.bitwise_or(
+            np.bitwise_and(np.right_shift(blockAddr, 29), 4),
+            np.bitwise_and(np.right_shift(blockAddr, 10), 3))
+        typeCode[blockStart : blockStart + classifyBlockSize] \
+            = typeCodeTable[lookupIndex]
+    return typeCode
 
-    allAddr = np.array(allEvents['addr'])
-    allTs = np.array(allEvents['ts'])
+def PartitionByTypeVersion1or2(allAddr, allTs, typeCode, wantedTypeCodes):
+    """
+    Partitions the addresses and timestamps by type code, with a counting 
+    sort: the events of each type are counted to size the output arrays, 
+    then each block of events is scattered, type by type, to the end of the
+    output arrays for its types. The order of events within each type is
+    kept.
+    Returns a dict from each of wantedTypeCodes to an (addresses, timeStamps)
+    pair of native arrays - uint32 addresses, and timestamps of the width of
+    allTs (uint32 raw or uint64 unwrapped); other types are dropped.
+    """
 
-    # Trim events outside time window.
-    # This is an inefficent implementation, which allows for non-monotonic
-    # timestamps.
+    tsDtype = allTs.dtype.newbyteorder('=')
+    numEventsByTypeCode = np.bincount(typeCode, minlength=numTypeCodes)
+    partition = {}
+    for wantedTypeCode in wantedTypeCodes:
+        partition[wantedTypeCode] = (
+            np.empty(numEventsByTypeCode[wantedTypeCode], 'uint32'),
+            np.empty(numEventsByTypeCode[wantedTypeCode], tsDtype))
 
-    if 'startTime' in importParams:
-        print 'Cropping events by time ...'
-        tempIndex = np.nonzero(allTs >= importParams['startTime'] * 1e6)
-        allAddr = allAddr[tempIndex]
-        allTs = allTs[tempIndex]
+    outputPositions = np.zeros(numTypeCodes, 'int64')
+    for blockStart in range(0, len(typeCode), classifyBlockSize):
+        blockEnd = blockStart + classifyBlockSize
+        blockTypeCode = typeCode[blockStart : blockEnd]
+        # Brought into memory (and native byte order) a block at a time
+        blockAddr = allAddr[blockStart : blockEnd].astype('uint32')
+        blockTs = allTs[blockStart : blockEnd].astype(tsDtype)
+        blockCounts = np.bincount(blockTypeCode, minlength=numTypeCodes)
+        for wantedTypeCode in wantedTypeCodes:
+            if blockCounts[wantedTypeCode] == 0:
+                continue
+            outputStart = outputPositions[wantedTypeCode]
+            outputEnd = outputStart + blockCounts[wantedTypeCode]
+            blockLogical = blockTypeCode == wantedTypeCode
+            partition[wantedTypeCode][0][outputStart : outputEnd] \
+                = np.compress(blockLogical, blockAddr)
+            partition[wantedTypeCode][1][outputStart : outputEnd] \
+                = np.compress(blockLogical, blockTs)
+        outputPositions = outputPositions + blockCounts
+    return partition
 
-    if 'endTime' in importParams:
-        print 'Cropping events by time ...'
-        tempIndex = np.nonzero(allTs <= importParams['endTime'] * 1e6)
-        allAddr = allAddr[tempIndex]
-        allTs = allTs[tempIndex]
+def DecodeAedatDataVersion1or2(allAddr, allTs, info, importParams):
+    """
+    Interprets a run of aedat version 1 or 2 addresses and their timestamps,
+    returning the data dict - one entry per data type - which ImportAedat
+    puts into aedat['data'].
+    The statistics of the events decoded are put into info['eventStatistics']
+    (see EventStatistics).
+    allAddr and allTs may be views onto a memory-mapped file. 
+    """
 
     # Interpret the addresses
     
@@ -113,6 +405,9 @@ def ImportAedatDataVersion1or2(aedat):
 
     # Create a structure to put all the data in 
     outputData = {}
+    statistics = {}
+    info['eventStatistics'] = statistics
+    rateBinWidth = RateBinWidth(importParams)
 
     if info['source'] == 'Das1':
 
@@ -133,42 +428,36 @@ def ImportAedatDataVersion1or2(aedat):
         bits 11 and 32 (1-based) both being zero signals a polarity event
         """
 
-        print 'Building logical indices by type ...'        
-        apsOrImuMask = int('80000000', 16)
-        apsOrImuLogical = np.bitwise_and(allAddr, apsOrImuMask)
-        apsOrImuLogical = apsOrImuLogical.astype(bool)
-        signalOrSpecialMask = int('400', 16)
-        signalOrSpecialLogical = np.bitwise_and(allAddr, signalOrSpecialMask)
-        signalOrSpecialLogical = signalOrSpecialLogical.astype(bool)
-
-        # These masks are used for both frames and polarity events, so are defined
-        # outside of the following if statement
-        yMask = int('7FC00000', 16)
-        yShiftBits = 22
-        xMask = int('003FF000', 16)
-        xShiftBits = 12        
-        polarityMask = int('00000800', 16)
-        
-        specialLogical = np.logical_and(signalOrSpecialLogical,
-                                       np.logical_not(apsOrImuLogical))
+        # Classify every event with a single type code, then partition the
+        # addresses and timestamps of the wanted types
+        print 'Classifying events by type ...'
+        typeCode = ClassifyAddressesVersion1or2(allAddr)
+        wantedTypeCodes = []
+        for dataType, dataTypeCode in (('special', specialTypeCode),
+                                       ('polarity', polarityTypeCode),
+                                       ('frame', frameTypeCode),
+                                       ('imu6', imuTypeCode)):
+            if 'dataTypes' not in importParams or dataType in importParams['dataTypes']:
+                wantedTypeCodes.append(dataTypeCode)
+        partition = PartitionByTypeVersion1or2(allAddr, allTs, typeCode, wantedTypeCodes)
+        del typeCode
+
     # Special events
-        if ('dataTypes' not in importParams or 'special' in importParams['dataTypes']) \
-                 and any(specialLogical):
+        if specialTypeCode in partition and len(partition[specialTypeCode][1]) > 0:
             print 'Processing special events ...'
             outputData['special'] = {}
-            outputData['special']['timeStamp'] = allTs[specialLogical] 
+            outputData['special']['timeStamp'] = partition[specialTypeCode][1]
             # No need to create address field, since there is only one type of special event
-        del specialLogical
+            AccumulateEventStatistics(statistics, 'special', outputData['special']['timeStamp'],
+                                      binWidth=rateBinWidth)
+        partition.pop(specialTypeCode, None)
     
-        polarityLogical = np.logical_and(np.logical_not(apsOrImuLogical),
-                                      np.logical_not(signalOrSpecialLogical))
         # Polarity(DVS) events
-        if ('dataTypes' not in importParams or 'polarity' in importParams['dataTypes']) \
-                and any(polarityLogical):
+        if polarityTypeCode in partition and len(partition[polarityTypeCode][1]) > 0:
             print 'Processing polarity events ...'
-            polarityData = allAddr[polarityLogical]         
+            polarityData = partition[polarityTypeCode][0]
             outputData['polarity'] = {}
-            outputData['polarity']['timeStamp'] = allTs[polarityLogical]
+            outputData['polarity']['timeStamp'] = partition[polarityTypeCode][1]
             # Y addresses
             outputData['polarity']['y'] = np.array(np.right_shift( \
                 np.bitwise_and(polarityData, yMask), yShiftBits), 'uint16')
@@ -181,22 +470,16 @@ def ImportAedatDataVersion1or2(aedat):
             outputData['polarity']['polarity'] = np.array( \
             np.bitwise_and(polarityData, polarityMask), 'bool')
             del polarityData
-        del polarityLogical
-
+            AccumulateEventStatistics(statistics, 'polarity', outputData['polarity']['timeStamp'],
+                                      polarity=outputData['polarity']['polarity'],
+                                      binWidth=rateBinWidth)
+        partition.pop(polarityTypeCode, None)
 
-        ImuOrPolarityMask = int('800', 16)
-        ImuOrPolarityLogical = np.bitwise_and(allAddr, ImuOrPolarityMask)
-        ImuOrPolarityLogical = ImuOrPolarityLogical.astype(bool)
-        frameLogical = np.logical_and(apsOrImuLogical,
-                                     np.logical_not(ImuOrPolarityLogical))
        # Frame events
-        if ('dataTypes' not in importParams or 'frame' in importParams['dataTypes']) \
-                and any(frameLogical):
+        if frameTypeCode in partition and len(partition[frameTypeCode][1]) > 0:
             print 'Processing frames ...'
-            frameSampleMask = int('1111111111', 2) 
             
-            frameData = allAddr[frameLogical] 
-            frameTs = allTs[frameLogical] 
+            frameData, frameTs = partition[frameTypeCode]
     
             # Note: uses int16 instead of uint16 to allow for a subtraction operation below to look for discontinuities
             frameX = np.array(np.right_shift(np.bitwise_and(frameData, xMask), xShiftBits), 'int16') 
@@ -205,142 +488,63 @@ def ImportAedatDataVersion1or2(aedat):
             # Note: no need for a bitshift here, since it's converted to boolean anyway
             frameSignal = np.array(np.bitwise_and(frameData, signalOrSpecialMask), 'bool') 
             
-             # In general the ramp of address values could be in either
-             # direction and either x or y could be the outer(inner) loop
-             # Search for a discontinuity in both x and y simultaneously
-            frameXDiscont = abs(frameX[1 : ] - frameX[0 : -1]) > 1 
-            frameYDiscont = abs(frameY[1 : ] - frameY[0 : -1]) > 1
-            frameDiscontIndex = np.where(np.logical_and(frameXDiscont, frameYDiscont))
-            frameDiscontIndex = frameDiscontIndex[0] # The last line produces a tuple - we only want the array
-            frameStarts = np.concatenate([[0], frameDiscontIndex  + 1, [frameData.size]])
+            frameStarts = FrameStartsVersion1or2(frameX, frameY)
              # Now we have the indices of the first sample in each frame, plus
              # an additional index just beyond the end of the array
             numFrames = frameStarts.size - 1 
+            frameStartIndices = frameStarts[0 : -1]
             outputData['frame'] = {}
-            outputData['frame']['reset']            = np.zeros(numFrames, 'bool') 
-            outputData['frame']['timeStampStart']   = np.zeros(numFrames, 'uint32') 
-            outputData['frame']['timeStampEnd']     = np.zeros(numFrames, 'uint32')
-            outputData['frame']['samples']          = np.empty(numFrames, 'object') 
-            outputData['frame']['xLength']          = np.zeros(numFrames, 'uint16') 
-            outputData['frame']['yLength']          = np.zeros(numFrames, 'uint16') 
-            outputData['frame']['xPosition']        = np.zeros(numFrames, 'uint16') 
-            outputData['frame']['yPosition']        = np.zeros(numFrames, 'uint16') 
-            
-            for frameIndex in range(0, numFrames) :
-                if frameIndex % 10 == 9:
-                    print 'Processing frame ', frameIndex + 1, ' of ', numFrames
-                # All within a frame should be either reset or signal. I could
-                # implement a check here to see that that's true, but I haven't
-                # done so; rather I just take the first value
-                outputData['frame']['reset'][frameIndex] \
-                    = not frameSignal[frameStarts[frameIndex]]  
-                
-                 # in aedat 2 format we don't have the four timestamps of aedat 3 format
-                 # We expect to find all the same timestamps  
-                 # nevertheless search for lowest and highest
-                outputData['frame']['timeStampStart'][frameIndex] \
-                    = min(frameTs[frameStarts[frameIndex] : frameStarts[frameIndex + 1]])  
-                outputData['frame']['timeStampEnd'][frameIndex] \
-                    = max(frameTs[frameStarts[frameIndex] : frameStarts[frameIndex + 1]])  
-    
-                tempXPosition = min(frameX[frameStarts[frameIndex] : frameStarts[frameIndex + 1]]) 
-                outputData['frame']['xPosition'][frameIndex] = tempXPosition 
-                tempYPosition = min(frameY[frameStarts[frameIndex] : frameStarts[frameIndex + 1]]) 
-                outputData['frame']['yPosition'][frameIndex] = tempYPosition 
-                outputData['frame']['xLength'][frameIndex] \
-                    = max(frameX[frameStarts[frameIndex] : frameStarts[frameIndex + 1]]) \
-                        - outputData['frame']['xPosition'][frameIndex] + 1 
-                outputData['frame']['yLength'][frameIndex] \
-                    = max(frameY[frameStarts[frameIndex] : frameStarts[frameIndex + 1]]) \
-                        - outputData['frame']['yPosition'][frameIndex] + 1 
-                # If we worked out which way the data is ramping in each
-                # direction, and if we could exclude data loss, then we could
-                # do some nice clean matrix transformations; but I'm just going
-                # to iterate through the samples, putting them in the right
-                # place in the array according to their address
-                
-                 # first create a temporary array - there is no concept of
-                 # colour channels in aedat2
-                
-                # IN MATLAB IMPLEMENTATION, THIS FOLLOWING LOOP IS REPLACED BY ACCUMARRAY FUNCTION - Haven't figured out a good python equivalent yet                
-                tempSamples = np.zeros((outputData['frame']['yLength'][frameIndex], \
-                                    outputData['frame']['xLength'][frameIndex]), dtype='uint16') 
-                for sampleIndex in range(frameStarts[frameIndex], frameStarts[frameIndex + 1]):
-                    tempSamples[frameY[sampleIndex] \
-                                    - outputData['frame']['yPosition'][frameIndex], \
-                                frameX[sampleIndex] \
-                                    - outputData['frame']['xPosition'][frameIndex]] \
-                        = frameSample[sampleIndex] 
-
-                outputData['frame']['samples'][frameIndex] = tempSamples 
+            # All within a frame should be either reset or signal. I could
+            # implement a check here to see that that's true, but I haven't
+            # done so; rather I just take the first value
+            outputData['frame']['reset'] = np.logical_not(frameSignal[frameStartIndices])
+
+             # in aedat 2 format we don't have the four timestamps of aedat 3 format
+             # We expect to find all the same timestamps  
+             # nevertheless search for lowest and highest
+            outputData['frame']['timeStampStart'] \
+                = np.minimum.reduceat(frameTs, frameStartIndices)
+            outputData['frame']['timeStampEnd'] \
+                = np.maximum.reduceat(frameTs, frameStartIndices)
+
+            outputData['frame']['xPosition'] \
+                = np.array(np.minimum.reduceat(frameX, frameStartIndices), 'uint16')
+            outputData['frame']['yPosition'] \
+                = np.array(np.minimum.reduceat(frameY, frameStartIndices), 'uint16')
+            outputData['frame']['xLength'] \
+                = np.array(np.maximum.reduceat(frameX, frameStartIndices) 
+                           - outputData['frame']['xPosition'] + 1, 'uint16')
+            outputData['frame']['yLength'] \
+                = np.array(np.maximum.reduceat(frameY, frameStartIndices) 
+                           - outputData['frame']['yPosition'] + 1, 'uint16')
+
+            # Scatter all the samples into one array of frames in a single
+            # operation - this does the job of accumarray in the MATLAB
+            # implementation. Each frame is placed in the top-left corner of
+            # its slot, so frames smaller than the largest one are padded with
+            # zeros beyond their xLength and yLength. There is no concept of
+            # colour channels in aedat2
+            sampleFrameIndex = np.repeat(np.arange(numFrames), np.diff(frameStarts))
+            outputData['frame']['samples'] \
+                = np.zeros((numFrames, 
+                            outputData['frame']['yLength'].max(), 
+                            outputData['frame']['xLength'].max()), dtype='uint16') 
+            outputData['frame']['samples'][sampleFrameIndex, 
+                frameY - outputData['frame']['yPosition'][sampleFrameIndex].astype('int16'), 
+                frameX - outputData['frame']['xPosition'][sampleFrameIndex].astype('int16')] \
+                = frameSample
+            del sampleFrameIndex
     
             if (not ('subtractResetRead' in importParams) or importParams['subtractResetRead']) \
                     and 'reset' in outputData['frame']:
-                # Make a second pass through the frames, subtracting reset
-                # reads from signal reads
-                frameCount = 0
-                for frameIndex in range(0, numFrames):
-                    if frameIndex % 10 == 9:
-                        print 'Performing subtraction on frame ', frameIndex + 1, ' of ', numFrames
-                    if outputData['frame']['reset'][frameIndex]: 
-                        resetFrame = outputData['frame']['samples'][frameIndex] 
-                        resetXPosition = outputData['frame']['xPosition'][frameIndex] 
-                        resetYPosition = outputData['frame']['yPosition'][frameIndex] 
-                        resetXLength = outputData['frame']['xLength'][frameIndex] 
-                        resetYLength = outputData['frame']['yLength'][frameIndex]                     
-                    else: 
-                         # If a resetFrame has not yet been found, 
-                         # push through the signal frame as is
-                        if not 'resetFrame' in locals():
-                            outputData['frame']['samples'][frameCount] \
-                                = outputData['frame']['samples'][frameIndex] 
-                        else:
-                             # If the resetFrame and signalFrame are not the same size,    
-                             # don't attempt subtraction 
-                             # (there is probably a cleaner solution than this - could be improved)
-                            if resetXPosition != outputData['frame']['xPosition'][frameIndex] \
-                                or resetYPosition != outputData['frame']['yPosition'][frameIndex] \
-                                or resetXLength != outputData['frame']['xLength'][frameIndex] \
-                                or resetYLength != outputData['frame']['yLength'][frameIndex]:
-                                outputData['frame']['samples'][frameCount] \
-                                    = outputData['frame']['samples'][frameIndex] 
-                            else:
-                                 # Do the subtraction
-                                outputData['frame']['samples'][frameCount] \
-                                    = resetFrame - outputData['frame']['samples'][frameIndex] 
-                                # This operation was on unsigned integers, set negatives to zero
-                                outputData['frame']['samples'][frameCount][outputData['frame']['samples'][frameCount] > 32767] = 0
-                             # Copy over the reset of the info
-                            outputData['frame']['xPosition'][frameCount] \
-                                = outputData['frame']['xPosition'][frameIndex] 
-                            outputData['frame']['yPosition'][frameCount] \
-                                = outputData['frame']['yPosition'][frameIndex] 
-                            outputData['frame']['xLength'][frameCount] \
-                                = outputData['frame']['xLength'][frameIndex] 
-                            outputData['frame']['yLength'][frameCount] \
-                                = outputData['frame']['yLength'][frameIndex] 
-                            outputData['frame']['timeStampStart'][frameCount] \
-                                = outputData['frame']['timeStampStart'][frameIndex]  
-                            outputData['frame']['timeStampEnd'][frameCount] \
-                                = outputData['frame']['timeStampEnd'][frameIndex]                              
-                            frameCount = frameCount + 1
-                 # Clip the arrays
-                outputData['frame']['xPosition'] \
-                    = outputData['frame']['xPosition'][0 : frameCount] 
-                outputData['frame']['yPosition'] \
-                    = outputData['frame']['yPosition'][0 : frameCount] 
-                outputData['frame']['xLength'] \
-                    = outputData['frame']['xLength'][0 : frameCount] 
-                outputData['frame']['yLength'] \
-                    = outputData['frame']['yLength'][0 : frameCount] 
-                outputData['frame']['timeStampStart'] \
-                    = outputData['frame']['timeStampStart'][0 : frameCount] 
-                outputData['frame']['timeStampEnd'] \
-                    = outputData['frame']['timeStampEnd'][0 : frameCount] 
-                outputData['frame']['samples'] \
-                    = outputData['frame']['samples'][0 : frameCount]
-                del outputData['frame']['reset']   # reset is no longer needed
-        del frameLogical
+                # Subtract reset reads from signal reads, optionally into a
+                # buffer supplied by the caller
+                outputData['frame'] = SubtractResetReadVersion1or2(
+                    outputData['frame'], importParams.get('frameBuffer'))
+            AccumulateEventStatistics(statistics, 'frame', outputData['frame']['timeStampStart'],
+                                      outputData['frame']['timeStampEnd'],
+                                      binWidth=rateBinWidth)
+        partition.pop(frameTypeCode, None)
     
     
         # IMU events
@@ -348,19 +552,18 @@ def ImportAedatDataVersion1or2(aedat):
         # a single sample; the following code recomposes these
         # 7 words are sent in series, these being 3 axes for accel, temperature, and 3 axes for gyro
 
-        imuLogical = np.logical_and(apsOrImuLogical, ImuOrPolarityLogical)
-        if ('dataTypes' not in importParams or 'imu6' in importParams['dataTypes']) \
-                and any(imuLogical):
+        if imuTypeCode in partition and len(partition[imuTypeCode][1]) >= 7:
             print 'Processing IMU6 events ...'
+            imuData, imuTs = partition[imuTypeCode]
+            # A window or a truncated file may end part way through a block;
+            # its words are dropped, so that all the columns are of one length
+            numImuWords = len(imuTs) - np.mod(len(imuTs), 7)
+            if numImuWords < len(imuTs): 
+                print 'The number of IMU samples is not divisible by 7, so the last %d are dropped' \
+                    % (len(imuTs) - numImuWords)
+                imuData = imuData[0 : numImuWords]
             outputData['imu6'] = {}
-            outputData['imu6']['timeStamp'] = allTs[imuLogical]
-
-            if np.mod(np.count_nonzero(imuLogical), 7) > 0: 
-                print 'The number of IMU samples is not divisible by 7, so IMU samples are not interpretable'
-            else:
-                outputData['imu6']['timeStamp'] = allTs[imuLogical]
-                outputData['imu6']['timeStamp'] \
-                    = outputData['imu6']['timeStamp'][0 : : 7]
+            outputData['imu6']['timeStamp'] = imuTs[0 : numImuWords : 7]
     
             # Conversion factors
             # Actually these scales depend on the fiull scale value 
@@ -372,9 +575,7 @@ def ImportAedatDataVersion1or2(aedat):
             temperatureScale = 1.0/340
             temperatureOffset=35.0
     
-            imuDataMask = int('0FFFF000', 16)
-            imuDataShiftBits = 12
-            rawData = np.right_shift(np.bitwise_and(allAddr[imuLogical], imuDataMask), imuDataShiftBits)
+            rawData = np.right_shift(np.bitwise_and(imuData, imuDataMask), imuDataShiftBits)
             # This is a uint32 which contains an int16. Need to convert to int16 before converting to float.             
             rawData = rawData.astype('int16')
             rawData = rawData.astype('float32')
@@ -386,22 +587,9 @@ def ImportAedatDataVersion1or2(aedat):
             outputData['imu6']['gyroX']         = rawData[4 : : 7] * gyroScale  
             outputData['imu6']['gyroY']         = rawData[5 : : 7] * gyroScale
             outputData['imu6']['gyroZ']         = rawData[6 : : 7] * gyroScale
-        del imuLogical
+            AccumulateEventStatistics(statistics, 'imu6', outputData['imu6']['timeStamp'],
+                                      binWidth=rateBinWidth)
+        partition.pop(imuTypeCode, None)
 
-    # If you want to do chip-specific address shifts or subtractions,
-    # this would be the place to do it.
+    return outputData
 
-    # calculate numEvents fields  also find first and last timeStamps
-    info['firstTimeStamp'] = np.infty
-    info['lastTimeStamp'] = 0
-
-    aedat['info'] = info
-    aedat['data'] = outputData
-
-    # Find first and last time stamps        
-    aedat = FindFirstAndLastTimeStamps(aedat)
-    
-    # Add NumEvents field for each data type
-    aedat = NumEventsByType(aedat)
-       
-    return aedat
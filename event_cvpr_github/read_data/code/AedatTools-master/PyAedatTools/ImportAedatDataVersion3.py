@@ -9,24 +9,148 @@ Refer to this function for the definition of input/output variables etc
 Let's just assume this code runs on little-endian processor. 
 
 Not handled yet:
-Timestamp overflow
 Reading by packets
 Data-type-specific read in
-Frames and other data types
+Sample, ear and other less common data types
 Multi-source read-in
-Building large arrays, 
-    exponentially expanding them, and cropping them at the end, in order to 
-    read more efficiently - at the moment we build a list then convert to array. 
 
+The events of each type are collected in a ColumnBuffer, which grows by
+doubling and is cropped once at the end.
+
+Timestamps are uint64, corrected for overflow (from each packet's
+tsOverflow) and for timestamp resets: after a TIMESTAMP_RESET special event,
+time carries on from the reset rather than starting again from 0. The offset
+in effect at the start of each packet is kept in the packet index
+(info['packetResetOffsets']), so that reads which start part way through the
+file or skip packets get the same timestamps as a full read.
 
 """
 
 import struct
 import math
 import numpy as np                       
+from PyAedatTools.ColumnBuffer import ColumnBuffer
+from PyAedatTools.UnwrapTimeStamps import UnwrapTimeStamps
+from PyAedatTools.EventStatistics import RateBinWidth
+from PyAedatTools.EventStatistics import AccumulateEventStatistics
+from PyAedatTools.EventStream import StreamsFromData
 from PyAedatTools.FindFirstAndLastTimeStamps import FindFirstAndLastTimeStamps
 from PyAedatTools.NumEventsByType import NumEventsByType
 
+# The data types decoded, by packet event type
+dataTypesByEventType = {0: 'special',
+                        1: 'polarity',
+                        2: 'frame',
+                        3: 'imu6',
+                        8: 'point1D',
+                        9: 'point2D',
+                        10: 'point3D'}
+
+# The output columns of each data type, apart from frames (whose columns 
+# depend on importParams['simplifyFrameTimeStamps'])
+columnFormatsByDataType = {
+    'special': [('valid', 'bool'),
+                ('timeStamp', 'uint64'),
+                ('address', 'uint32')],
+    'polarity': [('valid', 'bool'),
+                 ('timeStamp', 'uint64'),
+                 ('y', 'uint16'),
+                 ('x', 'uint16'),
+                 ('polarity', 'bool')],
+    'imu6': [('valid', 'bool'),
+             ('timeStamp', 'uint64'),
+             ('accelX', 'float32'),
+             ('accelY', 'float32'),
+             ('accelZ', 'float32'),
+             ('gyroX', 'float32'),
+             ('gyroY', 'float32'),
+             ('gyroZ', 'float32'),
+             ('temperature', 'float32')],
+    'point1D': [('valid', 'bool'),
+                ('timeStamp', 'uint64'),
+                ('type', 'uint8'),
+                ('x', 'float32')],
+    'point2D': [('valid', 'bool'),
+                ('timeStamp', 'uint64'),
+                ('type', 'uint8'),
+                ('x', 'float32'),
+                ('y', 'float32')],
+    'point3D': [('valid', 'bool'),
+                ('timeStamp', 'uint64'),
+                ('type', 'uint8'),
+                ('x', 'float32'),
+                ('y', 'float32'),
+                ('z', 'float32')]}
+
+specialDataFormat = np.dtype([('info', '<u4'), ('timeStamp', '<i4')])
+# The special event type of a timestamp reset
+timeStampResetType = 1
+
+def UnwrapSpecialEventsVersion3(allEvents, packetTimeStampOffset):
+    """
+    Returns the timestamps of a packet of special events, allowing for any
+    TIMESTAMP_RESET events among them, together with the timestamp of the
+    last reset (from which time carries on afterwards), or None if there is
+    no reset in the packet.
+    """
+
+    allInfo = allEvents['info']
+    resetLogical = np.logical_and(
+        np.bitwise_and(allInfo, 0x1).astype(bool),
+        np.right_shift(np.bitwise_and(allInfo, 0xFE), 1) == timeStampResetType)
+    state = {'offset': packetTimeStampOffset}
+    allTimeStamps = UnwrapTimeStamps(allEvents['timeStamp'], resetLogical, state,
+                                     wrapPeriod=None)
+    if resetLogical.any():
+        return allTimeStamps, np.uint64(state['offset'])
+    return allTimeStamps, None
+
+def StartTimePacketIndex(packetTypes, packetTimeStamps, startTimeStamp):
+    """
+    The (0-based) index of the packet from which to read the events from
+    startTimeStamp (in us) on, given the packet index. The last packet of
+    each event type which begins before startTimeStamp may hold events after
+    it, so this is the earliest of those packets; None if no packet begins
+    before startTimeStamp.
+    """
+
+    targetPacketIndices = np.flatnonzero(packetTimeStamps < startTimeStamp)
+    if targetPacketIndices.size == 0:
+        return None
+    _, lastOfTypeReversed = np.unique(packetTypes[targetPacketIndices][::-1], return_index=True)
+    return targetPacketIndices[targetPacketIndices.size - 1 - lastOfTypeReversed].min()
+
+def CropToTimeWindow(outputData, statistics, startTimeStamp, endTimeStamp, rateBinWidth):
+    """
+    Packets are read whole, so the first and last ones read may hold events
+    outside the time window. This keeps only the events of each data type
+    whose timestamps (for frames, their start timestamps) lie from
+    startTimeStamp to endTimeStamp (in us), as a time window of an aedat 1/2
+    file does, and works out the statistics of the types cut again from the
+    events kept. outputData and statistics are updated in place.
+    """
+
+    streams = StreamsFromData(outputData)
+    for dataType in streams:
+        stream = streams[dataType]
+        timeStamps = stream[stream.firstTimeStampColumn()]
+        keepLogical = np.logical_and(timeStamps >= startTimeStamp, timeStamps <= endTimeStamp)
+        if keepLogical.all():
+            continue
+        statistics.pop(dataType, None)
+        if not keepLogical.any():
+            del outputData[dataType]
+            continue
+        stream = stream[keepLogical]
+        outputData[dataType] = stream.columns
+        if dataType == 'polarity':
+            AccumulateEventStatistics(statistics, dataType, stream['timeStamp'],
+                                      polarity=stream['polarity'], binWidth=rateBinWidth)
+        else:
+            AccumulateEventStatistics(statistics, dataType, stream[stream.firstTimeStampColumn()],
+                                      stream[stream.lastTimeStampColumn()], binWidth=rateBinWidth)
+    return outputData
+
 def ImportAedatDataVersion3(aedat):
 
     # Unpack the aedat dict
@@ -36,7 +160,7 @@ def ImportAedatDataVersion3(aedat):
     
     # Check the startEvent and endEvent parameters
     if 'startPacket' in importParams:
-        startPacket = importParams.startPacket
+        startPacket = importParams['startPacket']
     else:    
         startPacket = 1
 
@@ -101,32 +225,98 @@ def ImportAedatDataVersion3(aedat):
         allDataTypes = True
         
     packetCount = 0
+    mainTimeStamp = 0 # Stays at 0 until a packet of a wanted type is read
+
+    # The packet index arrays are 0-based: packet number packetCount (1-based)
+    # is held at position packetCount - 1.
+    # An index which stops short of the end of the file (e.g. because the
+    # file has grown since it was built) is marked with
+    # info['packetIndexComplete'] = False; an indexing pass (noData) then
+    # carries on from the last packet in it rather than starting again.
+    extendIndex = noData and 'packetPointers' in info \
+                  and not info.get('packetIndexComplete', True)
+    reachedEndOfFile = False
+    # The timestamp reset offset in effect
+    timeStampResetOffset = np.uint64(0)
 
     # Has this file already been indexed in a previous pass?
     if 'packetPointers' in info:
         packetTypes = info['packetTypes']
         packetPointers = info['packetPointers']
         packetTimeStamps = info['packetTimeStamps']
+        packetEventNumbers = info['packetEventNumbers']
+        # An index without reset offsets is taken to have no resets
+        packetResetOffsets = info.get('packetResetOffsets', 
+                                      np.zeros(len(packetPointers), np.uint64))
+        numIndexedPackets = len(packetPointers)
     elif endPacket < np.inf:
-        packetTypes = np.ones(endPacket, np.uint16)
-        packetPointers = np.zeros(endPacket, np.uint64)
-        packetTimeStamps = np.zeros(endPacket, np.uint64)
+        packetTypes = np.ones(int(endPacket), np.uint16)
+        packetPointers = np.zeros(int(endPacket), np.uint64)
+        packetTimeStamps = np.zeros(int(endPacket), np.uint64)
+        packetEventNumbers = np.zeros(int(endPacket), np.uint32)
+        packetResetOffsets = np.zeros(int(endPacket), np.uint64)
+        numIndexedPackets = 0
     else:
         packetTypes = np.ones(1000, np.uint16)
         packetPointers = np.zeros(1000, np.uint64)
         packetTimeStamps = np.zeros(1000, np.uint64)
+        packetEventNumbers = np.zeros(1000, np.uint32)
+        packetResetOffsets = np.zeros(1000, np.uint64)
+        numIndexedPackets = 0
         
-    if noData == False:
-        specialNumEvents = 0
-        specialValid = np.zeros(0, dtype=bool)
-        specialDataFormat = np.dtype([('info', '<u4'), ('timeStamp', '<i4')])
+    fileHandle.seek(0, 2)
+    fileSize = fileHandle.tell()
 
-        polarityNumEvents  = 0
-        polarityValid      = np.zeros(0, dtype=bool)
+    if noData == False:
+        # If the file has been indexed, the number of events of each type in
+        # the packets to be read is known, and is used as the initial 
+        # capacity of the column buffers
+        capacityByType = {}
+        if 'packetPointers' in info:
+            indexedPacketNumbers = np.arange(1, len(packetPointers) + 1)
+            packetsToRead = np.logical_and(indexedPacketNumbers >= startPacket,
+                                           indexedPacketNumbers <= endPacket)
+            packetsToRead = np.logical_and(packetsToRead, 
+                                           np.mod(indexedPacketNumbers, modPacket) == 0)
+            for indexedType in np.unique(packetTypes[packetsToRead]):
+                capacityByType[indexedType] = np.sum(
+                    packetEventNumbers[packetsToRead][packetTypes[packetsToRead] == indexedType], 
+                    dtype=np.int64)
+
+        # Counts, time ranges etc of the events, accumulated packet by packet
+        # (see EventStatistics)
+        statistics = {}
+        rateBinWidth = RateBinWidth(importParams)
+
+        specialColumns = ColumnBuffer(columnFormatsByDataType['special'],
+                                      capacityByType.get(0, 0))
+
+        polarityColumns = ColumnBuffer(columnFormatsByDataType['polarity'],
+                                       capacityByType.get(1, 0))
         polarityDataFormat = np.dtype([('address', '<u4'), ('timeStamp', '<i4')])
 
-        frameNumEvents              = 0
-        frameValid                  = np.zeros(0, dtype=bool)
+        # Frames are held in a (numFrames, yLength, xLength, colorChannels)
+        # samples column; this grows to fit the largest frame, with smaller
+        # frames at the start of each dimension, padded with zeros
+        frameColumns = [('valid', 'bool'),
+                        ('colorChannels', 'uint8'),
+                        ('colorFilter', 'uint8'),
+                        ('roiId', 'uint8')]
+        if simplifyFrameTimeStamps:
+            frameColumns = frameColumns + [('timeStampStart', 'uint64'),
+                                           ('timeStampEnd', 'uint64')]
+        else:
+            frameColumns = frameColumns + [('timeStampFrameStart', 'uint64'),
+                                           ('timeStampFrameEnd', 'uint64'),
+                                           ('timeStampExposureStart', 'uint64'),
+                                           ('timeStampExposureEnd', 'uint64')]
+        frameColumns = ColumnBuffer(frameColumns 
+                                    + [('xLength', 'uint16'),
+                                       ('yLength', 'uint16'),
+                                       ('xPosition', 'uint16'),
+                                       ('yPosition', 'uint16'),
+                                       ('samples', 'uint16', (0, 0, 0))],
+                                    capacityByType.get(2, 0))
         frameColorChannelsMask      = 0xE
         frameColorChannelsShiftBits = 1
         frameColorFilterMask        = 0x70
@@ -134,8 +324,17 @@ def ImportAedatDataVersion3(aedat):
         frameRoiIdMask              = 0x3F80
         frameRoiIdShiftBits         = 7
 
-        imu6NumEvents = 0
-        imu6Valid     = np.zeros(0, dtype=bool)
+        imu6Columns = ColumnBuffer(columnFormatsByDataType['imu6'],
+                                   capacityByType.get(3, 0))
+        imu6DataFormat = np.dtype([('info', '<u4'),
+                                   ('timeStamp', '<i4'),
+                                   ('accelX', '<f4'),
+                                   ('accelY', '<f4'),
+                                   ('accelZ', '<f4'),
+                                   ('gyroX', '<f4'),
+                                   ('gyroY', '<f4'),
+                                   ('gyroZ', '<f4'),
+                                   ('temperature', '<f4')])
 
         sampleNumEvents = 0
         sampleValid     = np.zeros(0, dtype=bool)
@@ -143,21 +342,21 @@ def ImportAedatDataVersion3(aedat):
         earNumEvents = 0
         earValid     = np.zeros(0, dtype=bool)
 
-        point1DNumEvents = 0
-        point1DValid     = np.zeros(0, dtype=bool)
+        point1DColumns = ColumnBuffer(columnFormatsByDataType['point1D'],
+                                      capacityByType.get(8, 0))
         point1DDataFormat = np.dtype([('info', '<u4'), 
                                       ('x', '<f4'), 
                                       ('timeStamp', '<i4')])
 
-        point2DNumEvents = 0
-        point2DValid     = np.zeros(0, dtype=bool)
+        point2DColumns = ColumnBuffer(columnFormatsByDataType['point2D'],
+                                      capacityByType.get(9, 0))
         point2DDataFormat = np.dtype([('info', '<u4'), 
                                       ('x', '<f4'), 
                                       ('y', '<f4'), 
                                       ('timeStamp', '<i4')])
 
-        point3DNumEvents = 0
-        point3DValid     = np.zeros(0, dtype=bool)
+        point3DColumns = ColumnBuffer(columnFormatsByDataType['point3D'],
+                                      capacityByType.get(10, 0))
         point3DDataFormat = np.dtype([('info', '<u4'), 
                                       ('x', '<f4'), 
                                       ('y', '<f4'), 
@@ -170,15 +369,21 @@ def ImportAedatDataVersion3(aedat):
     
     # If the file has been indexed or partially indexed, and there is a
     # startPacket or startTime parameter, then jump ahead to the right place
-    if 'packetPointers' in info:
+    if extendIndex:
+        # The last packet indexed may have been cut short, so index it again
+        if len(packetPointers) > 0:
+            fileHandle.seek(packetPointers[-1])
+            packetCount = len(packetPointers) - 1
+    elif 'packetPointers' in info:
         if startPacket > 1: 
-            fileHandle.seek(packetPointers(startPacket))
+            fileHandle.seek(packetPointers[startPacket - 1])
             packetCount = startPacket - 1
         elif startTime > 0:
-            targetPacketIndices = np.argwhere(info['packetTimeStamps'] < startTime * 1e6)
-            if targetPacketIndices: # i.e. targetPacketIndices is not empty
-                fileHandle.seek(packetPointers(targetPacketIndices[-1]))
-                packetCount = targetPacketIndices[-1]
+            targetPacketIndex = StartTimePacketIndex(info['packetTypes'],
+                                                     info['packetTimeStamps'], startTime * 1e6)
+            if targetPacketIndex is not None:
+                fileHandle.seek(packetPointers[targetPacketIndex])
+                packetCount = targetPacketIndex
     
     # If the file has already been indexed (PARTIAL INDEXING NOT HANDLED), and
     # we are using modPacket to skip a proportion of the data, then use this
@@ -190,28 +395,55 @@ def ImportAedatDataVersion3(aedat):
         # Read the header of the next packet
         packetCount = packetCount + 1
         if modSkipping:
-            packetCount = np.ceil(packetCount / modPacket) * modPacket
-            fileHandle.seek(packetPointers[packetCount])
+            packetCount = int(np.ceil(float(packetCount) / modPacket)) * modPacket
+            if packetCount > len(packetPointers):
+                packetCount = len(packetPointers)
+                info['numPackets'] = packetCount
+                break
+            fileHandle.seek(packetPointers[packetCount - 1])
 
 
         header = fileHandle.read(28)
         if len(header) < 28: # i.e. EOF
             packetCount = packetCount - 1
             info['numPackets'] = packetCount
+            reachedEndOfFile = True
             break
         if len(packetTypes) < packetCount:
             # Double the size of packet index arrays as necessary
             packetTypes      = np.append(packetTypes,      np.ones (packetCount, 'uint16') * 32768, 0)
             packetPointers   = np.append(packetPointers,   np.zeros(packetCount, 'uint64'), 0)
             packetTimeStamps = np.append(packetTimeStamps, np.zeros(packetCount, 'uint64'), 0)
-        packetPointers[packetCount] = fileHandle.tell() - 28    
+            packetEventNumbers = np.append(packetEventNumbers, np.zeros(packetCount, 'uint32'), 0)
+            packetResetOffsets = np.append(packetResetOffsets, np.zeros(packetCount, 'uint64'), 0)
+        packetPointers[packetCount - 1] = fileHandle.tell() - 28    
+        # Packets already indexed give the reset offset in effect, as the
+        # packets before them may not have been read
+        if packetCount <= numIndexedPackets:
+            timeStampResetOffset = packetResetOffsets[packetCount - 1]
+        else:
+            packetResetOffsets[packetCount - 1] = timeStampResetOffset
         if packetCount % 100 == 0 :
-            print 'packet: %d; file position: %d MB' % (packetCount, math.floor(info['fileHandle'].tell / 1000000))
+            print 'packet: %d; file position: %d MB' % (packetCount, math.floor(fileHandle.tell() / 1000000))
         if startPacket > packetCount or np.mod(packetCount, modPacket) > 0:
             # Ignore this packet as its count is too low
             eventSize = struct.unpack('I', header[4:8])[0]
             eventNumber = struct.unpack('I', header[20:24])[0]
-            fileHandle.seek(eventNumber * eventSize, 1)
+            packetTypes[packetCount - 1] = struct.unpack('h', header[0:2])[0]
+            packetEventNumbers[packetCount - 1] = eventNumber
+            if packetTypes[packetCount - 1] == 0 and packetCount > numIndexedPackets:
+                # Timestamp resets have to be followed through the packets
+                # skipped, unless they are in the index already
+                nextPacketPointer = fileHandle.tell() + eventNumber * eventSize
+                eventTsOverflow = struct.unpack('I', header[12:16])[0]
+                resetTimeStamp = UnwrapSpecialEventsVersion3(
+                    np.fromfile(fileHandle, specialDataFormat, eventNumber),
+                    np.uint64(eventTsOverflow) * 2 ** 31 + timeStampResetOffset)[1]
+                if resetTimeStamp is not None:
+                    timeStampResetOffset = resetTimeStamp
+                fileHandle.seek(nextPacketPointer)
+            else:
+                fileHandle.seek(eventNumber * eventSize, 1)
         elif endPacket < packetCount:
             packetCount = packetCount - 1
         else:
@@ -224,6 +456,7 @@ def ImportAedatDataVersion3(aedat):
             # Read the full packet
             numBytesInPacket = eventNumber * eventSize
             packetTimeStampOffset = np.uint64(eventTsOverflow) * 2 ** 31 # Why 31 bits? because this is added to the 32 bit timestamp, which is signed and therefore wraps after 31 bits
+            packetTimeStampOffset = packetTimeStampOffset + timeStampResetOffset
             '''
             There should be a startTime check here, but this requires to find the maintimestamp by reading ahead - do this later
             It should only do this until a flag is raised saying that we're now past the start time.
@@ -231,236 +464,189 @@ def ImportAedatDataVersion3(aedat):
                         if startTime * 1e6 <= mainTimeStamp:
             '''
             eventType = struct.unpack('h', header[0:2])[0]
-            packetTypes[packetCount] = eventType
+            packetTypes[packetCount - 1] = eventType
+            packetEventNumbers[packetCount - 1] = eventNumber
         
             #eventSource = struct.unpack('h', [header[2:4])[0] # Multiple sources not handled yet
             if noData:
-                # Inefficient - better to just read the timestamp and skip the rest
-                packetData = fileHandle.read(numBytesInPacket)
-                mainTimeStamp = np.uint64(struct.unpack('i', \
-                                       packetData[eventTsOffset : eventTsOffset + 4])[0]) \
-                              + packetTimeStampOffset
+                # Read just the timestamp of the first event and skip the
+                # rest of the packet, so that indexing only touches the
+                # headers. An empty (or cut short) packet keeps the
+                # timestamp of the packet before
+                nextPacketPointer = fileHandle.tell() + numBytesInPacket
+                if eventType == 0:
+                    # Special event packets are small, and are read in full
+                    # to follow any timestamp resets
+                    allTimeStamps, resetTimeStamp = UnwrapSpecialEventsVersion3(
+                        np.fromfile(fileHandle, specialDataFormat, eventNumber),
+                        packetTimeStampOffset)
+                    if len(allTimeStamps) > 0:
+                        mainTimeStamp = allTimeStamps[0]
+                    if resetTimeStamp is not None:
+                        timeStampResetOffset = resetTimeStamp
+                elif eventNumber > 0:
+                    fileHandle.seek(eventTsOffset, 1)
+                    timeStampBytes = fileHandle.read(4)
+                    if len(timeStampBytes) == 4:
+                        mainTimeStamp = np.uint64(struct.unpack('i', timeStampBytes)[0]) \
+                                      + packetTimeStampOffset
+                packetTimeStamps[packetCount - 1] = mainTimeStamp
+                fileHandle.seek(nextPacketPointer)
             else:
+                # Not every branch below reads the packet (e.g. unwanted or
+                # unhandled types), so note where the next packet begins
+                nextPacketPointer = fileHandle.tell() + numBytesInPacket
+                # No column buffer needs to grow beyond the number of events
+                # of this size which the rest of the file could hold
+                numEventsRemaining = (fileSize - fileHandle.tell()) // max(eventSize, 1)
                               
                 # Handle the packet types individually:
             
-                # Special events
+                # Special events - these are read even if they're not
+                # wanted, to follow any timestamp resets
                 if eventType == 0:
-                    if allDataTypes or 'special' in info['dataTypes']:
-                        # First check if the array is big enough
-                        currentLength = len(specialValid)
-                        if currentLength == 0:
-                            specialValid     = np.zeros(eventNumber, dtype=bool)
-                            specialTimeStamp = np.zeros(eventNumber, 'uint64')
-                            specialAddress   = np.zeros(eventNumber, 'uint32')
-                        else:
-                            while eventNumber > currentLength - specialNumEvents:
-                                specialValid		= np.append(specialValid,     np.zeros(currentLength, 'bool'  ))
-                                specialTimeStamp	= np.append(specialTimeStamp, np.zeros(currentLength, 'uint64'))
-                                specialAddress	= np.append(specialAddress,   np.zeros(currentLength, 'uint32'))
-                                currentLength = len(specialValid)
-                        allEvents = np.fromfile(fileHandle, specialDataFormat, eventNumber)
-                        allInfo = np.array(allEvents['info'])
-                        specialValid[specialNumEvents : specialNumEvents + eventNumber] \
-                            = bool(allInfo and 0x1) # Pick off the first bit
-                        specialAddress[specialNumEvents : specialNumEvents + eventNumber] \
-                            = (allInfo and 0xFE) >> 1 # Next 7 bits are the special event type
+                    allEvents = np.fromfile(fileHandle, specialDataFormat, eventNumber)
+                    allTimeStamps, resetTimeStamp = UnwrapSpecialEventsVersion3(
+                        allEvents, packetTimeStampOffset)
+                    if resetTimeStamp is not None:
+                        timeStampResetOffset = resetTimeStamp
+                    if allDataTypes or 'special' in dataTypes:
+                        allInfo = allEvents['info']
+                        start, end = specialColumns.extend(
+                            len(allEvents), len(specialColumns) + numEventsRemaining)
+                        specialColumns.columns['valid'][start : end] \
+                            = np.bitwise_and(allInfo, 0x1).astype(bool) # Pick off the first bit
+                        specialColumns.columns['address'][start : end] \
+                            = np.right_shift(np.bitwise_and(allInfo, 0xFE), 1) # Next 7 bits are the special event type
                         # special optional data would go here - next 24 bits - no need at the present    
-                        specialTimeStamp[specialNumEvents : specialNumEvents + eventNumber] \
-                            = packetTimeStampOffset + np.uint64(np.array(allEvents['timeStamp']))
-                        mainTimeStamp = specialTimeStamp(specialNumEvents)
-                        specialNumEvents = specialNumEvents + eventNumber
+                        specialColumns.columns['timeStamp'][start : end] = allTimeStamps
+                        if end > start:
+                            mainTimeStamp = specialColumns.columns['timeStamp'][start]
+                        AccumulateEventStatistics(statistics, 'special',
+                            specialColumns.columns['timeStamp'][start : end],
+                            binWidth=rateBinWidth)
 
                 # Polarity events                
                 elif eventType == 1:  
-                    if allDataTypes or 'polarity' in info['dataTypes']:
-                        # First check if the array is big enough
-                        currentLength = len(polarityValid)
-                        if currentLength == 0:
-                            polarityValid     = np.zeros(eventNumber, dtype=bool)
-                            polarityTimeStamp = np.zeros(eventNumber, 'uint64')
-                            polarityX         = np.zeros(eventNumber, 'uint16')
-                            polarityY         = np.zeros(eventNumber, 'uint16')
-                            polarityPolarity  = np.false(eventNumber);
-                        else:
-                            while eventNumber > currentLength - polarityNumEvents:
-                                polarityValid     = np.append(polarityValid,     np.zeros(currentLength, 'bool'  ))
-                                polarityTimeStamp = np.append(polarityTimeStamp, np.zeros(currentLength, 'uint64'))
-                                polarityX         = np.append(polarityX,         np.zeros(currentLength, 'uint16'))
-                                polarityY         = np.append(polarityY,         np.zeros(currentLength, 'uint16'))
-                                polarityPolarity  = np.append(polarityPolarity,  np.false(currentLength          ))
-                                currentLength = len(polarityValid)
+                    if allDataTypes or 'polarity' in dataTypes:
                         allEvents = np.fromfile(fileHandle, polarityDataFormat, eventNumber)
-                        allAddresses = np.array(allEvents['addr'])
+                        allAddresses = allEvents['address']
+                        start, end = polarityColumns.extend(
+                            len(allEvents), len(polarityColumns) + numEventsRemaining)
+                        # Decode the whole packet at once, straight into the columns
                         # Pick off the first bit as the validity mark
-                        polarityValid[polarityNumEvents : polarityNumEvents + eventNumber] \
-                            = bool(allAddresses & 0x1) 
+                        polarityColumns.columns['valid'][start : end] \
+                            = np.bitwise_and(allAddresses, 0x1).astype(bool)
                         # Pick off the second bit as the polarity
-                        polarityPolarity[polarityNumEvents : polarityNumEvents + eventNumber] \
-                            = bool(allAddresses & 0x2)
-                        polarityY[polarityNumEvents : polarityNumEvents + eventNumber] \
-                            = np.uint16((allAddresses & 0x1FFFC) >> 2)
-                        polarityX[polarityNumEvents : polarityNumEvents + eventNumber] \
-                            = np.uint16((allAddresses & 0xFFFE0000) >> 17)
-                        polarityTimeStamp[polarityNumEvents : polarityNumEvents + eventNumber] \
-                            = packetTimeStampOffset + np.uint64(np.array(allEvents['timeStamp'])) 
-                        mainTimeStamp = polarityTimeStamp(polarityNumEvents)
-                        polarityNumEvents = polarityNumEvents + eventNumber
+                        polarityColumns.columns['polarity'][start : end] \
+                            = np.bitwise_and(allAddresses, 0x2).astype(bool)
+                        polarityColumns.columns['y'][start : end] \
+                            = np.right_shift(np.bitwise_and(allAddresses, 0x1FFFC), 2)
+                        polarityColumns.columns['x'][start : end] \
+                            = np.right_shift(allAddresses, 17)
+                        # Timestamps are corrected for overflow as 64 bit
+                        polarityColumns.columns['timeStamp'][start : end] \
+                            = packetTimeStampOffset + allEvents['timeStamp'].astype(np.uint64)
+                        if end > start:
+                            mainTimeStamp = polarityColumns.columns['timeStamp'][start]
+                        AccumulateEventStatistics(statistics, 'polarity',
+                            polarityColumns.columns['timeStamp'][start : end],
+                            polarity=polarityColumns.columns['polarity'][start : end],
+                            binWidth=rateBinWidth)
                 # Frames
                 elif(eventType == 2): 
-                    '''                    
-                    if allDataTypes || any(cellfun(cellFind('frame'), dataTypes))
-                        % First check if the array is big enough
-                        currentLength = length(frameValid);
-                        if currentLength == 0
-                            frameValid					= np.zeros(eventNumber, dtype=bool)
-                            frameColorChannels			= uint8(zeros(eventNumber, 1));
-                            frameColorFilter			= uint8(zeros(eventNumber, 1));
-                            frameRoiId					= uint8(zeros(eventNumber, 1));
-                            if simplifyFrameTimeStamps
-                                frameTimeStampStart     = uint64(zeros(eventNumber, 1));
-                                frameTimeStampEnd		= uint64(zeros(eventNumber, 1));
-                            else
-                                frameTimeStampFrameStart	= uint64(zeros(eventNumber, 1));
-                                frameTimeStampFrameEnd		= uint64(zeros(eventNumber, 1));
-                                frameTimeStampExposureStart = uint64(zeros(eventNumber, 1));
-                                frameTimeStampExposureEnd	= uint64(zeros(eventNumber, 1));
-                            end
-                            frameXLength				= uint16(zeros(eventNumber, 1));
-                            frameYLength				= uint16(zeros(eventNumber, 1));
-                            frameXPosition				= uint16(zeros(eventNumber, 1));
-                            frameYPosition				= uint16(zeros(eventNumber, 1));
-                            frameSamples				= cell(eventNumber, 1);
-                        else	
-                            while eventNumber > currentLength - frameNumEvents
-                                frameValid					= [frameValid;                  false(currentLength, 1)];
-                                frameColorChannels			= [frameColorChannels;			uint8(zeros(currentLength, 1))];
-                                frameColorFilter			= [frameColorFilter;			uint8(zeros(currentLength, 1))];
-                                frameRoiId					= [frameRoiId;					uint8(zeros(currentLength, 1))];
-                                if simplifyFrameTimeStamps
-                                    frameTimeStampStart	= [frameTimeStampStart;	uint64(zeros(currentLength, 1))];
-                                    frameTimeStampEnd		= [frameTimeStampEnd;		uint64(zeros(currentLength, 1))];
-                                else
-                                    frameTimeStampFrameStart	= [frameTimeStampFrameStart;	uint64(zeros(currentLength, 1))];
-                                    frameTimeStampFrameEnd		= [frameTimeStampFrameEnd;		uint64(zeros(currentLength, 1))];                                
-                                    frameTimeStampExposureStart = [frameTimeStampExposureStart; uint64(zeros(currentLength, 1))];
-                                    frameTimeStampExposureEnd	= [frameTimeStampExposureEnd;	uint64(zeros(currentLength, 1))];
-                                end
-                                frameXLength				= [frameXLength;				uint16(zeros(currentLength, 1))];
-                                frameYLength				= [frameYLength;				uint16(zeros(currentLength, 1))];
-                                frameXPosition				= [frameXPosition;				uint16(zeros(currentLength, 1))];
-                                frameYPosition				= [frameYPosition;				uint16(zeros(currentLength, 1))];
-                                frameSamples				= [frameSamples;				cell(currentLength, 1)];
-                                currentLength = length(frameValid);
-                                %disp(['Frame array resized to ' num2str(currentLength)])
-                            end
-                        end					
-
-                        % Iterate through the events, converting the data and
-                        % populating the arrays
-                        for dataPointer = 1 : eventSize : numBytesInPacket % This points to the first byte for each event
-                            frameNumEvents = frameNumEvents + 1;
-                            frameValid(frameNumEvents) = mod(packetData(dataPointer), 2) == 1; % Pick off the first bit
-                            frameData = typecast(packetData(dataPointer : dataPointer + 3), 'uint32');
-                            frameColorChannels(frameNumEvents) = uint16(bitshift(bitand(frameData, frameColorChannelsMask), -frameColorChannelsShiftBits));
-                            frameColorFilter(frameNumEvents)	= uint16(bitshift(bitand(frameData, frameColorFilterMask),	-frameColorFilterShiftBits));
-                            frameRoiId(frameNumEvents)		= uint16(bitshift(bitand(frameData, frameRoiIdMask),		-frameRoiIdShiftBits));
-                            if simplifyFrameTimeStamps
-                                frameTimeStampStart(frameNumEvents)		= packetTimeStampOffset + uint64(typecast(packetData(dataPointer + 12 : dataPointer + 15), 'int32'));
-                                frameTimeStampEnd(frameNumEvents)		= packetTimeStampOffset + uint64(typecast(packetData(dataPointer + 16 : dataPointer + 19), 'int32'));
-                            else
-                                frameTimeStampFrameStart(frameNumEvents)		= packetTimeStampOffset + uint64(typecast(packetData(dataPointer + 4 : dataPointer + 7), 'int32'));
-                                frameTimeStampFrameEnd(frameNumEvents)		= packetTimeStampOffset + uint64(typecast(packetData(dataPointer + 8 : dataPointer + 11), 'int32'));
-                                frameTimeStampExposureStart(frameNumEvents)	= packetTimeStampOffset + uint64(typecast(packetData(dataPointer + 12 : dataPointer + 15), 'int32'));
-                                frameTimeStampExposureEnd(frameNumEvents)		= packetTimeStampOffset + uint64(typecast(packetData(dataPointer + 16 : dataPointer + 19), 'int32'));
-                            end
-                            frameXLength(frameNumEvents)		= typecast(packetData(dataPointer + 20 : dataPointer + 21), 'uint16'); % strictly speaking these are 4-byte signed integers, but there's no way they'll be that big in practice
-                            frameYLength(frameNumEvents)		= typecast(packetData(dataPointer + 24 : dataPointer + 25), 'uint16');
-                            frameXPosition(frameNumEvents)	= typecast(packetData(dataPointer + 28 : dataPointer + 29), 'uint16');
-                            frameYPosition(frameNumEvents)	= typecast(packetData(dataPointer + 32 : dataPointer + 33), 'uint16');
-                            numSamples = int32(frameXLength(frameNumEvents)) * int32(frameYLength(frameNumEvents)) * int32(frameColorChannels(frameNumEvents)); % Conversion to int32 allows addition with 'dataPointer' below
-                            % At least one recording has a file ending half way
-                            % through the frame data due to a laptop dying,
-                            % hence the following check
-                            if length(packetData) >= dataPointer + 35 + numSamples * 2
-                                sampleData = cast(typecast(packetData(dataPointer + 36 : dataPointer + 35 + numSamples * 2), 'uint16'), 'uint16');
-                                frameSamples{frameNumEvents}		= reshape(sampleData, frameColorChannels(frameNumEvents), frameXLength(frameNumEvents), frameYLength(frameNumEvents));
-                                if frameColorChannels(frameNumEvents) == 1
-                                    frameSamples{frameNumEvents} = squeeze(frameSamples{frameNumEvents});
-                                    frameSamples{frameNumEvents} = permute(frameSamples{frameNumEvents}, [2 1]);
-                                else
-                                    % Change the dimensions of the frame array to
-                                    % the standard for matlab: column, then row,
-                                    % then channel number
-                                    frameSamples{frameNumEvents} = permute(frameSamples{frameNumEvents}, [3 2 1]);
-                                end
-                            else
-                                frameSamples{frameNumEvents} = zeros(frameYLength(frameNumEvents), frameXLength(frameNumEvents), frameColorChannels(frameNumEvents));
-                            end
-                            % aedat3 uses left-justified 16 bit samples -
-                            % for consistency with aedat2, revert to
-                            % fundamental 10 bit representation
-                            frameSamples{frameNumEvents} = frameSamples{frameNumEvents} / 2^6;
-                        end
-                        
-                    end
-                    '''
+                    if allDataTypes or 'frame' in dataTypes:
+                        # Each frame is a 36 byte header followed by its 
+                        # samples; eventSize allows for the largest frame in
+                        # the packet
+                        frameDataFormat = np.dtype({
+                            'names': ['info', 'timeStamps', 'xLength', 'yLength', 
+                                      'xPosition', 'yPosition', 'samples'],
+                            'formats': ['<u4', ('<i4', (4, )), '<i4', '<i4', 
+                                        '<i4', '<i4', ('<u2', ((eventSize - 36) // 2, ))],
+                            'offsets': [0, 4, 20, 24, 28, 32, 36],
+                            'itemsize': eventSize})
+                        # At least one recording has a file ending half way
+                        # through the frame data due to a laptop dying;
+                        # fromfile only returns the whole frames
+                        allEvents = np.fromfile(fileHandle, frameDataFormat, eventNumber)
+                        allInfo = allEvents['info']
+                        start, end = frameColumns.extend(
+                            len(allEvents), len(frameColumns) + numEventsRemaining)
+                        frameColumns.columns['valid'][start : end] \
+                            = np.bitwise_and(allInfo, 0x1).astype(bool) # Pick off the first bit
+                        colorChannels = np.right_shift(np.bitwise_and(allInfo, frameColorChannelsMask), 
+                                                       frameColorChannelsShiftBits)
+                        frameColumns.columns['colorChannels'][start : end] = colorChannels
+                        frameColumns.columns['colorFilter'][start : end] \
+                            = np.right_shift(np.bitwise_and(allInfo, frameColorFilterMask), 
+                                             frameColorFilterShiftBits)
+                        frameColumns.columns['roiId'][start : end] \
+                            = np.right_shift(np.bitwise_and(allInfo, frameRoiIdMask), 
+                                             frameRoiIdShiftBits)
+                        allTimeStamps = packetTimeStampOffset \
+                                        + allEvents['timeStamps'].astype(np.uint64)
+                        if simplifyFrameTimeStamps:
+                            frameColumns.columns['timeStampStart'][start : end] = allTimeStamps[:, 2]
+                            frameColumns.columns['timeStampEnd'][start : end] = allTimeStamps[:, 3]
+                        else:
+                            frameColumns.columns['timeStampFrameStart'][start : end] = allTimeStamps[:, 0]
+                            frameColumns.columns['timeStampFrameEnd'][start : end] = allTimeStamps[:, 1]
+                            frameColumns.columns['timeStampExposureStart'][start : end] = allTimeStamps[:, 2]
+                            frameColumns.columns['timeStampExposureEnd'][start : end] = allTimeStamps[:, 3]
+                        # strictly speaking these are 4-byte signed integers, but there's no way they'll be that big in practice
+                        xLength = allEvents['xLength']
+                        yLength = allEvents['yLength']
+                        frameColumns.columns['xLength'][start : end] = xLength
+                        frameColumns.columns['yLength'][start : end] = yLength
+                        frameColumns.columns['xPosition'][start : end] = allEvents['xPosition']
+                        frameColumns.columns['yPosition'][start : end] = allEvents['yPosition']
+                        # Frames of the same size are reshaped together, as a
+                        # view onto the packet; the samples are interleaved by
+                        # colour channel, then run along x, then y.
+                        # aedat3 uses left-justified 16 bit samples - for
+                        # consistency with aedat2, revert to fundamental 10
+                        # bit representation
+                        frameSizes = (yLength.astype(np.int64) * 2 ** 16 + xLength) * 2 ** 8 + colorChannels
+                        for frameSize in np.unique(frameSizes):
+                            frameIndices = np.flatnonzero(frameSizes == frameSize)
+                            frameShape = (int(yLength[frameIndices[0]]), 
+                                          int(xLength[frameIndices[0]]), 
+                                          int(colorChannels[frameIndices[0]]))
+                            numSamples = frameShape[0] * frameShape[1] * frameShape[2]
+                            if numSamples == 0 or numSamples > allEvents['samples'].shape[1]:
+                                continue
+                            frameColumns.reserveShape('samples', frameShape)
+                            frameColumns.columns['samples'][start + frameIndices, 
+                                                            0 : frameShape[0], 
+                                                            0 : frameShape[1], 
+                                                            0 : frameShape[2]] \
+                                = np.right_shift(allEvents['samples'][frameIndices, 0 : numSamples], 6) \
+                                    .reshape((len(frameIndices), ) + frameShape)
+                        if end > start:
+                            mainTimeStamp = allTimeStamps[0, 0]
+                        # Frames are timed by their exposure
+                        AccumulateEventStatistics(statistics, 'frame',
+                            allTimeStamps[:, 2], allTimeStamps[:, 3],
+                            binWidth=rateBinWidth)
                 # Imu6    
                 elif eventType == 3:
-                    '''
-                    if allDataTypes || any(cellfun(cellFind('imu6'), dataTypes))
-                        % First check if the array is big enough
-                        currentLength = length(imu6Valid);
-                        if currentLength == 0 
-                            imu6Valid			= np.zeros(eventNumber, dtype=bool)
-                            imu6TimeStamp		= uint64(zeros(eventNumber, 1));
-                            imu6AccelX			= single(zeros(eventNumber, 1));
-                            imu6AccelY			= single(zeros(eventNumber, 1));
-                            imu6AccelZ			= single(zeros(eventNumber, 1));
-                            imu6GyroX			= single(zeros(eventNumber, 1));
-                            imu6GyroY			= single(zeros(eventNumber, 1));
-                            imu6GyroZ			= single(zeros(eventNumber, 1));
-                            imu6Temperature     = single(zeros(eventNumber, 1));
-                        else	
-                            while eventNumber > currentLength - imu6NumEvents
-                                imu6Valid			= [imu6Valid;        false(currentLength, 1)];
-                                imu6TimeStamp		= [imu6TimeStamp;    uint64(zeros(currentLength, 1))];
-                                imu6AccelX			= [imu6AccelX;       single(zeros(currentLength, 1))];
-                                imu6AccelY			= [imu6AccelY;       single(zeros(currentLength, 1))];
-                                imu6AccelZ			= [imu6AccelZ;       single(zeros(currentLength, 1))];
-                                imu6GyroX			= [imu6GyroX;        single(zeros(currentLength, 1))];
-                                imu6GyroY			= [imu6GyroY;        single(zeros(currentLength, 1))];
-                                imu6GyroZ			= [imu6GyroZ;        single(zeros(currentLength, 1))];
-                                imu6Temperature     = [imu6Temperature;  single(zeros(currentLength, 1))];                            
-                                currentLength = length(imu6Valid);
-                            end
-                        end
-                        % Matricise computation on a packet
-                        dataMatrix = reshape(packetData, [eventSize, eventNumber]);
-                        dataTempTimeStamp = dataMatrix(5:8, :);
-                        imu6TimeStamp(imu6NumEvents + (1 : eventNumber)) = packetTimeStampOffset + uint64(typecast(dataTempTimeStamp(:), 'int32'));
-                        % The following is overkill - only need to pick out 1
-                        % byte to get to the valid flag
-                        dataTempAddress = dataMatrix(1:4, :);
-                        dataTempAddress = typecast(dataTempAddress(:), 'uint32');
-                        imu6Valid(imu6NumEvents + (1 : eventNumber)) = mod(dataTempAddress, 2) == 1; % Pick off the first bit
-                        tempDataMatrix = dataMatrix(9:12, :);
-                        imu6AccelX      (imu6NumEvents + (1 : eventNumber)) = typecast(tempDataMatrix(:), 'single');
-                        tempDataMatrix = dataMatrix(13:16, :);
-                        imu6AccelY      (imu6NumEvents + (1 : eventNumber)) = typecast(tempDataMatrix(:), 'single');
-                        tempDataMatrix = dataMatrix(17:20, :);
-                        imu6AccelZ      (imu6NumEvents + (1 : eventNumber)) = typecast(tempDataMatrix(:), 'single');
-                        tempDataMatrix = dataMatrix(21:24, :);
-                        imu6GyroX       (imu6NumEvents + (1 : eventNumber)) = typecast(tempDataMatrix(:), 'single');
-                        tempDataMatrix = dataMatrix(25:28, :);
-                        imu6GyroY       (imu6NumEvents + (1 : eventNumber)) = typecast(tempDataMatrix(:), 'single');
-                        tempDataMatrix = dataMatrix(29:32, :);
-                        imu6GyroZ       (imu6NumEvents + (1 : eventNumber)) = typecast(tempDataMatrix(:), 'single');
-                        tempDataMatrix = dataMatrix(33:36, :);
-                        imu6Temperature (imu6NumEvents + (1 : eventNumber)) = typecast(tempDataMatrix(:), 'single');
-                        imu6NumEvents = imu6NumEvents + eventNumber;
-                    end
-                    '''
+                    if allDataTypes or 'imu6' in dataTypes:
+                        allEvents = np.fromfile(fileHandle, imu6DataFormat, eventNumber)
+                        start, end = imu6Columns.extend(
+                            len(allEvents), len(imu6Columns) + numEventsRemaining)
+                        imu6Columns.columns['valid'][start : end] \
+                            = np.bitwise_and(allEvents['info'], 0x1).astype(bool) # Pick off the first bit
+                        imu6Columns.columns['timeStamp'][start : end] \
+                            = packetTimeStampOffset + allEvents['timeStamp'].astype(np.uint64)
+                        for field in ('accelX', 'accelY', 'accelZ', 
+                                      'gyroX', 'gyroY', 'gyroZ', 'temperature'):
+                            imu6Columns.columns[field][start : end] = allEvents[field]
+                        if end > start:
+                            mainTimeStamp = imu6Columns.columns['timeStamp'][start]
+                        AccumulateEventStatistics(statistics, 'imu6',
+                            imu6Columns.columns['timeStamp'][start : end],
+                            binWidth=rateBinWidth)
                 # Sample
                 elif eventType == 5:
                     '''
@@ -490,113 +676,76 @@ def ImportAedatDataVersion3(aedat):
                 # Point1D
                 elif eventType == 8: 
 
-                    if allDataTypes or 'point1D' in info['dataTypes']:
-                        # First check if the array is big enough
-                        currentLength = len(point1DValid)
-                        if currentLength == 0:
-                            point1DValid     = np.zeros(eventNumber, 'bool')
-                            point1DTimeStamp = np.zeros(eventNumber, 'uint64')
-                            point1DType      = np.zeros(eventNumber, 'uint8')
-                            point1DX         = np.zeros(eventNumber, 'float32')
-                        else:	
-                            while eventNumber > currentLength - point1DNumEvents:
-                                point1DValid		= np.append(point1DValid,		np.zeros(currentLength, 'bool'  ))
-                                point1DTimeStamp	= np.append(point1DTimeStamp,	np.zeros(currentLength, 'uint64'))
-                                point1DType	    = np.append(point1DType,	    np.zeros(currentLength, 'uint8'))
-                                point1DX		= np.append(point1DX,		np.zeros(currentLength, 'float32'))
-                                currentLength = len(point1DValid)
+                    if allDataTypes or 'point1D' in dataTypes:
                         allEvents = np.fromfile(fileHandle, point1DDataFormat, eventNumber)
-                        allInfo = np.array(allEvents['info'])
-                        point1DValid[point1DNumEvents : point1DNumEvents + eventNumber] \
-                            = bool(allInfo and 0x1) # Pick off the first bit
-                        point1DType[point1DNumEvents : point1DNumEvents + eventNumber] \
-                            = (allInfo and 0xFE) >> 1 # Next 7 bits are the point1D event type
+                        allInfo = allEvents['info']
+                        start, end = point1DColumns.extend(
+                            len(allEvents), len(point1DColumns) + numEventsRemaining)
+                        point1DColumns.columns['valid'][start : end] \
+                            = np.bitwise_and(allInfo, 0x1).astype(bool) # Pick off the first bit
+                        point1DColumns.columns['type'][start : end] \
+                            = np.right_shift(np.bitwise_and(allInfo, 0xFE), 1) # Next 7 bits are the point1D event type
                         # point1D scale would go here - next 8 bits - no need at the present    
-                        point1DX[point1DNumEvents : point1DNumEvents + eventNumber] \
-                            = np.array(allEvents['x'])
-                        point1DTimeStamp[point1DNumEvents : point1DNumEvents + eventNumber] \
-                            = packetTimeStampOffset + np.uint64(np.array(allEvents['timeStamp']))
-                        mainTimeStamp = point1DTimeStamp(point1DNumEvents)
-                        point1DNumEvents = point1DNumEvents + eventNumber
+                        point1DColumns.columns['x'][start : end] = allEvents['x']
+                        point1DColumns.columns['timeStamp'][start : end] \
+                            = packetTimeStampOffset + allEvents['timeStamp'].astype(np.uint64)
+                        if end > start:
+                            mainTimeStamp = point1DColumns.columns['timeStamp'][start]
+                        AccumulateEventStatistics(statistics, 'point1D',
+                            point1DColumns.columns['timeStamp'][start : end],
+                            binWidth=rateBinWidth)
 
                 # Point2D
                 elif eventType == 9:
 
-                    if allDataTypes or 'point2D' in info['dataTypes']:
-                        # First check if the array is big enough
-                        currentLength = len(point2DValid)
-                        if currentLength == 0:
-                            point2DValid     = np.zeros(eventNumber, 'bool')
-                            point2DTimeStamp = np.zeros(eventNumber, 'uint64')
-                            point2DType      = np.zeros(eventNumber, 'uint8')
-                            point2DX         = np.zeros(eventNumber, 'float32')
-                            point2DY         = np.zeros(eventNumber, 'float32')
-                        else:
-                            while eventNumber > currentLength - point1DNumEvents:
-                                point2DValid     = np.append(point2DValid,     np.zeros(currentLength, 'bool'  ))
-                                point2DTimeStamp = np.append(point2DTimeStamp, np.zeros(currentLength, 'uint64'))
-                                point2DType      = np.append(point2DType,	      np.zeros(currentLength, 'uint8'))
-                                point2DX         = np.append(point2DX,    np.zeros(currentLength, 'float32'))
-                                point2DY         = np.append(point2DY,    np.zeros(currentLength, 'float32'))
-                                currentLength = len(point1DValid)
+                    if allDataTypes or 'point2D' in dataTypes:
                         allEvents = np.fromfile(fileHandle, point2DDataFormat, eventNumber)
-                        allInfo = np.array(allEvents['info'])
-                        point2DValid[point2DNumEvents : point2DNumEvents + eventNumber] \
-                            = np.logical_and(allInfo, 0x1) # Pick off the first bit
-                        point2DType[point2DNumEvents : point2DNumEvents + eventNumber] \
-                            = (allInfo & 0xFE) >> 1 # Next 7 bits are the point1D event type
-                        # point1D scale would go here - next 8 bits - no need at the present    
-                        point2DX[point2DNumEvents : point2DNumEvents + eventNumber] \
-                            = np.array(allEvents['x'])
-                        point2DY[point2DNumEvents : point2DNumEvents + eventNumber] \
-                            = np.array(allEvents['y'])
-                        point2DTimeStamp[point2DNumEvents : point2DNumEvents + eventNumber] \
-                            = packetTimeStampOffset + np.uint64(np.array(allEvents['timeStamp']))
-                        mainTimeStamp = point2DTimeStamp[point2DNumEvents]
-                        point2DNumEvents = point2DNumEvents + eventNumber
+                        allInfo = allEvents['info']
+                        start, end = point2DColumns.extend(
+                            len(allEvents), len(point2DColumns) + numEventsRemaining)
+                        point2DColumns.columns['valid'][start : end] \
+                            = np.bitwise_and(allInfo, 0x1).astype(bool) # Pick off the first bit
+                        point2DColumns.columns['type'][start : end] \
+                            = np.right_shift(np.bitwise_and(allInfo, 0xFE), 1) # Next 7 bits are the point2D event type
+                        # point2D scale would go here - next 8 bits - no need at the present    
+                        point2DColumns.columns['x'][start : end] = allEvents['x']
+                        point2DColumns.columns['y'][start : end] = allEvents['y']
+                        point2DColumns.columns['timeStamp'][start : end] \
+                            = packetTimeStampOffset + allEvents['timeStamp'].astype(np.uint64)
+                        if end > start:
+                            mainTimeStamp = point2DColumns.columns['timeStamp'][start]
+                        AccumulateEventStatistics(statistics, 'point2D',
+                            point2DColumns.columns['timeStamp'][start : end],
+                            binWidth=rateBinWidth)
                         
                 # Point3D
                 elif eventType == 10:
 
-                    if allDataTypes or 'point3D' in info['dataTypes']:
-                        # First check if the array is big enough
-                        currentLength = len(point3DValid)
-                        if currentLength == 0:
-                            point3DValid     = np.zeros(eventNumber, 'bool')
-                            point3DTimeStamp = np.zeros(eventNumber, 'uint64')
-                            point3DType      = np.zeros(eventNumber, 'uint8')
-                            point3DX         = np.zeros(eventNumber, 'float32')
-                            point3DY         = np.zeros(eventNumber, 'float32')
-                            point3DZ         = np.zeros(eventNumber, 'float32')
-                        else:
-                            while eventNumber > currentLength - point1DNumEvents:
-                                point3DValid     = np.append(point3DValid,     np.zeros(currentLength, 'bool'  ))
-                                point3DTimeStamp = np.append(point3DTimeStamp, np.zeros(currentLength, 'uint64'))
-                                point3DType      = np.append(point3DType,	      np.zeros(currentLength, 'uint8'))
-                                point3DX         = np.append(point3DX,         np.zeros(currentLength, 'float32'))
-                                point3DY         = np.append(point3DY,         np.zeros(currentLength, 'float32'))
-                                point3DZ         = np.append(point3DZ,         np.zeros(currentLength, 'float32'))
-                                currentLength = len(point1DValid)
+                    if allDataTypes or 'point3D' in dataTypes:
                         allEvents = np.fromfile(fileHandle, point3DDataFormat, eventNumber)
-                        allInfo = np.array(allEvents['info'])
-                        point3DValid[point3DNumEvents : point3DNumEvents + eventNumber] \
-                            = np.logical_and(allInfo, 0x1) # Pick off the first bit
-                        point3DType[point3DNumEvents : point3DNumEvents + eventNumber] \
-                            = (allInfo & 0xFE) >> 1 # Next 7 bits are the point1D event type
-                        # point1D scale would go here - next 8 bits - no need at the present    
-                        point3DX[point3DNumEvents : point3DNumEvents + eventNumber] \
-                            = np.array(allEvents['x'])
-                        point3DY[point3DNumEvents : point3DNumEvents + eventNumber] \
-                            = np.array(allEvents['y'])
-                        point3DZ[point3DNumEvents : point3DNumEvents + eventNumber] \
-                            = np.array(allEvents['z'])                            
-                        point3DTimeStamp[point3DNumEvents : point3DNumEvents + eventNumber] \
-                            = packetTimeStampOffset + np.uint64(np.array(allEvents['timeStamp']))
-                        mainTimeStamp = point3DTimeStamp[point3DNumEvents]
-                        point3DNumEvents = point3DNumEvents + eventNumber
+                        allInfo = allEvents['info']
+                        start, end = point3DColumns.extend(
+                            len(allEvents), len(point3DColumns) + numEventsRemaining)
+                        point3DColumns.columns['valid'][start : end] \
+                            = np.bitwise_and(allInfo, 0x1).astype(bool) # Pick off the first bit
+                        point3DColumns.columns['type'][start : end] \
+                            = np.right_shift(np.bitwise_and(allInfo, 0xFE), 1) # Next 7 bits are the point3D event type
+                        # point3D scale would go here - next 8 bits - no need at the present    
+                        point3DColumns.columns['x'][start : end] = allEvents['x']
+                        point3DColumns.columns['y'][start : end] = allEvents['y']
+                        point3DColumns.columns['z'][start : end] = allEvents['z']
+                        point3DColumns.columns['timeStamp'][start : end] \
+                            = packetTimeStampOffset + allEvents['timeStamp'].astype(np.uint64)
+                        if end > start:
+                            mainTimeStamp = point3DColumns.columns['timeStamp'][start]
+                        AccumulateEventStatistics(statistics, 'point3D',
+                            point3DColumns.columns['timeStamp'][start : end],
+                            binWidth=rateBinWidth)
 
                 else:
                     raise Exception('Unknown event type')
+
+                fileHandle.seek(nextPacketPointer)
             
             if mainTimeStamp > endTime * 1e6 \
                     and mainTimeStamp != 0x7FFFFFFF: # This may be a timestamp reset - don't let it stop the import
@@ -609,64 +758,22 @@ def ImportAedatDataVersion3(aedat):
 
     if not noData:
 
+        info['eventStatistics'] = statistics
         outputData = {}
     
-        if specialNumEvents > 0:
-            special = {}
-            special['valid']      = specialValid[0 : specialNumEvents] 
-            special['timeStamp']  = specialTimeStamp[0 : specialNumEvents]
-            special['address']    = specialAddress[0 : specialNumEvents]
-            outputData['special'] = special
+        if len(specialColumns) > 0:
+            outputData['special'] = specialColumns.trim()
     
-        if polarityNumEvents > 0:
-            polarity = {}
-            polarity['valid']       = polarityValid[0 : polarityNumEvents]
-            polarity['timeStamp']   = polarityTimeStamp[0 : polarityNumEvents]
-            polarity['y']           = polarityY[0 : polarityNumEvents]
-            polarity['x']           = polarityX[0 : polarityNumEvents]
-            polarity['polarity']    = polarityPolarity[0 : polarityNumEvents]
-            outputData['polarity']  = polarity
+        if len(polarityColumns) > 0:
+            outputData['polarity'] = polarityColumns.trim()
     
-        '''
-        if frameNumEvents > 0
-            keepLogical = false(size(frameValid, 1), 1);
-            keepLogical(1:frameNumEvents) = true; 
-            frame.valid = frameValid(keepLogical);
-            frame.roiId					= frameRoiId(keepLogical);
-            frame.colorChannels			= frameColorChannels(keepLogical);
-            frame.colorFilter			= frameColorFilter(keepLogical);
-            if simplifyFrameTimeStamps
-                frame.timeStampStart	= frameTimeStampStart(keepLogical);
-                frame.timeStampEnd		= frameTimeStampEnd(keepLogical);
-            else
-                frame.timeStampFrameStart	= frameTimeStampFrameStart(keepLogical);
-                frame.timeStampFrameEnd		= frameTimeStampFrameEnd(keepLogical);
-                frame.timeStampExposureStart = frameTimeStampExposureStart(keepLogical);
-                frame.timeStampExposureEnd	= frameTimeStampExposureEnd(keepLogical);
-            end
-            frame.samples				= frameSamples(keepLogical);
-            frame.xLength				= frameXLength(keepLogical);
-            frame.yLength				= frameYLength(keepLogical);
-            frame.xPosition				= frameXPosition(keepLogical);
-            frame.yPosition				= frameYPosition(keepLogical);
-            outputData.frame = frame;
-        end
+        if len(frameColumns) > 0:
+            outputData['frame'] = frameColumns.trim()
     
-        if imu6NumEvents > 0
-            keepLogical = false(size(imu6Valid, 1), 1);
-            keepLogical(1:imu6NumEvents) = true; 
-            imu6.valid = imu6Valid(keepLogical); 
-            imu6.timeStamp	= imu6TimeStamp(keepLogical);
-            imu6.gyroX		= imu6GyroX(keepLogical);
-            imu6.gyroY		= imu6GyroY(keepLogical);
-            imu6.gyroZ		= imu6GyroZ(keepLogical); 
-            imu6.accelX		= imu6AccelX(keepLogical);
-            imu6.accelY		= imu6AccelY(keepLogical);
-            imu6.accelZ		= imu6AccelZ(keepLogical);
-            imu6.temperature = imu6Temperature(keepLogical);
-            outputData.imu6 = imu6;
-        end
+        if len(imu6Columns) > 0:
+            outputData['imu6'] = imu6Columns.trim()
     
+        '''
         if sampleNumEvents > 0
             keepLogical = false(size(sampleValid, 1), 1);
             keepLogical(1:sampleNumEvents) = true; 
@@ -689,37 +796,28 @@ def ImportAedatDataVersion3(aedat):
             outputData.ear = ear;
         end
         '''
-        if point1DNumEvents > 0:
-            point1D = {}
-            point1D['valid'] = point1DValid[0 : point1DNumEvents] 
-            point1D['timeStamp'] = point1DTimeStamp[0 : point1DNumEvents]
-            point1D['type'] = point1DType[0 : point1DNumEvents]
-            point1D['x'] = point1DX[0 : point1DNumEvents]
-            outputData['point1D'] = point1D
+        if len(point1DColumns) > 0:
+            outputData['point1D'] = point1DColumns.trim()
     
-        if point2DNumEvents > 0:
-            point2D = {}
-            point2D['valid'] = point2DValid[0 : point2DNumEvents]
-            point2D['timeStamp'] = point2DTimeStamp[0 : point2DNumEvents]
-            point2D['type'] = point2DType[0 : point2DNumEvents]
-            point2D['x'] = point2DX[0 : point2DNumEvents]
-            point2D['y'] = point2DY[0 : point2DNumEvents]
-            outputData['point2D'] = point2D
+        if len(point2DColumns) > 0:
+            outputData['point2D'] = point2DColumns.trim()
             
-        if point3DNumEvents > 0:
-            point3D = {}
-            point3D['valid'] = point3DValid[0 : point3DNumEvents]
-            point3D['timeStamp'] = point3DTimeStamp[0 : point3DNumEvents]
-            point3D['type'] = point3DType[0 : point3DNumEvents]
-            point3D['x'] = point3DX[0 : point3DNumEvents]
-            point3D['y'] = point3DY[0 : point3DNumEvents]
-            point3D['z'] = point3DZ[0 : point3DNumEvents]
-            outputData['point3D'] = point3D
-
-    # Pack packet info 
-    info['packetTypes']     = packetTypes[0 : packetCount]
-    info['packetPointers']  = packetPointers[0 : packetCount]
-    info['packetTimeStamps'] = packetTimeStamps[0 : packetCount]
+        if len(point3DColumns) > 0:
+            outputData['point3D'] = point3DColumns.trim()
+
+        if 'startTime' in importParams or 'endTime' in importParams:
+            CropToTimeWindow(outputData, statistics, startTime * 1e6, endTime * 1e6,
+                             rateBinWidth)
+
+    # Pack packet info - unless the file had already been indexed, in which
+    # case a read of a range of packets mustn't cut the index short
+    if 'packetPointers' not in info or extendIndex:
+        info['packetTypes']     = packetTypes[0 : packetCount]
+        info['packetPointers']  = packetPointers[0 : packetCount]
+        info['packetTimeStamps'] = packetTimeStamps[0 : packetCount]
+        info['packetEventNumbers'] = packetEventNumbers[0 : packetCount]
+        info['packetResetOffsets'] = packetResetOffsets[0 : packetCount]
+        info['packetIndexComplete'] = reachedEndOfFile
     
     # Calculate data volume by type
     
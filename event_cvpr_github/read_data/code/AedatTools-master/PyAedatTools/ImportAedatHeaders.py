@@ -16,6 +16,7 @@ Code contributions from Bodo Rueckhauser
 """
 
 from PyAedatTools.BasicSourceName import BasicSourceName 
+from PyAedatTools.DeviceAddressSpace import DeviceAddressSpace
 
 def ImportAedatHeaders(aedat):
 
@@ -55,12 +56,12 @@ def ImportAedatHeaders(aedat):
             # final dot
             start_prefix = line.rfind('.')
             if start_prefix == -1:
-                start_prefix = 9    
+                start_prefix = 8
             sourceFromFile = BasicSourceName(line[start_prefix+1:-2]) # Cut off '\r'
         # Version 3.0 encodes it like this
         # The following ignores any trace of previous sources
         # (prefixed with a minus sign)
-        if line[: 8] == ' Source ':
+        if line[: 7] == 'Source ':
             start_prefix = line.find(':')  # There should be only one colon
             try:
                 sourceFromFile
@@ -74,7 +75,7 @@ def ImportAedatHeaders(aedat):
                 # info.sourceFromFile = [info.sourceFromFile line[start_prefix
                 #  + 2 : ];
             except NameError:
-                sourceFromFile = line[start_prefix + 2:]
+                sourceFromFile = BasicSourceName(line[start_prefix + 2:].strip())
 
         # Pick out date and time of recording
 
@@ -149,11 +150,10 @@ def ImportAedatHeaders(aedat):
             # If no source was detected, assume it was from a DVS128	
             info['source'] = 'Dvs128'
         
-    """
-    % Get the address space (dimensions) of the device
-    % For vision sensors, this is a tuple [X Y]
-    info.deviceAddressSpace = DeviceAddressSpace(info.source);
-    """    
+    # Get the address space (dimensions) of the device
+    # For vision sensors, this is a tuple [X Y]
+    info['deviceAddressSpace'] = DeviceAddressSpace(info['source'])
+
     aedat['info'] = info
 
     return aedat
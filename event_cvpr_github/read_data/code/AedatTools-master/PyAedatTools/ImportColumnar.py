@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+ImportColumnar
+
+Imports data exported by ExportColumnar, giving the same aedat dict as
+ImportAedat does. Tables of .npz files need only numpy; Parquet tables need
+pyarrow.
+
+startTime and endTime are pushed down to the tables: the row groups whose
+timestamp min/max lie wholly outside the window aren't read, and the rows
+read are then trimmed to the window. For each data type, the numbers of row
+groups read and skipped are left in info['rowGroupsRead'] and
+info['rowGroupsSkipped'].
+
+Only the tables listed in the manifest of the last export are read.
+
+Parameters, in aedat['importParams']:
+    filePath - the directory written by ExportColumnar
+    startTime, endTime - in seconds, as for ImportAedat
+    dataTypes - the data types to import; by default, all of them
+"""
+
+import os
+import numpy as np
+from PyAedatTools.EventStream import EventStream
+from PyAedatTools.EventStream import FrameStream
+from PyAedatTools.ColumnChunks import PadFrames
+from PyAedatTools.ColumnChunks import LoadChunks
+from PyAedatTools.ColumnChunks import OverlappingChunks
+from PyAedatTools.ExportColumnar import pq
+from PyAedatTools.ExportColumnar import samplesShapeColumns
+from PyAedatTools.ExportColumnar import ManifestFilePath
+from PyAedatTools.ExportColumnar import TablePath
+from PyAedatTools.ExportColumnar import RowGroupFilePath
+from PyAedatTools.NumEventsByType import NumEventsByType
+from PyAedatTools.FindFirstAndLastTimeStamps import FindFirstAndLastTimeStamps
+
+def ColumnArray(column):
+    """
+    A column of a pyarrow Table as a numpy array.
+    """
+
+    chunks = [chunk.to_numpy(zero_copy_only=False) for chunk in column.chunks]
+    if len(chunks) == 1:
+        return chunks[0]
+    return np.concatenate(chunks)
+
+def ReadNpzTable(tablePath, timeStampColumn, startTimeStamp, endTimeStamp):
+    """
+    Returns (columns, numRowGroups, rowGroups read) for a table of .npz
+    files.
+    """
+
+    with np.load(os.path.join(tablePath, 'index.npz')) as indexFile:
+        rowGroupMask = OverlappingChunks(indexFile['minimum_' + timeStampColumn],
+                                         indexFile['maximum_' + timeStampColumn],
+                                         startTimeStamp, endTimeStamp)
+    rowGroups = np.flatnonzero(rowGroupMask)
+    if len(rowGroups) == 0:
+        return {}, len(rowGroupMask), rowGroups
+    columns = LoadChunks([RowGroupFilePath(tablePath, rowGroup) for rowGroup in rowGroups])
+    return columns, len(rowGroupMask), rowGroups
+
+def ReadParquetTable(tablePath, timeStampColumn, startTimeStamp, endTimeStamp):
+    """
+    Returns (columns, numRowGroups, rowGroups read) for a Parquet table.
+    """
+
+    if pq is None:
+        raise Exception('pyarrow is needed to read %s' % tablePath)
+    parquetFile = pq.ParquetFile(tablePath)
+    metadata = parquetFile.metadata
+    columnIndex = parquetFile.schema.names.index(timeStampColumn)
+    minimums = []
+    maximums = []
+    for rowGroup in range(metadata.num_row_groups):
+        statistics = metadata.row_group(rowGroup).column(columnIndex).statistics
+        hasMinMax = statistics is not None and statistics.has_min_max
+        # A row group without statistics is always read
+        minimums.append(statistics.min if hasMinMax else -np.inf)
+        maximums.append(statistics.max if hasMinMax else np.inf)
+    rowGroups = np.flatnonzero(OverlappingChunks(minimums, maximums, startTimeStamp, endTimeStamp))
+    columns = {}
+    if len(rowGroups) > 0:
+        table = parquetFile.read_row_groups([int(rowGroup) for rowGroup in rowGroups])
+        for name in table.schema.names:
+            if name == 'samples':
+                columns[name] = table.column(name).to_pylist()
+            else:
+                columns[name] = ColumnArray(table.column(name))
+        if 'samples' in columns:
+            shapes = np.stack([columns.pop(shapeColumn) for shapeColumn in samplesShapeColumns], 1)
+            columns['samples'] = PadFrames(
+                [np.frombuffer(frameSamples, np.uint16).reshape(
+                    (1, ) + tuple(int(length) for length in shape if length > 0))
+                 for frameSamples, shape in zip(columns['samples'], shapes)])
+    return columns, metadata.num_row_groups, rowGroups
+
+def ImportColumnar(aedat):
+
+    importParams = aedat['importParams']
+    directory = importParams['filePath']
+    if not os.path.isfile(ManifestFilePath(directory)):
+        raise Exception('%s is not a finished export of ExportColumnar' % directory)
+
+    startTime = importParams.get('startTime', 0)
+    endTime = importParams.get('endTime', np.inf)
+    if startTime > endTime:
+        raise Exception('The startTime parameter is %d, but the endTime parameter is %d' % (startTime, endTime))
+    # Timestamps are compared with the window only where it is given
+    startTimeStamp = startTime * 1e6 if 'startTime' in importParams else None
+    endTimeStamp = endTime * 1e6 if 'endTime' in importParams else None
+
+    with np.load(ManifestFilePath(directory)) as manifestFile:
+        tables = zip([str(dataType) for dataType in manifestFile['dataTypes']],
+                     [str(tableFormat) for tableFormat in manifestFile['formats']],
+                     [str(column) for column in manifestFile['timeStampColumns']])
+        source = str(manifestFile['source'])
+
+    info = aedat.get('info', {})
+    if source:
+        info.setdefault('source', source)
+    info['rowGroupsRead'] = {}
+    info['rowGroupsSkipped'] = {}
+    data = {}
+    for dataType, tableFormat, timeStampColumn in tables:
+        if 'dataTypes' in importParams and dataType not in importParams['dataTypes']:
+            continue
+        tablePath = TablePath(directory, dataType, tableFormat)
+        if tableFormat == 'parquet':
+            readTable = ReadParquetTable
+        else:
+            readTable = ReadNpzTable
+        columns, numRowGroups, rowGroups = readTable(
+            tablePath, timeStampColumn, startTimeStamp, endTimeStamp)
+        info['rowGroupsRead'][dataType] = len(rowGroups)
+        info['rowGroupsSkipped'][dataType] = numRowGroups - len(rowGroups)
+        if len(rowGroups) == 0:
+            continue
+        if dataType == 'frame':
+            stream = FrameStream(dataType, columns)
+        else:
+            stream = EventStream(dataType, columns)
+        # The row groups read may reach beyond the window
+        data[dataType] = stream.timeWindow(startTimeStamp, endTimeStamp).toDict()
+
+    aedat['info'] = info
+    aedat['data'] = data
+    aedat = NumEventsByType(aedat)
+    aedat = FindFirstAndLastTimeStamps(aedat)
+    return aedat
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+This is a sub-function of importAedat.
+It maps the data region of an aedat version 1 or 2 file - everything after
+info['beginningOfDataPointer'] - into memory as a read-only structured array
+of big-endian address / timestamp pairs.
+
+Nothing is read from disk until a slice of the result is touched, and the
+fields of the result (e.g. events['ts']) are views, not copies, so opening a
+multi-hour recording costs nothing up front.
+"""
+
+import numpy as np
+
+def EventFormatVersion1or2(fileFormat):
+    """
+    Returns the number of bytes per event and the (big-endian) structured
+    dtype of one event, for aedat file format 1 or 2.
+    """
+
+    # The formatVersion dictates whether there are 6 or 8 bytes per event.
+    if fileFormat == 1:
+        return 6, np.dtype([('addr', '>u2'), ('ts', '>u4')])
+    else:
+        return 8, np.dtype([('addr', '>u4'), ('ts', '>u4')])
+
+def MemmapAedatDataVersion1or2(aedat, startEvent=0, numEvents=None):
+    """
+    Parameters
+    ----------
+    aedat :
+        dict with 'info' (as produced by ImportAedatHeaders) and
+        'importParams' holding an open 'fileHandle'.
+    startEvent :
+        index of the first event to map.
+    numEvents :
+        number of events to map; by default everything up to the end of the
+        file.
+
+    Returns
+    -------
+    :
+        A read-only np.memmap of the structured event dtype; an empty
+        in-memory array if there is nothing to map.
+    """
+
+    info = aedat['info']
+    fileHandle = aedat['importParams']['fileHandle']
+    numBytesPerEvent, addrPrecision = EventFormatVersion1or2(info['fileFormat'])
+
+    fileHandle.seek(0, 2)
+    numEventsInFile = (fileHandle.tell() - info['beginningOfDataPointer']) \
+        // numBytesPerEvent
+    startEvent = int(startEvent)
+    if numEvents is None:
+        numEvents = numEventsInFile - startEvent
+    numEvents = int(min(numEvents, numEventsInFile - startEvent))
+
+    # np.memmap refuses to map an empty region
+    if numEvents <= 0:
+        return np.zeros(0, addrPrecision)
+
+    # The mmap holds its own reference to the file, so the view stays valid
+    # after ImportAedat has closed fileHandle
+    return np.memmap(fileHandle, dtype=addrPrecision, mode='r',
+                     offset=info['beginningOfDataPointer']
+                         + numBytesPerEvent * startEvent,
+                     shape=(numEvents,))
+
+def SeekTimeStampVersion1or2(allTs, timeStamp, side='left'):
+    """
+    Bisects on the timestamps of a mapped event array (e.g. the 'ts' field of
+    the result of MemmapAedatDataVersion1or2) for timeStamp, returning the
+    index of the first event with a timestamp >= timeStamp (side='left') or
+    > timeStamp (side='right'), as np.searchsorted would.
+    Only about log2(len(allTs)) timestamps are touched, so this costs a few
+    page reads however long the recording is.
+    This assumes that the timestamps are monotonic.
+    """
+
+    low = 0
+    high = len(allTs)
+    while low < high:
+        middle = (low + high) // 2
+        middleTimeStamp = allTs[middle]
+        if middleTimeStamp < timeStamp \
+                or (side == 'right' and middleTimeStamp == timeStamp):
+            low = middle + 1
+        else:
+            high = middle
+    return low
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+Persistent packet index for aedat3.x files.
+
+ImportAedatDataVersion3 builds an index of the packets in a file
+(info['packetTypes'], info['packetPointers'], info['packetTimeStamps'],
+info['packetEventNumbers'] and info['packetResetOffsets']); given this
+index, reads by startPacket or startTime can seek straight to the right
+packet.
+These functions keep the index in a small sidecar file next to the .aedat
+file (the file path with '.index.npz' appended), keyed by the size and
+modification time of the .aedat file, so that it is only built once.
+
+If the .aedat file has grown since the sidecar was written (e.g. it was
+indexed while still being recorded), the index is loaded as a partial index
+and IndexAedatDataVersion3 extends it from its last packet, rather than
+scanning the whole file again.
+
+ImportAedat and ImportAedatChunks use these functions unless
+importParams['packetIndexFile'] is False.
+"""
+
+import os
+import time
+import numpy as np
+from PyAedatTools.ImportAedatDataVersion3 import ImportAedatDataVersion3
+
+packetIndexFields = ('packetTypes', 'packetPointers', 'packetTimeStamps',
+                     'packetEventNumbers', 'packetResetOffsets')
+
+def PacketIndexFilePath(filePath):
+    return filePath + '.index.npz'
+
+def LoadPacketIndex(aedat):
+    """
+    Puts the packet index from the sidecar file into aedat['info'], if there
+    is a sidecar file and it is valid for the .aedat file.
+    If the .aedat file has grown since the index was built, the index is
+    marked as incomplete (info['packetIndexComplete'] = False).
+    """
+
+    info = aedat['info']
+    filePath = aedat['importParams']['filePath']
+    indexFilePath = PacketIndexFilePath(filePath)
+    if not os.path.isfile(indexFilePath):
+        return aedat
+
+    fileStat = os.stat(filePath)
+    try:
+        with open(indexFilePath, 'rb') as indexFile:
+            index = dict(np.load(indexFile))
+    except (IOError, ValueError):
+        print 'The packet index file %s could not be read; ignoring it' % indexFilePath
+        return aedat
+
+    # A sidecar written before a field was added to the index is rebuilt
+    if any(field not in index for field in packetIndexFields):
+        return aedat
+    if int(index['beginningOfDataPointer']) != info['beginningOfDataPointer']:
+        return aedat
+    if int(index['fileSize']) == fileStat.st_size \
+            and float(index['fileMTime']) == fileStat.st_mtime:
+        complete = bool(index['packetIndexComplete'])
+    elif int(index['fileSize']) < fileStat.st_size:
+        # The file has grown; the packets indexed so far can be kept
+        complete = False
+    else:
+        # The file has been rewritten or truncated
+        return aedat
+
+    for field in packetIndexFields:
+        info[field] = index[field]
+    info['packetIndexComplete'] = complete
+    if complete:
+        info['numPackets'] = len(info['packetPointers'])
+    return aedat
+
+def SavePacketIndex(aedat):
+    """
+    Writes the packet index in aedat['info'] to the sidecar file.
+    The sidecar is written to a temporary file and moved into place, so a
+    reader never sees half of it. If the directory isn't writable, the index
+    just isn't saved.
+    """
+
+    info = aedat['info']
+    filePath = aedat['importParams']['filePath']
+    indexFilePath = PacketIndexFilePath(filePath)
+    fileStat = os.stat(filePath)
+
+    index = {}
+    for field in packetIndexFields:
+        index[field] = info[field]
+    index['packetIndexComplete'] = info.get('packetIndexComplete', True)
+    index['fileSize'] = fileStat.st_size
+    index['fileMTime'] = fileStat.st_mtime
+    index['beginningOfDataPointer'] = info['beginningOfDataPointer']
+
+    tempFilePath = indexFilePath + '.tmp'
+    try:
+        with open(tempFilePath, 'wb') as indexFile:
+            np.savez_compressed(indexFile, **index)
+        os.rename(tempFilePath, indexFilePath)
+    except (IOError, OSError):
+        print 'The packet index could not be written to %s' % indexFilePath
+    return aedat
+
+def IndexAedatDataVersion3(aedat):
+    """
+    Makes sure aedat['info'] holds a complete packet index, loading it from
+    the sidecar file and building or extending it (with a noData pass of
+    ImportAedatDataVersion3) as necessary.
+    Any range parameters (startPacket, endTime etc) in importParams are
+    ignored by the indexing pass.
+    The indexing pass only reads the packet headers and the timestamp of the
+    first event of each packet; its rate is reported, and left in
+    info['packetIndexRate'] (packets/second).
+    """
+
+    importParams = aedat['importParams']
+    usePacketIndexFile = importParams.get('packetIndexFile', True)
+
+    if usePacketIndexFile and 'packetPointers' not in aedat['info']:
+        aedat = LoadPacketIndex(aedat)
+    # An index passed in through info without this flag is taken as complete
+    if aedat['info'].get('packetIndexComplete', 'packetPointers' in aedat['info']):
+        return aedat
+
+    indexParams = dict(importParams)
+    indexParams['noData'] = True
+    for key in ('startPacket', 'endPacket', 'startTime', 'endTime', 'modPacket'):
+        indexParams.pop(key, None)
+    numPacketsBefore = len(aedat['info'].get('packetPointers', []))
+    startTime = time.time()
+    ImportAedatDataVersion3({'importParams': indexParams, 'info': aedat['info']})
+    indexTime = max(time.time() - startTime, 1e-9)
+    numPacketsIndexed = len(aedat['info']['packetPointers']) - numPacketsBefore
+    aedat['info']['packetIndexRate'] = numPacketsIndexed / indexTime
+    print 'Indexed %d packets in %.2f s: %d packets/second' \
+        % (numPacketsIndexed, indexTime, aedat['info']['packetIndexRate'])
+
+    if usePacketIndexFile:
+        aedat = SavePacketIndex(aedat)
+    return aedat
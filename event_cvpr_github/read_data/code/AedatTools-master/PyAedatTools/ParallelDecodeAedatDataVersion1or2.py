@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+"""
+This is a sub-function of importAedat.
+It decodes the DAVIS events of an aedat version 1 or 2 file on several worker
+processes, as selected by importParams['workers'].
+
+Since the events are fixed-width records, the event range is split into
+equal runs of events (i.e. aligned byte ranges of the data region), and each
+worker maps its own runs of the file. The import is done in two passes:
+    1. Each worker counts the events of each type in its runs; from these
+       counts the parent works out where every run's output goes, and
+       allocates the output columns in shared memory.
+    2. Each worker decodes its runs straight into the shared columns:
+       polarity events are decoded in full, special event timestamps are
+       copied, and the raw addresses and timestamps of APS and IMU samples
+       are copied out for the parent. The statistics of the polarity and
+       special events of each run are passed back, to be merged.
+Frames and IMU samples may straddle the runs, so the parent decodes them,
+from the samples gathered in pass 2, with DecodeAedatDataVersion1or2.
+As each run's output goes to its own slot, in run order, the result is the
+same as that of the serial import.
+"""
+
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from PyAedatTools.MemmapAedatDataVersion1or2 import MemmapAedatDataVersion1or2
+from PyAedatTools.ImportAedatDataVersion1or2 import DecodeAedatDataVersion1or2
+from PyAedatTools.ImportAedatDataVersion1or2 import ClassifyAddressesVersion1or2
+from PyAedatTools.ImportAedatDataVersion1or2 import PartitionByTypeVersion1or2
+from PyAedatTools.ImportAedatDataVersion1or2 import numTypeCodes
+from PyAedatTools.ImportAedatDataVersion1or2 import polarityTypeCode
+from PyAedatTools.ImportAedatDataVersion1or2 import specialTypeCode
+from PyAedatTools.ImportAedatDataVersion1or2 import frameTypeCode
+from PyAedatTools.ImportAedatDataVersion1or2 import imuTypeCode
+from PyAedatTools.ImportAedatDataVersion1or2 import yMask, yShiftBits
+from PyAedatTools.ImportAedatDataVersion1or2 import xMask, xShiftBits
+from PyAedatTools.ImportAedatDataVersion1or2 import polarityMask
+from PyAedatTools.UnwrapTimeStamps import UnwrapTimeStamps
+from PyAedatTools.UnwrapTimeStamps import SampleUnwrapState
+from PyAedatTools.EventStatistics import RateBinWidth
+from PyAedatTools.EventStatistics import AccumulateEventStatistics
+from PyAedatTools.EventStatistics import MergeEventStatistics
+
+# The shared output columns: (column name, ctypes type, numpy dtype)
+sharedColumnFormat = [('polarityTimeStamp', ctypes.c_uint32, 'uint32'),
+                      ('polarityY', ctypes.c_uint16, 'uint16'),
+                      ('polarityX', ctypes.c_uint16, 'uint16'),
+                      ('polarityPolarity', ctypes.c_uint8, 'bool'),
+                      ('specialTimeStamp', ctypes.c_uint32, 'uint32'),
+                      ('apsOrImuAddr', ctypes.c_uint32, 'uint32'),
+                      ('apsOrImuTs', ctypes.c_uint32, 'uint32')]
+timeStampColumnNames = ('polarityTimeStamp', 'specialTimeStamp', 'apsOrImuTs')
+
+# Set in each worker of pass 2 by InitialiseWorker
+workerColumns = {}
+
+def SharedColumnFormat(unwrapTimeStamps):
+    """
+    Returns sharedColumnFormat, with uint64 timestamp columns if the
+    timestamps are unwrapped.
+    """
+
+    if not unwrapTimeStamps:
+        return sharedColumnFormat
+    return [(name, ctypes.c_uint64, 'uint64') if name in timeStampColumnNames
+            else (name, cType, dtype)
+            for name, cType, dtype in sharedColumnFormat]
+
+def InitialiseWorker(rawColumns, columnFormat):
+    for name, cType, dtype in columnFormat:
+        workerColumns[name] = SharedColumnArray(rawColumns[name], dtype)
+
+def SharedColumnArray(rawColumn, dtype):
+    return np.frombuffer(rawColumn, 'uint8' if dtype == 'bool' else dtype).view(dtype)
+
+def ReadEventRange(task):
+    """
+    Maps one run of events, unwraps its timestamps (given the unwrap state at
+    the start of the run, if any) and applies the time window to it, 
+    returning its addresses, timestamps and type codes.
+    """
+
+    info, importParams, startEvent, numEvents, unwrapState = task[0 : 5]
+    with open(importParams['filePath'], 'rb') as fileHandle:
+        allEvents = MemmapAedatDataVersion1or2(
+            {'info': info, 'importParams': {'fileHandle': fileHandle}},
+            startEvent, numEvents)
+    allAddr = allEvents['addr']
+    allTs = allEvents['ts']
+    if unwrapState is not None:
+        allTs = UnwrapTimeStamps(allTs, state=dict(unwrapState))
+    if 'startTime' in importParams:
+        tempIndex = np.nonzero(allTs >= importParams['startTime'] * 1e6)
+        allAddr = allAddr[tempIndex]
+        allTs = allTs[tempIndex]
+    if 'endTime' in importParams:
+        tempIndex = np.nonzero(allTs <= importParams['endTime'] * 1e6)
+        allAddr = allAddr[tempIndex]
+        allTs = allTs[tempIndex]
+    return allAddr, allTs, ClassifyAddressesVersion1or2(allAddr)
+
+def CountEventRange(task):
+    """
+    Pass 1: returns the number of events of each type in one run.
+    """
+
+    allAddr, allTs, typeCode = ReadEventRange(task)
+    return np.bincount(typeCode, minlength=numTypeCodes)
+
+def DecodeEventRange(task):
+    """
+    Pass 2: decodes one run into the shared columns, starting at the output
+    positions worked out for it in pass 1, returning the run's statistics.
+    """
+
+    allAddr, allTs, typeCode = ReadEventRange(task)
+    wantedTypeCodes, outputPositions = task[5 : 7]
+    rateBinWidth = RateBinWidth(task[1])
+    statistics = {}
+    partition = PartitionByTypeVersion1or2(allAddr, allTs, typeCode, wantedTypeCodes)
+    del typeCode, allAddr, allTs
+
+    if polarityTypeCode in partition:
+        polarityData, polarityTs = partition.pop(polarityTypeCode)
+        start = outputPositions['polarity']
+        end = start + len(polarityTs)
+        workerColumns['polarityTimeStamp'][start : end] = polarityTs
+        workerColumns['polarityY'][start : end] \
+            = np.right_shift(np.bitwise_and(polarityData, yMask), yShiftBits)
+        workerColumns['polarityX'][start : end] \
+            = np.right_shift(np.bitwise_and(polarityData, xMask), xShiftBits)
+        workerColumns['polarityPolarity'][start : end] \
+            = np.bitwise_and(polarityData, polarityMask).astype(bool)
+        AccumulateEventStatistics(statistics, 'polarity', polarityTs,
+                                  polarity=workerColumns['polarityPolarity'][start : end],
+                                  binWidth=rateBinWidth)
+        del polarityData, polarityTs
+
+    if specialTypeCode in partition:
+        specialTs = partition.pop(specialTypeCode)[1]
+        start = outputPositions['special']
+        workerColumns['specialTimeStamp'][start : start + len(specialTs)] = specialTs
+        AccumulateEventStatistics(statistics, 'special', specialTs, binWidth=rateBinWidth)
+
+    # APS samples, then IMU samples; the order within each type is kept
+    start = outputPositions['apsOrImu']
+    for apsOrImuTypeCode in (frameTypeCode, imuTypeCode):
+        if apsOrImuTypeCode in partition:
+            apsOrImuAddr, apsOrImuTs = partition.pop(apsOrImuTypeCode)
+            workerColumns['apsOrImuAddr'][start : start + len(apsOrImuTs)] = apsOrImuAddr
+            workerColumns['apsOrImuTs'][start : start + len(apsOrImuTs)] = apsOrImuTs
+            start = start + len(apsOrImuTs)
+    return statistics
+
+def ParallelDecodeAedatDataVersion1or2(aedat, startEvent, numEvents, workers):
+    """
+    Decodes events startEvent to startEvent + numEvents - 1 of a DAVIS aedat
+    version 1 or 2 file on 'workers' processes, returning the data dict, as
+    DecodeAedatDataVersion1or2 does.
+    """
+
+    info = aedat['info']
+    importParams = aedat['importParams']
+
+    # Split the event range into a few runs per worker, to balance the load
+    numRuns = max(min(4 * workers, numEvents // 100000), 1)
+    runStarts = np.linspace(0, numEvents, numRuns + 1).astype(np.int64)
+    # The file handle can't be passed to the workers - they open their own
+    workerParams = {}
+    for key in ('filePath', 'startTime', 'endTime', 'rateBinWidth'):
+        if key in importParams:
+            workerParams[key] = importParams[key]
+    workerInfo = {'fileFormat': info['fileFormat'],
+                  'beginningOfDataPointer': info['beginningOfDataPointer']}
+    # Each run's timestamps are unwrapped from the wraps before it, which
+    # are counted here
+    unwrapTimeStamps = importParams.get('unwrapTimeStamps', True)
+    if unwrapTimeStamps:
+        allMappedTs = MemmapAedatDataVersion1or2(aedat)['ts']
+        unwrapStates = [SampleUnwrapState(allMappedTs, startEvent + runStarts[run])
+                        for run in range(numRuns)]
+        del allMappedTs
+    else:
+        unwrapStates = [None] * numRuns
+    tasks = [(workerInfo, workerParams, startEvent + runStarts[run],
+              runStarts[run + 1] - runStarts[run], unwrapStates[run])
+             for run in range(numRuns)]
+
+    wantedTypeCodes = []
+    for dataType, dataTypeCode in (('special', specialTypeCode),
+                                   ('polarity', polarityTypeCode),
+                                   ('frame', frameTypeCode),
+                                   ('imu6', imuTypeCode)):
+        if 'dataTypes' not in importParams or dataType in importParams['dataTypes']:
+            wantedTypeCodes.append(dataTypeCode)
+
+    # Pass 1: count the events of each type in each run
+    print 'Counting events on %d workers ...' % workers
+    pool = multiprocessing.Pool(workers)
+    try:
+        runCounts = np.array(pool.map(CountEventRange, tasks))
+    finally:
+        pool.close()
+        pool.join()
+    runCounts[:, [typeCode for typeCode in range(numTypeCodes)
+                  if typeCode not in wantedTypeCodes]] = 0
+
+    # Work out where each run's output goes
+    runPositions = np.zeros((numRuns + 1, numTypeCodes), np.int64)
+    runPositions[1 : ] = np.cumsum(runCounts, axis=0)
+    numApsOrImu = runCounts[:, frameTypeCode] + runCounts[:, imuTypeCode]
+    apsOrImuPositions = np.concatenate([[0], np.cumsum(numApsOrImu)])
+    columnLengths = {'polarity': runPositions[-1, polarityTypeCode],
+                     'special': runPositions[-1, specialTypeCode],
+                     'apsOrImu': apsOrImuPositions[-1]}
+
+    columnFormat = SharedColumnFormat(unwrapTimeStamps)
+    rawColumns = {}
+    for name, cType, dtype in columnFormat:
+        columnLength = [columnLengths[group] for group in columnLengths
+                        if name.startswith(group)][0]
+        # A RawArray can't be empty
+        rawColumns[name] = RawArray(cType, int(max(columnLength, 1)))
+    decodeTasks = [task + (wantedTypeCodes,
+                           {'polarity': runPositions[run, polarityTypeCode],
+                            'special': runPositions[run, specialTypeCode],
+                            'apsOrImu': apsOrImuPositions[run]})
+                   for run, task in enumerate(tasks)]
+
+    # Pass 2: decode each run into the shared columns
+    print 'Decoding events on %d workers ...' % workers
+    pool = multiprocessing.Pool(workers, InitialiseWorker, (rawColumns, columnFormat))
+    try:
+        runStatistics = pool.map(DecodeEventRange, decodeTasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    columns = {}
+    for name, cType, dtype in columnFormat:
+        columns[name] = SharedColumnArray(rawColumns[name], dtype)
+
+    # Merge
+    outputData = {}
+    if columnLengths['special'] > 0:
+        outputData['special'] = {}
+        outputData['special']['timeStamp'] \
+            = columns['specialTimeStamp'][0 : columnLengths['special']]
+    if columnLengths['polarity'] > 0:
+        outputData['polarity'] = {}
+        outputData['polarity']['timeStamp'] \
+            = columns['polarityTimeStamp'][0 : columnLengths['polarity']]
+        outputData['polarity']['y'] = columns['polarityY'][0 : columnLengths['polarity']]
+        outputData['polarity']['x'] = columns['polarityX'][0 : columnLengths['polarity']]
+        outputData['polarity']['polarity'] \
+            = columns['polarityPolarity'][0 : columnLengths['polarity']]
+    if columnLengths['apsOrImu'] > 0:
+        apsOrImuParams = dict(importParams)
+        apsOrImuParams['dataTypes'] = set(['frame', 'imu6'])
+        if 'dataTypes' in importParams:
+            apsOrImuParams['dataTypes'] &= set(importParams['dataTypes'])
+        outputData.update(DecodeAedatDataVersion1or2(
+            columns['apsOrImuAddr'][0 : columnLengths['apsOrImu']],
+            columns['apsOrImuTs'][0 : columnLengths['apsOrImu']],
+            info, apsOrImuParams))
+    else:
+        info['eventStatistics'] = {}
+    for statistics in runStatistics:
+        MergeEventStatistics(info['eventStatistics'], statistics)
+    return outputData
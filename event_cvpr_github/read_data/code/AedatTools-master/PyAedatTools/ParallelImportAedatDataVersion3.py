@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""
+This is a sub-function of importAedat.
+It imports an aedat3.x file on several worker processes, as selected by
+importParams['workers'].
+
+Given the packet index (see PacketIndex), the packets which a serial import
+would read are known up front, and since each packet header carries its
+eventNumber, so is the number of events of each type in any run of packets.
+The packets are split into runs of roughly equal size in bytes; each worker
+imports its runs with ImportAedatDataVersion3 and copies the events straight
+into output columns in shared memory, at offsets worked out from the index.
+Frames, whose size is only known once they are decoded, are passed back to
+the parent and joined there.
+
+The runs' outputs are laid out in packet order, so the result is the same as
+that of a serial import.
+"""
+
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from PyAedatTools.ImportAedatDataVersion3 import ImportAedatDataVersion3
+from PyAedatTools.ImportAedatDataVersion3 import dataTypesByEventType
+from PyAedatTools.ImportAedatDataVersion3 import columnFormatsByDataType
+from PyAedatTools.ImportAedatDataVersion3 import CropToTimeWindow
+from PyAedatTools.ImportAedatDataVersion3 import StartTimePacketIndex
+from PyAedatTools.PacketIndex import IndexAedatDataVersion3
+from PyAedatTools.EventStatistics import RateBinWidth
+from PyAedatTools.EventStatistics import MergeEventStatistics
+from PyAedatTools.FindFirstAndLastTimeStamps import FindFirstAndLastTimeStamps
+from PyAedatTools.NumEventsByType import NumEventsByType
+
+cTypesByDtype = {'bool': ctypes.c_uint8,
+                 'uint8': ctypes.c_uint8,
+                 'uint16': ctypes.c_uint16,
+                 'uint32': ctypes.c_uint32,
+                 'uint64': ctypes.c_uint64,
+                 'float32': ctypes.c_float}
+
+# Set in each worker by InitialiseWorker
+workerState = {}
+
+def SharedColumnArray(rawColumn, dtype):
+    return np.frombuffer(rawColumn, 'uint8' if dtype == 'bool' else dtype).view(dtype)
+
+def InitialiseWorker(info, rawColumns):
+    workerState['info'] = info
+    workerState['columns'] = {}
+    for dataType in rawColumns:
+        workerState['columns'][dataType] = {}
+        for name, dtype in columnFormatsByDataType[dataType]:
+            workerState['columns'][dataType][name] \
+                = SharedColumnArray(rawColumns[dataType][name], dtype)
+
+def PacketsToReadVersion3(info, importParams):
+    """
+    Returns the (1-based) numbers of the packets which ImportAedatDataVersion3
+    would read, given the packet index in info and the range parameters in
+    importParams.
+    """
+
+    packetTypes = info['packetTypes']
+    packetTimeStamps = info['packetTimeStamps']
+    numPackets = len(packetTypes)
+    startPacket = int(importParams.get('startPacket', 1))
+    endPacket = int(min(importParams.get('endPacket', numPackets), numPackets))
+    modPacket = importParams.get('modPacket', 1)
+
+    # Where startTime is given, the import starts from the earliest of the
+    # last packets of each type beginning before it
+    firstPacket = startPacket
+    if startPacket <= 1 and importParams.get('startTime', 0) > 0:
+        targetPacketIndex = StartTimePacketIndex(packetTypes, packetTimeStamps,
+                                                 importParams['startTime'] * 1e6)
+        if targetPacketIndex is not None:
+            firstPacket = targetPacketIndex + 1
+    packetNumbers = np.arange(firstPacket, endPacket + 1)
+    packetNumbers = packetNumbers[np.mod(packetNumbers, modPacket) == 0]
+
+    # Where endTime is given, the import stops after the first packet of a
+    # wanted type which begins after it
+    if 'endTime' in importParams:
+        wantedEventTypes = [eventType for eventType in dataTypesByEventType
+                            if 'dataTypes' not in importParams
+                            or dataTypesByEventType[eventType] in importParams['dataTypes']]
+        timeStamps = packetTimeStamps[packetNumbers - 1]
+        pastEndTime = np.logical_and(
+            np.in1d(packetTypes[packetNumbers - 1], wantedEventTypes),
+            np.logical_and(timeStamps > importParams['endTime'] * 1e6,
+                           timeStamps != 0x7FFFFFFF))
+        if pastEndTime.any():
+            packetNumbers = packetNumbers[0 : np.flatnonzero(pastEndTime)[0] + 1]
+    return packetNumbers
+
+def ImportPacketRange(task):
+    """
+    Imports one run of packets, and copies the events into the shared
+    columns starting at the output positions worked out for the run.
+    Returns the number of events copied of each type, the frames, and the
+    run's event statistics.
+    """
+
+    importParams, outputPositions = task
+    with open(importParams['filePath'], 'rb') as importParams['fileHandle']:
+        run = ImportAedatDataVersion3({'info': dict(workerState['info']),
+                                       'importParams': importParams})
+    runData = run.get('data', {})
+    numEvents = {}
+    for dataType in workerState['columns']:
+        if dataType in runData:
+            start = outputPositions[dataType]
+            numEvents[dataType] = len(runData[dataType]['timeStamp'])
+            for name, column in workerState['columns'][dataType].items():
+                column[start : start + numEvents[dataType]] = runData[dataType][name]
+    return numEvents, runData.get('frame'), run['info'].get('eventStatistics', {})
+
+def JoinFrames(frames):
+    """
+    Joins the frame dicts of several runs, padding the samples of each to
+    the largest frame size.
+    """
+
+    samplesShape = tuple(np.max([frame['samples'].shape[1 : ] for frame in frames], axis=0))
+    joined = {}
+    for name in frames[0]:
+        if name == 'numEvents':
+            continue
+        if name == 'samples':
+            joined[name] = np.zeros((sum(len(frame['samples']) for frame in frames), )
+                                    + samplesShape, 'uint16')
+            start = 0
+            for frame in frames:
+                samples = frame['samples']
+                joined[name][start : start + len(samples),
+                             0 : samples.shape[1],
+                             0 : samples.shape[2],
+                             0 : samples.shape[3]] = samples
+                start = start + len(samples)
+        else:
+            joined[name] = np.concatenate([frame[name] for frame in frames])
+    return joined
+
+def ParallelImportAedatDataVersion3(aedat):
+
+    info = aedat['info']
+    importParams = aedat['importParams']
+    workers = int(importParams['workers'])
+
+    # Index the file, unless that has already been done
+    aedat = IndexAedatDataVersion3(aedat)
+    info = aedat['info']
+
+    packetNumbers = PacketsToReadVersion3(info, importParams)
+    packetIndices = packetNumbers - 1
+    packetTypes = info['packetTypes'][packetIndices]
+    packetEventNumbers = info['packetEventNumbers'][packetIndices].astype(np.int64)
+
+    # Split the packets into a few runs per worker, of roughly equal size
+    importParams['fileHandle'].seek(0, 2)
+    packetEnds = np.append(info['packetPointers'][1 : ].astype(np.int64),
+                           importParams['fileHandle'].tell())
+    packetSizes = packetEnds[packetIndices] - info['packetPointers'][packetIndices].astype(np.int64)
+    numRuns = max(min(4 * workers, len(packetNumbers)), 1)
+    runStarts = np.searchsorted(np.cumsum(packetSizes),
+                                np.linspace(0, packetSizes.sum(), numRuns + 1)[1 : -1])
+    runStarts = np.unique(np.concatenate([[0], runStarts, [len(packetNumbers)]]))
+    runStarts = runStarts[runStarts <= len(packetNumbers)]
+    numRuns = len(runStarts) - 1
+    runIndices = np.repeat(np.arange(numRuns), np.diff(runStarts))
+
+    # Count the events of each type in each run, to find its output positions
+    wantedDataTypes = [dataType for dataType in columnFormatsByDataType
+                       if 'dataTypes' not in importParams
+                       or dataType in importParams['dataTypes']]
+    outputPositions = {}
+    rawColumns = {}
+    for eventType, dataType in dataTypesByEventType.items():
+        if dataType not in wantedDataTypes:
+            continue
+        runNumEvents = np.zeros(numRuns, np.int64)
+        np.add.at(runNumEvents, runIndices[packetTypes == eventType],
+                  packetEventNumbers[packetTypes == eventType])
+        outputPositions[dataType] = np.concatenate([[0], np.cumsum(runNumEvents)])
+        numEvents = int(outputPositions[dataType][-1])
+        if numEvents > 0:
+            rawColumns[dataType] = {}
+            for name, dtype in columnFormatsByDataType[dataType]:
+                rawColumns[dataType][name] = RawArray(cTypesByDtype[dtype], numEvents)
+
+    runParams = dict(importParams)
+    for key in ('fileHandle', 'startTime', 'endTime', 'workers'):
+        runParams.pop(key, None)
+    tasks = []
+    for run in range(numRuns):
+        params = dict(runParams)
+        params['startPacket'] = int(packetNumbers[runStarts[run]])
+        params['endPacket'] = int(packetNumbers[runStarts[run + 1] - 1])
+        tasks.append((params, dict((dataType, int(outputPositions[dataType][run]))
+                                   for dataType in outputPositions)))
+
+    print 'Importing %d packets in %d runs on %d workers ...' \
+        % (len(packetNumbers), numRuns, workers)
+    pool = multiprocessing.Pool(workers, InitialiseWorker, (info, rawColumns))
+    try:
+        results = pool.map(ImportPacketRange, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    outputData = {}
+    for dataType in rawColumns:
+        outputData[dataType] = {}
+        for name, dtype in columnFormatsByDataType[dataType]:
+            column = SharedColumnArray(rawColumns[dataType][name], dtype)
+            # A packet cut short at the end of the file holds fewer events
+            # than its header says, leaving a gap after that run's events
+            numEventsByRun = [result[0].get(dataType, 0) for result in results]
+            if sum(numEventsByRun) < len(column):
+                column = np.concatenate(
+                    [column[outputPositions[dataType][run]
+                            : outputPositions[dataType][run] + numEventsByRun[run]]
+                     for run in range(numRuns)])
+            outputData[dataType][name] = column
+        if len(outputData[dataType]['timeStamp']) == 0:
+            del outputData[dataType]
+    frames = [result[1] for result in results if result[1] is not None]
+    if len(frames) > 0:
+        outputData['frame'] = JoinFrames(frames)
+
+    # The statistics of the runs add up to those of a serial import
+    statistics = {}
+    for result in results:
+        MergeEventStatistics(statistics, result[2])
+    info['eventStatistics'] = statistics
+
+    # The runs are read without the time window, so the events are cut to it
+    # here, as a serial import cuts them
+    if 'startTime' in importParams or 'endTime' in importParams:
+        CropToTimeWindow(outputData, statistics, importParams.get('startTime', 0) * 1e6,
+                         importParams.get('endTime', np.inf) * 1e6, RateBinWidth(importParams))
+
+    aedat['data'] = outputData
+    aedat = NumEventsByType(aedat)
+    aedat = FindFirstAndLastTimeStamps(aedat)
+    return aedat
@@ -6,17 +6,14 @@ newX newY
 Polarity events only, to start with
 """
 import numpy as np
+from PyAedatTools.EventStream import EventStream
 
 def Reshape(aedat, newX, newY):
     # ... actually just crop for now
-    inXLogical = aedat['data']['polarity']['x'] < newX
-    inYLogical = aedat['data']['polarity']['y'] < newY
-    inLogical = np.bitwise_and(inXlogical, inYLogical)
-    aedat['data']['polarity']['x']          = aedat['data']['polarity']['x'][inLogical]
-    aedat['data']['polarity']['y']          = aedat['data']['polarity']['y'][inLogical]
-    aedat['data']['polarity']['polarity']   = aedat['data']['polarity']['polarity'][inLogical]
-    aedat['data']['polarity']['timeStamp']  = aedat['data']['polarity']['timeStamp'][inLogical]
-    aedat['data']['polarity']['numEvents']  = len(aedat['data']['polarity']['x'])
+    polarity = EventStream.fromDict('polarity', aedat['data']['polarity'])
+    inLogical = np.logical_and(polarity['x'] < newX, polarity['y'] < newY)
+    # Each column is copied once, by the crop itself
+    aedat['data']['polarity'] = polarity[inLogical].toDict()
     #reset needs handling
     
     return aedat
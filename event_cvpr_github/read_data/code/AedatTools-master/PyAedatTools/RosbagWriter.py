@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+RosbagWriter
+
+A writer for ROS bag files (format 2.0), in pure Python and numpy, so that
+ExportRosbag needs no ROS install.
+
+A bag is a sequence of records, each a header (of name=value fields) and
+data:
+    #ROSBAG V2.0
+    bag header record - where the index is, padded to 4096 bytes
+    chunk records - each holding connection records and message data records,
+        and followed by an index data record per connection in the chunk,
+        giving the time and offset of each message
+    connection records, then a chunk info record per chunk - the index
+Chunks are written uncompressed.
+
+writeMessages takes any number of messages of one connection, already
+serialised and all of the same length, as the rows of a 2D uint8 array;
+their records are laid out with a numpy structured dtype, so that each chunk
+is built and written in one go, whatever the number of messages in it.
+"""
+
+import struct
+import numpy as np
+
+bagMagic = '#ROSBAG V2.0\n'
+bagHeaderLength = 4096
+
+opMessageData = 0x02
+opBagHeader = 0x03
+opIndexData = 0x04
+opChunk = 0x05
+opChunkInfo = 0x06
+opConnection = 0x07
+
+def PackHeader(fields):
+    """
+    fields is a list of (name, value) pairs of strings.
+    """
+
+    return ''.join(struct.pack('<i', len(name) + 1 + len(value)) + name + '=' + value
+                   for name, value in fields)
+
+def PackRecord(fields, data):
+    header = PackHeader(fields)
+    return struct.pack('<i', len(header)) + header + struct.pack('<i', len(data)) + data
+
+def PackTime(timeNs):
+    return struct.pack('<II', timeNs // 1000000000, timeNs % 1000000000)
+
+def MessageRecordFormat(messageLength):
+    """
+    The layout of a message data record holding a message of messageLength
+    bytes; the header fields are op, conn and time.
+    """
+
+    return np.dtype([('headerLength', '<i4'),
+                     ('opLength', '<i4'), ('opName', 'S3'), ('op', 'u1'),
+                     ('connLength', '<i4'), ('connName', 'S5'), ('conn', '<i4'),
+                     ('timeLength', '<i4'), ('timeName', 'S5'),
+                     ('secs', '<u4'), ('nsecs', '<u4'),
+                     ('dataLength', '<i4'), ('data', 'u1', (messageLength,))])
+
+indexEntryFormat = np.dtype([('secs', '<u4'), ('nsecs', '<u4'), ('offset', '<i4')])
+
+class RosbagWriter(object):
+
+    def __init__(self, filePath, chunkSize=768 * 1024):
+        """
+        chunkSize is the size (bytes) beyond which a chunk is closed; each
+        chunk holds at least one message.
+        """
+
+        self.fileHandle = open(filePath, 'wb')
+        self.chunkSize = chunkSize
+        # Connection records, by connection number
+        self.connections = []
+        self.connectionsWritten = set()
+        # (chunk position, start time, end time, {connection: count}), times in ns
+        self.chunkInfos = []
+        self.fileHandle.write(bagMagic)
+        self.writeBagHeader(0)
+
+    def writeBagHeader(self, indexPosition):
+        fields = [('op', chr(opBagHeader)),
+                  ('index_pos', struct.pack('<Q', indexPosition)),
+                  ('conn_count', struct.pack('<i', len(self.connections))),
+                  ('chunk_count', struct.pack('<i', len(self.chunkInfos)))]
+        headerLength = len(PackHeader(fields))
+        self.fileHandle.write(PackRecord(fields, ' ' * (bagHeaderLength - headerLength - 8)))
+
+    def addConnection(self, topic, messageType, md5sum, messageDefinition):
+        """
+        Returns the number of the new connection.
+        """
+
+        connection = len(self.connections)
+        connectionHeader = PackHeader([('topic', topic), ('type', messageType),
+                                       ('md5sum', md5sum),
+                                       ('message_definition', messageDefinition)])
+        self.connections.append(PackRecord([('op', chr(opConnection)),
+                                            ('conn', struct.pack('<i', connection)),
+                                            ('topic', topic)],
+                                           connectionHeader))
+        return connection
+
+    def writeMessages(self, connection, secs, nsecs, messageData):
+        """
+        Writes the messages of a connection. secs and nsecs are the times of
+        the messages; messageData is a (numMessages, messageLength) uint8
+        array of the serialised messages.
+        """
+
+        numMessages, messageLength = messageData.shape
+        recordFormat = MessageRecordFormat(messageLength)
+        messagesPerChunk = max(self.chunkSize // recordFormat.itemsize, 1)
+        for chunkStart in range(0, numMessages, messagesPerChunk):
+            chunkEnd = min(chunkStart + messagesPerChunk, numMessages)
+            records = np.empty(chunkEnd - chunkStart, recordFormat)
+            records['headerLength'] = recordFormat.itemsize - messageLength - 8
+            records['opLength'] = 4
+            records['opName'] = 'op='
+            records['op'] = opMessageData
+            records['connLength'] = 9
+            records['connName'] = 'conn='
+            records['conn'] = connection
+            records['timeLength'] = 13
+            records['timeName'] = 'time='
+            records['secs'] = secs[chunkStart : chunkEnd]
+            records['nsecs'] = nsecs[chunkStart : chunkEnd]
+            records['dataLength'] = messageLength
+            records['data'] = messageData[chunkStart : chunkEnd]
+            self.writeChunk(connection, records)
+
+    def writeChunk(self, connection, records):
+        # The connection record goes before the first message of the connection
+        if connection in self.connectionsWritten:
+            connectionRecord = ''
+        else:
+            connectionRecord = self.connections[connection]
+            self.connectionsWritten.add(connection)
+        chunkData = connectionRecord + records.tostring()
+
+        index = np.empty(len(records), indexEntryFormat)
+        index['secs'] = records['secs']
+        index['nsecs'] = records['nsecs']
+        index['offset'] = len(connectionRecord) + np.arange(len(records)) * records.dtype.itemsize
+        times = records['secs'].astype(np.uint64) * 1000000000 + records['nsecs']
+
+        chunkPosition = self.fileHandle.tell()
+        self.fileHandle.write(PackRecord([('op', chr(opChunk)),
+                                          ('compression', 'none'),
+                                          ('size', struct.pack('<I', len(chunkData)))],
+                                         chunkData))
+        self.fileHandle.write(PackRecord([('op', chr(opIndexData)),
+                                          ('ver', struct.pack('<i', 1)),
+                                          ('conn', struct.pack('<i', connection)),
+                                          ('count', struct.pack('<i', len(records)))],
+                                         index.tostring()))
+        self.chunkInfos.append((chunkPosition, int(times.min()), int(times.max()),
+                                {connection: len(records)}))
+
+    def close(self):
+        """
+        Writes the index and the bag header, and closes the file.
+        """
+
+        indexPosition = self.fileHandle.tell()
+        for connectionRecord in self.connections:
+            self.fileHandle.write(connectionRecord)
+        for chunkPosition, startTime, endTime, counts in self.chunkInfos:
+            self.fileHandle.write(PackRecord(
+                [('op', chr(opChunkInfo)),
+                 ('ver', struct.pack('<i', 1)),
+                 ('chunk_pos', struct.pack('<Q', chunkPosition)),
+                 ('start_time', PackTime(startTime)),
+                 ('end_time', PackTime(endTime)),
+                 ('count', struct.pack('<i', len(counts)))],
+                ''.join(struct.pack('<ii', connection, counts[connection])
+                        for connection in sorted(counts))))
+        self.fileHandle.seek(len(bagMagic))
+        self.writeBagHeader(indexPosition)
+        self.fileHandle.close()
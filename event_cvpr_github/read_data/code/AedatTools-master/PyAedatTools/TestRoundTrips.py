@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+
+"""
+TestRoundTrips
+
+Regression tests which write a synthetic recording with ExportAedat2 or
+ExportAedat3, read it back in the ways PyAedatTools offers, and check that
+every way gives the same data.
+
+Run them from the AedatTools-master directory:
+
+    python -m unittest PyAedatTools.TestRoundTrips
+
+The tests of EstimateDelta need PyEDI, which is looked for at the top of the
+repository if it isn't already importable.
+"""
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import numpy as np
+from PyAedatTools.ImportAedat import ImportAedat
+from PyAedatTools.ImportAedatChunks import ImportAedatChunks
+from PyAedatTools.ExportAedat2 import ExportAedat2
+from PyAedatTools.ExportAedat2 import accelScale
+from PyAedatTools.ExportAedat2 import gyroScale
+from PyAedatTools.ExportAedat2 import temperatureScale
+from PyAedatTools.ExportAedat2 import temperatureOffset
+from PyAedatTools.ExportAedat3 import ExportAedat3
+from PyAedatTools.AccumulateEvents import AccumulateEvents
+from PyAedatTools.ExportColumnar import ExportColumnar
+from PyAedatTools.ExportColumnar import pa
+from PyAedatTools.ImportColumnar import ImportColumnar
+from PyAedatTools.EventStore import ExportEventStore
+from PyAedatTools.EventStore import ImportEventStore
+from PyAedatTools.EventStore import h5py
+
+try:
+    import PyEDI
+except ImportError:
+    # PyEDI sits at the top of the repository, next to read_data
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                 '..', '..', '..', '..')))
+    try:
+        import PyEDI
+    except ImportError:
+        PyEDI = None
+if PyEDI is not None:
+    from PyEDI.EstimateDelta import EstimateDelta
+    from PyEDI.EstimateDelta import EventIntegralHistogram
+    from PyEDI.EstimateDelta import LatentFrameEnergy
+    from PyEDI.EstimateDelta import LatentFrameEnergies
+
+def SyntheticData(seed=0, numEvents=20000, numFrames=4, numImuSamples=6, width=24, height=18):
+    """
+    A recording of 0.2 s, with the layout of aedat['data']: random polarity
+    events, frames 40 ms apart, IMU samples (on the grid of values an aedat 2
+    file can hold) and a few special events.
+    """
+
+    rng = np.random.RandomState(seed)
+    polarity = {'timeStamp': np.sort(rng.randint(1000, 200000, numEvents)).astype(np.uint64),
+                'x': rng.randint(0, width, numEvents).astype(np.uint16),
+                'y': rng.randint(0, height, numEvents).astype(np.uint16),
+                'polarity': rng.randint(0, 2, numEvents).astype(bool)}
+    frameStarts = (np.arange(numFrames) * 40000 + 10000).astype(np.uint64)
+    frame = {'samples': rng.randint(0, 1024, (numFrames, height, width)).astype(np.uint16),
+             'timeStampStart': frameStarts,
+             'timeStampEnd': frameStarts + 5000,
+             'xLength': np.full(numFrames, width, np.uint16),
+             'yLength': np.full(numFrames, height, np.uint16),
+             'xPosition': np.zeros(numFrames, np.uint16),
+             'yPosition': np.zeros(numFrames, np.uint16)}
+    imu6 = {'timeStamp': np.sort(rng.choice(np.arange(2000, 199000, 7), numImuSamples, False)).astype(np.uint64)}
+    for name in ('accelX', 'accelY', 'accelZ'):
+        imu6[name] = (rng.randint(-8000, 8000, numImuSamples) / accelScale).astype(np.float32)
+    for name in ('gyroX', 'gyroY', 'gyroZ'):
+        imu6[name] = (rng.randint(-8000, 8000, numImuSamples) / gyroScale).astype(np.float32)
+    imu6['temperature'] = (rng.randint(-3000, 3000, numImuSamples) / temperatureScale
+                           + temperatureOffset).astype(np.float32)
+    special = {'timeStamp': np.array([5003, 90001, 170009], np.uint64)}
+    return {'polarity': polarity, 'frame': frame, 'imu6': imu6, 'special': special}
+
+def TimeWindow(data, startTime, endTime):
+    """
+    The events of data (frames, by their start timestamps) from startTime to
+    endTime (in seconds), found with a mask over the timestamps.
+    """
+
+    window = {}
+    for dataType in data:
+        typeData = data[dataType]
+        timeStamps = typeData['timeStampStart' if dataType == 'frame' else 'timeStamp']
+        keepLogical = (timeStamps >= startTime * 1e6) & (timeStamps <= endTime * 1e6)
+        if keepLogical.any():
+            window[dataType] = dict((name, np.asarray(typeData[name])[keepLogical])
+                                    for name in typeData if name != 'numEvents')
+    return window
+
+def JoinChunks(chunks):
+    """
+    The data of a series of chunks (e.g. from ImportAedatChunks), joined.
+    """
+
+    pieces = {}
+    for chunk in chunks:
+        for dataType in chunk['data']:
+            pieces.setdefault(dataType, []).append(chunk['data'][dataType])
+    return dict((dataType, dict((name, np.concatenate([piece[name] for piece in pieces[dataType]]))
+                                for name in pieces[dataType][0] if name != 'numEvents'))
+                for dataType in pieces)
+
+class RoundTripTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertDataEqual(self, expected, actual, exact=True):
+        """
+        Checks that actual holds the data types of expected, and the columns
+        of each (apart from numEvents) with the same values - and, if exact,
+        of the same dtypes. Otherwise floats need only agree to the
+        precision of the files, and aedat3 frames may have a colour channel
+        axis.
+        """
+
+        self.assertEqual(sorted(expected), sorted(actual))
+        for dataType in expected:
+            for name in expected[dataType]:
+                if name == 'numEvents':
+                    continue
+                expectedColumn = np.asarray(expected[dataType][name])
+                actualColumn = np.asarray(actual[dataType][name])
+                message = '%s %s' % (dataType, name)
+                if exact:
+                    self.assertEqual(expectedColumn.dtype, actualColumn.dtype, message)
+                    self.assertEqual(expectedColumn.shape, actualColumn.shape, message)
+                elif name == 'samples' and actualColumn.size == expectedColumn.size:
+                    actualColumn = actualColumn.reshape(expectedColumn.shape)
+                if expectedColumn.dtype.kind == 'f' and not exact:
+                    self.assertTrue(np.allclose(expectedColumn, actualColumn, atol=1e-4), message)
+                else:
+                    self.assertTrue(np.array_equal(expectedColumn, actualColumn), message)
+
+class TestAedat2RoundTrip(RoundTripTestCase):
+
+    windows = ((0.02, 0.12), (0.0, 0.001), (0.1, 0.1), (0.13, 0.3))
+
+    def setUp(self):
+        RoundTripTestCase.setUp(self)
+        self.data = SyntheticData()
+        self.filePath = os.path.join(self.directory, 'synthetic.aedat')
+        ExportAedat2({'info': {'source': 'Davis240C'},
+                      'exportParams': {'filePath': self.filePath},
+                      'data': self.data})
+
+    def importData(self, **importParams):
+        importParams['filePath'] = self.filePath
+        return ImportAedat({'importParams': importParams})['data']
+
+    def testSerial(self):
+        self.assertDataEqual(self.data, self.importData(), exact=False)
+
+    def testMemoryMap(self):
+        self.assertDataEqual(self.importData(), self.importData(memoryMap=True))
+
+    def testWorkers(self):
+        self.assertDataEqual(self.importData(), self.importData(workers=2))
+
+    def testTimeWindow(self):
+        data = self.importData()
+        for startTime, endTime in self.windows:
+            expected = TimeWindow(data, startTime, endTime)
+            self.assertDataEqual(expected, self.importData(startTime=startTime, endTime=endTime))
+            self.assertDataEqual(expected, self.importData(startTime=startTime, endTime=endTime,
+                                                           memoryMap=True))
+            self.assertDataEqual(expected, self.importData(startTime=startTime, endTime=endTime,
+                                                           workers=2))
+
+class TestAedat3RoundTrip(RoundTripTestCase):
+
+    windows = TestAedat2RoundTrip.windows
+
+    def setUp(self):
+        RoundTripTestCase.setUp(self)
+        self.data = SyntheticData()
+        self.filePath = os.path.join(self.directory, 'synthetic.aedat')
+        ExportAedat3({'info': {'source': 'Davis240C'},
+                      'exportParams': {'filePath': self.filePath, 'packetSize': 1000},
+                      'data': self.data})
+
+    def importData(self, **importParams):
+        importParams['filePath'] = self.filePath
+        return ImportAedat({'importParams': importParams})['data']
+
+    def testSerial(self):
+        data = self.importData(packetIndexFile=False)
+        self.assertDataEqual(self.data, data, exact=False)
+        # All the events written are valid
+        for dataType in data:
+            self.assertTrue(data[dataType]['valid'].all())
+
+    def testSidecarIndex(self):
+        self.assertTrue(os.path.isfile(self.filePath + '.index.npz'))
+        self.assertDataEqual(self.importData(packetIndexFile=False), self.importData())
+        for startTime, endTime in self.windows:
+            self.assertDataEqual(self.importData(startTime=startTime, endTime=endTime,
+                                                 packetIndexFile=False),
+                                 self.importData(startTime=startTime, endTime=endTime))
+
+    def testWorkers(self):
+        self.assertDataEqual(self.importData(), self.importData(workers=2))
+        for startTime, endTime in self.windows:
+            self.assertDataEqual(self.importData(startTime=startTime, endTime=endTime),
+                                 self.importData(startTime=startTime, endTime=endTime,
+                                                 workers=2))
+
+    def testTimeWindow(self):
+        data = self.importData()
+        for startTime, endTime in self.windows:
+            self.assertDataEqual(TimeWindow(data, startTime, endTime),
+                                 self.importData(startTime=startTime, endTime=endTime))
+
+class TestImportAedatChunks(RoundTripTestCase):
+
+    chunkParams = ({'chunkEvents': 3000}, {'chunkEvents': 1}, {'chunkDuration': 0.03})
+
+    def setUp(self):
+        RoundTripTestCase.setUp(self)
+        self.data = SyntheticData()
+        self.aedat2FilePath = os.path.join(self.directory, 'synthetic2.aedat')
+        ExportAedat2({'info': {'source': 'Davis240C'},
+                      'exportParams': {'filePath': self.aedat2FilePath},
+                      'data': self.data})
+        self.aedat3FilePath = os.path.join(self.directory, 'synthetic3.aedat')
+        ExportAedat3({'info': {'source': 'Davis240C'},
+                      'exportParams': {'filePath': self.aedat3FilePath, 'packetSize': 1000},
+                      'data': self.data})
+
+    def checkChunks(self, filePath, **importParams):
+        importParams['filePath'] = filePath
+        data = ImportAedat({'importParams': dict(importParams)})['data']
+        for chunkParams in self.chunkParams:
+            chunkParams = dict(chunkParams, **importParams)
+            self.assertDataEqual(data, JoinChunks(ImportAedatChunks({'importParams': chunkParams})))
+
+    def testAedat2(self):
+        self.checkChunks(self.aedat2FilePath)
+        self.checkChunks(self.aedat2FilePath, subtractResetRead=False)
+
+    def testAedat3(self):
+        self.checkChunks(self.aedat3FilePath)
+
+    def testChunkDurationWithPacketsOutOfOrder(self):
+        # Swap pairs of neighbouring packets, so that the packets' first
+        # timestamps go back and forth, as where several types interleave
+        with open(self.aedat3FilePath, 'rb') as fileHandle:
+            contents = fileHandle.read()
+        dataStart = contents.index('#!END-HEADER\r\n') + len('#!END-HEADER\r\n')
+        packets = []
+        position = dataStart
+        while position < len(contents):
+            eventSize = struct.unpack('<i', contents[position + 4 : position + 8])[0]
+            eventNumber = struct.unpack('<i', contents[position + 20 : position + 24])[0]
+            packets.append(contents[position : position + 28 + eventSize * eventNumber])
+            position += len(packets[-1])
+        for packetIndex in range(0, len(packets) - 1, 2):
+            packets[packetIndex], packets[packetIndex + 1] = packets[packetIndex + 1], packets[packetIndex]
+        filePath = os.path.join(self.directory, 'outOfOrder.aedat')
+        with open(filePath, 'wb') as fileHandle:
+            fileHandle.write(contents[0 : dataStart] + ''.join(packets))
+
+        chunkDuration = 0.03
+        chunks = list(ImportAedatChunks({'importParams': {'filePath': filePath,
+                                                          'chunkDuration': chunkDuration}}))
+        self.assertDataEqual(ImportAedat({'importParams': {'filePath': filePath}})['data'],
+                             JoinChunks(chunks))
+        # Each chunk ends at the first packet starting chunkDuration after it
+        # began, going by the latest packet timestamp so far
+        latestTimeStamps = np.maximum.accumulate(chunks[0]['info']['packetTimeStamps'])
+        for chunk in chunks:
+            startPacket = chunk['importParams']['startPacket']
+            endPacket = chunk['importParams']['endPacket']
+            endTimeStamp = latestTimeStamps[startPacket - 1] + chunkDuration * 1e6
+            self.assertTrue(endPacket == startPacket
+                            or latestTimeStamps[endPacket - 1] < endTimeStamp)
+            if endPacket < len(latestTimeStamps):
+                self.assertTrue(latestTimeStamps[endPacket] >= endTimeStamp)
+
+def CountEvents(polarity, starts, ends, height, width, signed):
+    """
+    AccumulateEvents, one event at a time.
+    """
+
+    frames = np.zeros((len(starts), height, width), np.int32)
+    for windowIndex in range(len(starts)):
+        for eventIndex in range(starts[windowIndex], ends[windowIndex]):
+            x = polarity['x'][eventIndex]
+            y = polarity['y'][eventIndex]
+            if x < width and y < height:
+                if signed and not polarity['polarity'][eventIndex]:
+                    frames[windowIndex, y, x] -= 1
+                else:
+                    frames[windowIndex, y, x] += 1
+    return frames
+
+class TestAccumulateEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.polarity = SyntheticData(numEvents=5000)['polarity']
+        rng = np.random.RandomState(1)
+        self.eventWindows = (
+            # Back to back
+            (np.arange(0, 5000, 500), np.arange(500, 5001, 500)),
+            # Overlapping, all from one reference event, as in EDI
+            (np.full(12, 2000), np.linspace(0, 5000, 12).astype(np.int64)),
+            # Random, overlapping and out of order
+            tuple(np.sort(rng.randint(0, 5000, (2, 20)), axis=0)))
+
+    def checkWindows(self, starts, ends, height=None, width=None, signed=True):
+        frames = AccumulateEvents(self.polarity, starts, ends, 'events', height, width,
+                                  signed=signed)
+        expected = CountEvents(self.polarity, starts, np.maximum(starts, ends),
+                               frames.shape[1], frames.shape[2], signed)
+        self.assertTrue(np.array_equal(expected, frames))
+
+    def testEventWindows(self):
+        for starts, ends in self.eventWindows:
+            for signed in (True, False):
+                self.checkWindows(starts, ends, signed=signed)
+                # Events beyond the frame are dropped
+                self.checkWindows(starts, ends, 10, 15, signed)
+
+    def testTimeWindows(self):
+        timeStamps = self.polarity['timeStamp']
+        windowStarts = np.array([0, 20000, 50000, 50000, 190000])
+        windowEnds = np.array([30000, 60000, 50000, 120000, 250000])
+        frames = AccumulateEvents(self.polarity, windowStarts, windowEnds)
+        starts = np.searchsorted(timeStamps, windowStarts, 'left')
+        ends = np.searchsorted(timeStamps, windowEnds, 'left')
+        expected = CountEvents(self.polarity, starts, ends, frames.shape[1], frames.shape[2], True)
+        self.assertTrue(np.array_equal(expected, frames))
+
+    def testOut(self):
+        starts, ends = self.eventWindows[1]
+        out = np.full((len(starts), 18, 24), 7, np.int32)
+        frames = AccumulateEvents(self.polarity, starts, ends, 'events', out=out)
+        self.assertTrue(frames is out)
+        self.assertTrue(np.array_equal(CountEvents(self.polarity, starts, ends, 18, 24, True), out))
+
+@unittest.skipIf(PyEDI is None, 'PyEDI is not importable')
+class TestEstimateDelta(unittest.TestCase):
+
+    def setUp(self):
+        # A blurry frame made from a smooth latent frame and the events of a
+        # contrast threshold of 0.4, with a hot pixel
+        rng = np.random.RandomState(2)
+        height, width, numSamples = 30, 40, 60
+        steps = rng.randint(-1, 2, (numSamples, height, width)) * (rng.rand(numSamples, height, width) < 0.1)
+        self.eventIntegral = np.cumsum(steps, 0).astype(np.int32)
+        self.eventIntegral -= self.eventIntegral[numSamples // 2]
+        self.eventIntegral[:, 5, 7] = np.arange(numSamples) - numSamples // 2
+        y, x = np.mgrid[0 : height, 0 : width]
+        latent = 0.5 + 0.2 * np.sin(x / 7.0) * np.cos(y / 5.0)
+        self.blurry = latent * np.exp(0.4 * self.eventIntegral).mean(0)
+        self.edgeMap = np.abs(self.eventIntegral[numSamples // 2 + 1]
+                              - self.eventIntegral[numSamples // 2 - 1]).astype(float)
+
+    def testEnergies(self):
+        grid = np.linspace(0.05, 1.0, 101)
+        points = range(0, 101, 10)
+        energies = LatentFrameEnergies(self.blurry, EventIntegralHistogram(self.eventIntegral),
+                                       grid, points, self.edgeMap)
+        expected = [LatentFrameEnergy(self.blurry, self.eventIntegral, grid[point], self.edgeMap)
+                    for point in points]
+        self.assertTrue(np.allclose(expected, energies, rtol=1e-9))
+
+    def testBatchAgainstFibonacci(self):
+        # Without an edge map, the energy is the total variation of the
+        # latent frame, least near the contrast threshold of the events; both
+        # searches go down to a grid of 100 steps over [0.05, 1]
+        step = 0.95 / 100
+        batch = EstimateDelta(self.blurry, self.eventIntegral)
+        fibonacci = EstimateDelta(self.blurry, self.eventIntegral, search='fibonacci')
+        self.assertTrue(abs(batch - fibonacci) <= 2 * step, (batch, fibonacci))
+        self.assertTrue(abs(batch - 0.4) <= 0.1, batch)
+
+class TestColumnar(RoundTripTestCase):
+
+    windows = TestAedat2RoundTrip.windows
+
+    def setUp(self):
+        RoundTripTestCase.setUp(self)
+        filePath = os.path.join(self.directory, 'synthetic.aedat')
+        ExportAedat3({'info': {'source': 'Davis240C'},
+                      'exportParams': {'filePath': filePath},
+                      'data': SyntheticData()})
+        self.aedat = ImportAedat({'importParams': {'filePath': filePath}})
+        self.exportPath = os.path.join(self.directory, 'columnar')
+
+    def checkFormat(self, tableFormat):
+        self.aedat['exportParams'] = {'filePath': self.exportPath, 'rowGroupSize': 1000,
+                                      'format': tableFormat}
+        ExportColumnar(self.aedat)
+        data = self.aedat['data']
+        self.assertDataEqual(data, ImportColumnar({'importParams': {'filePath': self.exportPath}})['data'])
+        for startTime, endTime in self.windows:
+            imported = ImportColumnar({'importParams': {'filePath': self.exportPath,
+                                                        'startTime': startTime,
+                                                        'endTime': endTime}})
+            self.assertDataEqual(TimeWindow(data, startTime, endTime), imported['data'])
+            # Row groups outside the window are skipped
+            self.assertTrue(imported['info']['rowGroupsSkipped']['polarity'] > 0)
+
+    def testNpz(self):
+        self.checkFormat('npz')
+
+    @unittest.skipIf(pa is None, 'pyarrow is not installed')
+    def testParquet(self):
+        self.checkFormat('parquet')
+
+class TestEventStore(RoundTripTestCase):
+
+    windows = TestAedat2RoundTrip.windows
+
+    def setUp(self):
+        RoundTripTestCase.setUp(self)
+        self.filePath = os.path.join(self.directory, 'synthetic.aedat')
+        ExportAedat2({'info': {'source': 'Davis240C'},
+                      'exportParams': {'filePath': self.filePath},
+                      'data': SyntheticData()})
+        self.aedat = ImportAedat({'importParams': {'filePath': self.filePath}})
+
+    def checkStore(self, storePath):
+        data = self.aedat['data']
+        exportParams = {'filePath': storePath, 'chunkSize': 1000, 'frameChunkSize': 1}
+        ExportEventStore({'exportParams': exportParams, 'data': data})
+        self.assertDataEqual(data, ImportEventStore({'importParams': {'filePath': storePath}})['data'])
+        for startTime, endTime in self.windows:
+            imported = ImportEventStore({'importParams': {'filePath': storePath,
+                                                          'startTime': startTime,
+                                                          'endTime': endTime}})
+            self.assertDataEqual(TimeWindow(data, startTime, endTime), imported['data'])
+        imported = ImportEventStore({'importParams': {'filePath': storePath,
+                                                      'dataTypes': ['frame'],
+                                                      'frameIndices': [1, 3]}})
+        self.assertEqual(imported['info']['chunksRead']['frame'], 2)
+        self.assertTrue(np.array_equal(data['frame']['samples'][[1, 3]],
+                                       imported['data']['frame']['samples']))
+
+        # Written chunk by chunk, as it is imported
+        ExportEventStore({'exportParams': exportParams},
+                         ImportAedatChunks({'importParams': {'filePath': self.filePath,
+                                                             'chunkEvents': 3000}}))
+        self.assertDataEqual(data, ImportEventStore({'importParams': {'filePath': storePath}})['data'])
+
+    def testNpz(self):
+        self.checkStore(os.path.join(self.directory, 'synthetic.events'))
+
+    @unittest.skipIf(h5py is None, 'h5py is not installed')
+    def testHdf5(self):
+        self.checkStore(os.path.join(self.directory, 'synthetic.h5'))
+
+if __name__ == '__main__':
+    unittest.main()
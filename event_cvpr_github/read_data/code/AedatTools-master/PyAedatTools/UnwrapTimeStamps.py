@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+UnwrapTimeStamps
+
+Turns raw device timestamps, in the order the events appear in the file,
+into monotonic uint64 microsecond timestamps.
+
+Two things make raw timestamps go backwards:
+    wraps - aedat version 1 or 2 files hold 32 bit timestamps, which wrap
+        every 2^32 us (about 71 minutes). A wrap is taken to be where a
+        timestamp falls by more than half the wrap period from the one before
+        it; everything after it is moved on by the wrap period.
+    resets - after a timestamp reset (e.g. an aedat3.x TIMESTAMP_RESET
+        special event) the device counts from 0 again; everything after the
+        reset event is moved on by the reset event's timestamp, so time
+        carries on from there.
+Small steps backwards (e.g. APS samples timestamped a little behind the DVS
+events around them) are left as they are.
+
+A recording can be unwrapped a stretch at a time (e.g. chunk by chunk), by
+passing the same state dict to each call; it holds the offset reached and
+the last raw timestamp. SampleUnwrapState finds the state at any point of a
+(memory-mapped) recording, and SeekUnwrappedTimeStamp bisects on unwrapped
+timestamps, both touching only every stride'th timestamp before zooming in.
+"""
+
+import numpy as np
+
+# Timestamps are unwrapped this many at a time, which bounds the size of the
+# temporary arrays
+unwrapBlockSize = 2 ** 20
+
+def UnwrapTimeStamps(timeStamps, resetLogical=None, state=None, wrapPeriod=2 ** 32):
+    """
+    Parameters
+    ----------
+    timeStamps :
+        raw timestamps in file order (any unsigned integer dtype or byte
+        order; e.g. a view onto a memory-mapped file).
+    resetLogical :
+        optional bool array, True for each timestamp reset event.
+    state :
+        optional dict, carried from one call to the next for successive
+        stretches of the same recording; it is updated in place.
+    wrapPeriod :
+        period at which the raw timestamps wrap; None if they don't.
+
+    Returns
+    -------
+    :
+        uint64 array of unwrapped timestamps.
+    """
+
+    if state is None:
+        state = {}
+    offset = int(state.get('offset', 0))
+    previousTimeStamp = state.get('previousTimeStamp')
+    unwrapped = np.empty(len(timeStamps), 'uint64')
+
+    for blockStart in range(0, len(timeStamps), unwrapBlockSize):
+        blockEnd = blockStart + unwrapBlockSize
+        # Brought into memory (and native byte order) a block at a time
+        blockTs = np.asarray(timeStamps[blockStart : blockEnd]).astype('int64')
+        increments = np.zeros(len(blockTs), 'int64')
+        if wrapPeriod is not None:
+            if previousTimeStamp is None:
+                previousTimeStamp = blockTs[0]
+            drops = np.empty(len(blockTs), 'int64')
+            drops[0] = previousTimeStamp - blockTs[0]
+            np.subtract(blockTs[0 : -1], blockTs[1 : ], out=drops[1 : ])
+            increments[drops > wrapPeriod // 2] = wrapPeriod
+            del drops
+        if resetLogical is not None:
+            blockResets = np.asarray(resetLogical[blockStart : blockEnd], bool)
+            # Events after a reset carry on from its timestamp; a reset at
+            # the end of the block moves on the offset for the next block
+            resetIndices = np.flatnonzero(blockResets[0 : -1])
+            increments[resetIndices + 1] += blockTs[resetIndices]
+        np.cumsum(increments, out=increments)
+        increments += offset
+        unwrapped[blockStart : blockEnd] = blockTs + increments
+        offset = int(increments[-1])
+        if resetLogical is not None and blockResets[-1]:
+            offset = offset + int(blockTs[-1])
+        previousTimeStamp = int(blockTs[-1])
+
+    state['offset'] = offset
+    state['previousTimeStamp'] = previousTimeStamp
+    return unwrapped
+
+def SampleUnwrapState(timeStamps, index, stride=2 ** 12, wrapPeriod=2 ** 32):
+    """
+    Returns the state with which to unwrap timeStamps from position index
+    onwards, having accounted for the wraps before it, from every stride'th
+    timestamp (so there mustn't be more than one wrap per stride). Resets
+    aren't looked for.
+    """
+
+    state = {}
+    if index > 0:
+        sampleIndices = np.append(np.arange(0, index - 1, stride), index - 1)
+        UnwrapTimeStamps(timeStamps[sampleIndices], state=state, wrapPeriod=wrapPeriod)
+    return state
+
+def SeekUnwrappedTimeStamp(timeStamps, timeStamp, side='left', state=None,
+                           stride=2 ** 12, wrapPeriod=2 ** 32):
+    """
+    Finds where timeStamp would go in the unwrapped timestamps (as
+    np.searchsorted would), given the state at the start of timeStamps.
+    Every stride'th timestamp is unwrapped and searched, and then the stride
+    containing timeStamp. This assumes that the unwrapped timestamps are
+    monotonic.
+    """
+
+    if len(timeStamps) == 0:
+        return 0
+    sampleIndices = np.arange(0, len(timeStamps), stride)
+    sampleTs = UnwrapTimeStamps(timeStamps[sampleIndices],
+                                state=dict(state or {}), wrapPeriod=wrapPeriod)
+    block = np.searchsorted(sampleTs, timeStamp, side)
+    if block == 0:
+        return 0
+    blockStart = sampleIndices[block - 1]
+    blockState = {'offset': int(sampleTs[block - 1]) - int(timeStamps[blockStart]),
+                  'previousTimeStamp': int(timeStamps[blockStart])}
+    blockTs = UnwrapTimeStamps(timeStamps[blockStart : blockStart + stride],
+                               state=blockState, wrapPeriod=wrapPeriod)
+    return blockStart + np.searchsorted(blockTs, timeStamp, side)